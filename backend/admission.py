@@ -0,0 +1,208 @@
+"""
+Ollama 准入控制：限制同时发往模型的生成请求数，超出的请求按用户轮转排队，
+预计等待超过目标时间时立即拒绝（429/503 + Retry-After），过载时吞吐保持稳定而不是全部超时
+"""
+# 导入所需的库
+import asyncio  # 排队等待
+import math     # Retry-After 取整
+import time     # 统计排队和执行时间
+from collections import OrderedDict, deque  # 按用户轮转的等待队列
+from typing import Deque, Dict, Optional, Tuple  # 类型注解
+from fastapi import HTTPException, status  # 拒绝请求
+from config import settings  # 导入配置项
+
+
+class AdmissionTicket:
+    """
+    已获得的执行名额，生成结束后调用 release 归还（重复调用无副作用）。
+    """
+    def __init__(self, controller: "AdmissionController", background: bool = False):
+        self._controller = controller
+        self._released = False
+        self.background = background  # 后台任务的名额不计入平均执行时间
+        self.started = time.monotonic()
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release(self)
+
+
+class AdmissionController:
+    """
+    AdmissionController 在 OllamaService 前面控制并发：
+    - 同时执行的生成请求不超过 limit；
+    - 超出的请求进入按用户划分的等待队列，名额空出时在有请求的用户之间轮转分配，
+      单个用户的大量请求不会饿死其他用户；
+    - 单个用户排队数超过上限返回 429，总队列已满、预计等待超过 max_wait 或实际等待超时返回 503，
+      都带有按当前平均执行时间估算的 Retry-After；
+    - 后台任务（如对话摘要）走低优先级通道，只在没有交互请求排队且有空闲名额时执行。
+    """
+    def __init__(self, limit: int = None, max_queue: int = None,
+                 max_queue_per_user: int = None, max_wait: float = None):
+        """
+        初始化 AdmissionController。
+        :param limit: 同时执行的生成请求上限。
+        :param max_queue: 等待队列总长度上限。
+        :param max_queue_per_user: 单个用户在队列中的请求上限。
+        :param max_wait: 排队等待目标（秒），预计或实际超过时拒绝。
+        """
+        self.enabled = settings.ADMISSION_ENABLED
+        self.limit = limit or settings.OLLAMA_MAX_CONCURRENCY
+        self.max_queue = max_queue or settings.ADMISSION_MAX_QUEUE
+        self.max_queue_per_user = max_queue_per_user or settings.ADMISSION_MAX_QUEUE_PER_USER
+        self.max_wait = max_wait or settings.ADMISSION_MAX_WAIT
+        self._active = 0
+        self._queues: "OrderedDict[int, Deque[Tuple[asyncio.Future, float]]]" = OrderedDict()
+        self._queued = 0
+        self._background: Deque[asyncio.Future] = deque()  # 等待中的后台任务
+        self._service_time = 0.0  # 单个请求执行时间的滑动平均（秒）
+        self.admitted = 0  # 获得名额的请求数
+        self.rejected: Dict[str, int] = {"user_queue_full": 0, "queue_full": 0, "slo": 0, "timeout": 0}
+        self.wait_total = 0.0  # 累计排队时间（秒）
+        self.wait_max = 0.0  # 最长排队时间（秒）
+
+    async def acquire(self, user_id: int) -> AdmissionTicket:
+        """
+        获取执行名额，需要排队时按用户轮转等待；无法在目标时间内获得名额时抛出 429/503。
+        """
+        if not self.enabled or (self._active < self.limit and not self._queued):
+            return self._admit(0.0)
+        queue = self._queues.get(user_id)
+        if queue is not None and len(queue) >= self.max_queue_per_user:
+            self._reject("user_queue_full")
+        if self._queued >= self.max_queue:
+            self._reject("queue_full")
+        if self.estimated_wait(self._queued + 1) > self.max_wait:
+            self._reject("slo")
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (future, time.monotonic())
+        self._queues.setdefault(user_id, deque()).append(entry)
+        self._queued += 1
+        try:
+            # asyncio.wait 超时不会取消 future，可以区分“已获得名额”和“仍在排队”
+            await asyncio.wait({future}, timeout=self.max_wait)
+        except asyncio.CancelledError:
+            # 客户端断开：已分到的名额转交下一个请求，否则退出队列
+            if future.done():
+                self._active -= 1
+                self._dispatch()
+            else:
+                self._dequeue(user_id, entry)
+            raise
+        if not future.done():
+            self._dequeue(user_id, entry)
+            self._reject("timeout")
+        return self._admit(time.monotonic() - entry[1], counted=True)
+
+    async def acquire_background(self) -> AdmissionTicket:
+        """
+        获取后台任务的低优先级名额：交互请求排队时一直让行，不受队列上限和等待目标限制。
+        """
+        if not self.enabled or (self._active < self.limit and not self._queued and not self._background):
+            self._active += 1
+            return AdmissionTicket(self, background=True)
+        future = asyncio.get_running_loop().create_future()
+        self._background.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._active -= 1
+                self._dispatch()
+            elif future in self._background:
+                self._background.remove(future)
+            raise
+        return AdmissionTicket(self, background=True)
+
+    def estimated_wait(self, position: int) -> float:
+        """
+        按平均执行时间估算排在第 position 位的请求需要等待的秒数。
+        """
+        return position / self.limit * self._service_time
+
+    def stats(self) -> Dict[str, object]:
+        """
+        并发、队列深度和排队时间统计。
+        """
+        waited = self.admitted
+        return {
+            "limit": self.limit,
+            "active": self._active,
+            "queued": self._queued,
+            "queued_users": len(self._queues),
+            "background_queued": len(self._background),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "avg_wait_ms": self.wait_total / waited * 1000 if waited else 0.0,
+            "max_wait_ms": self.wait_max * 1000,
+            "avg_service_ms": self._service_time * 1000,
+        }
+
+    def _admit(self, waited: float, counted: bool = False) -> AdmissionTicket:
+        # 排队获得名额时 _dispatch 已经占用了名额
+        if not counted:
+            self._active += 1
+        self.admitted += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        return AdmissionTicket(self)
+
+    def _reject(self, reason: str):
+        self.rejected[reason] += 1
+        retry_after = max(1, math.ceil(self.estimated_wait(self._queued + 1)))
+        if reason == "user_queue_full":
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many pending requests, please retry later",
+                headers={"Retry-After": str(retry_after)},
+            )
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="AI service is busy, please retry later",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+    def _dequeue(self, user_id: int, entry: tuple):
+        queue = self._queues.get(user_id)
+        if queue is not None and entry in queue:
+            queue.remove(entry)
+            self._queued -= 1
+            if not queue:
+                del self._queues[user_id]
+        entry[0].cancel()
+
+    def _release(self, ticket: AdmissionTicket):
+        if not ticket.background:
+            duration = time.monotonic() - ticket.started
+            self._service_time = duration if not self._service_time else 0.8 * self._service_time + 0.2 * duration
+        self._active -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """
+        把空出的名额按用户轮转分配给等待中的请求，没有交互请求排队时再分配给后台任务。
+        """
+        while self._queues and self._active < self.limit:
+            user_id, queue = next(iter(self._queues.items()))
+            future, _ = queue.popleft()
+            self._queued -= 1
+            if queue:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            if future.done():
+                continue
+            self._active += 1
+            future.set_result(None)
+        while self._background and not self._queues and self._active < self.limit:
+            future = self._background.popleft()
+            if future.done():
+                continue
+            self._active += 1
+            future.set_result(None)
+
+
+# 创建全局准入控制实例
+admission = AdmissionController()
@@ -1,71 +1,127 @@
-from math_mcp import mcp_math_request
-
 """
 AI 本地与联网辅助服务
 """
 # 导入所需的库
-def need_internet_query(message: str) -> bool:
-    """
-    判断用户输入是否需要联网（如包含日期、星期、天气、新闻等关键词）。
-    """
-    keywords = [
-        '今天', '日期', '星期', '几号', '现在时间', '天气', '新闻', '查一下', '搜索', '百度', '谷歌', 'google', 'bing', 'stock', '股价', '汇率', '实时', '热搜', '头条'
-    ]
-    return any(k in message for k in keywords)
-import requests  # 用于发送 HTTP 请求
+import logging  # 日志
+import httpx     # 异步 HTTP 客户端（连接池 + keep-alive）
+import asyncio   # 用于异步延时操作
 import json      # 用于处理 JSON 数据
-import time      # 用于延时操作
+import hashlib   # 计算合并请求的键
 import re        # 用于正则表达式处理
-from typing import List, Dict, Any  # 类型注解
+import time      # 首 token 计时
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple  # 类型注解
 from config import settings  # 导入配置项
+from model_monitor import ModelMonitor  # 后台模型状态监控
+from kv_context import kv_context_store  # 对话 KV context 缓存
+from response_cache import response_cache  # AI 回复缓存
+from tool_router import tool_router  # 模型前的工具快速路径
+from single_flight import Flight, SingleFlight  # 合并相同的生成请求
+from ollama_pool import Endpoint, OllamaPool  # 多实例负载均衡与故障转移
+from prompt_builder import BuiltPrompt, prompt_builder  # 按 token 预算构建 prompt
+from metrics import OLLAMA_TTFT, record_generation  # 首 token 时间和生成速度指标
+from tracing import span, start_span  # 请求追踪
+
+logger = logging.getLogger(__name__)
+
+
+class ThinkTagFilter:
+    """
+    增量过滤 <think> 标签，用于流式输出。
+    标签可能被拆分在多个分片中，未能确定的尾部会暂存到下一个分片再判断。
+    """
+    OPEN_TAG = "<think>"
+    CLOSE_TAG = "</think>"
+
+    def __init__(self):
+        self.in_think = False  # 当前是否处于 <think> 块内
+        self.buffer = ""  # 尚未确定是否为标签的暂存文本
+        self.started = False  # 是否已输出过可见内容（用于去除开头空白）
+
+    @staticmethod
+    def _partial_suffix(text: str, tag: str) -> int:
+        """
+        返回 text 末尾与 tag 前缀重合的最大长度。
+        """
+        for size in range(min(len(text), len(tag) - 1), 0, -1):
+            if tag.startswith(text[-size:]):
+                return size
+        return 0
+
+    def feed(self, chunk: str) -> str:
+        """
+        输入一个分片，返回可以立即输出的可见文本。
+        :param chunk: 模型输出的文本分片。
+        :return: 过滤后的可见文本。
+        """
+        text = self.buffer + chunk
+        self.buffer = ""
+        output = ""
+        while text:
+            tag = self.CLOSE_TAG if self.in_think else self.OPEN_TAG
+            index = text.find(tag)
+            if index >= 0:
+                if not self.in_think:
+                    output += text[:index]
+                text = text[index + len(tag):]
+                self.in_think = not self.in_think
+                continue
+            keep = self._partial_suffix(text, tag)
+            if not self.in_think:
+                output += text[:len(text) - keep]
+            self.buffer = text[len(text) - keep:]
+            break
+        if not self.started:
+            output = output.lstrip()
+            self.started = bool(output)
+        return output
+
+    def flush(self) -> str:
+        """
+        流结束时输出暂存的剩余文本（未闭合的 <think> 块会被丢弃）。
+        """
+        rest = "" if self.in_think else self.buffer
+        self.buffer = ""
+        if not self.started:
+            rest = rest.lstrip()
+        return rest
+
 
 class OllamaService:
     """
     OllamaService 用于与 Ollama AI 模型服务进行交互，生成对话回复。
+    请求经 OllamaPool 分发到多个 Ollama 实例，每个实例复用各自的连接池，不阻塞事件循环。
     """
-    def __init__(self, base_url: str = None, model: str = None):
+    def __init__(self, base_urls: List[str] = None, model: str = None):
         """
         初始化 OllamaService。
-        :param base_url: Ollama 服务的基础 URL。
+        :param base_urls: Ollama 实例的基础 URL 列表。
         :param model: 使用的模型名称。
         """
-        self.base_url = base_url or settings.OLLAMA_BASE_URL
         self.model = model or settings.OLLAMA_MODEL
-        self.api_url = f"{self.base_url}/api/generate"  # 生成接口地址
+        self.pool = OllamaPool(base_urls)  # 多实例负载均衡
+        self.pool.register_metrics()
+        self.monitor = ModelMonitor(self)  # 后台模型状态监控（同时是实例健康检查）
+        self.flights = SingleFlight(settings.SINGLE_FLIGHT_ENABLED)  # 合并同时进行的相同生成
 
-    def wait_for_model_ready(self, max_retries: int = 3) -> bool:
+    def unavailable_reason(self) -> str:
         """
-        检查模型是否准备就绪，最多重试 max_retries 次。
-        :param max_retries: 最大重试次数。
-        :return: 模型可用返回 True，否则 False。
+        根据后台监控的缓存状态判断模型是否不可用，不发起任何请求。
+        :return: 不可用时返回提示文本，否则返回 None。
         """
-        for attempt in range(max_retries):
-            try:
-                payload = {
-                    "model": self.model,
-                    "prompt": "你好",  # 用于测试模型是否可用
-                    "stream": False
-                }
-                response = requests.post(
-                    self.api_url,
-                    json=payload,
-                    headers={"Content-Type": "application/json"},
-                    timeout=30
-                )
-                if response.status_code == 200:
-                    result = response.json()
-                    # 如果 done_reason 不是 load，说明模型已加载完成
-                    if result.get("done_reason") != "load":
-                        return True
-                    else:
-                        time.sleep(5)
-                else:
-                    time.sleep(2)
-            except Exception as e:
-                # 只保留错误日志
-                print(f"❌ 模型测试异常: {str(e)}")
-                time.sleep(2)
-        return False
+        status = self.monitor.status
+        if not status["checked"]:
+            return None  # 尚未完成首次检查，直接尝试生成
+        if not status["connected"]:
+            return "无法连接到Ollama服务，请确保Ollama正在运行。"
+        if not status["model_available"]:
+            return f"抱歉，AI模型 {self.model} 不可用，请先下载该模型。"
+        return None
+
+    async def close(self):
+        """
+        关闭所有实例的连接池，应用关闭时调用。
+        """
+        await self.pool.close()
 
     def strip_think_tags(self, text: str) -> str:
         """
@@ -75,81 +131,320 @@ class OllamaService:
         """
         return re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL).strip()
 
-    def generate_response(self, message: str, conversation_history: List[Dict[str, str]] = None) -> str:
-        # 1. 优先MCP数学计算
-        mcp_result = mcp_math_request(message)
-        if mcp_result["status"] == "success":
-            return f"答案：{mcp_result['result']}"
-        elif mcp_result["status"] == "error":
-            return f"数学计算出错：{mcp_result['reason']}"
-        # 2. 其他情况（not_applicable）继续走大模型
+    def build_prompt(self, message: str, conversation_history: List[Dict[str, str]] = None) -> BuiltPrompt:
+        """
+        在模型的 token 预算内拼接对话历史（从最新的消息开始装入）和当前消息，生成模型输入。
+        :param message: 当前用户消息。
+        :param conversation_history: 对话历史（可选）。
+        :return: 构建结果（prompt 文本和 token 数）。
+        """
+        return prompt_builder.build(self.model, message, conversation_history)
+
+    def model_options(self) -> Dict[str, Any]:
+        """
+        随请求发送的模型参数：num_ctx 与 prompt 预算使用同一个上下文长度。
+        """
+        return {"num_ctx": prompt_builder.context_size(self.model)}
+
+    async def build_payload(self, message: str, conversation_history: List[Dict[str, str]] = None,
+                            conversation_id: int = None, stream: bool = False) -> Tuple[Dict[str, Any], BuiltPrompt]:
+        """
+        构建 /api/generate 请求体。开启 OLLAMA_KV_REUSE 且对话有可复用的 context 时，
+        只发送新消息并附带 context，模型无需重新预填充历史。
+        :param message: 当前用户消息。
+        :param conversation_history: 对话历史（可选）。
+        :param conversation_id: 对话ID（可选，用于查找 context）。
+        :param stream: 是否流式返回。
+        :return: (请求体字典, prompt 构建结果)
+        """
+        payload = {"model": self.model, "stream": stream, "options": self.model_options()}
+        context = None
+        if settings.OLLAMA_KV_REUSE and conversation_id:
+            context = await kv_context_store.get(conversation_id, self.model)
+        if context:
+            prompt = self.build_prompt(message)
+            # context 加上新消息超出预算时不再复用，改为在预算内重新装入历史
+            if len(context) + prompt.tokens > prompt_builder.budget(self.model):
+                context = None
+        if context:
+            payload["context"] = context
+        else:
+            prompt = self.build_prompt(message, conversation_history)
+        payload["prompt"] = prompt.text
+        return payload, prompt
+
+    def cache_key(self, message: str, conversation_history: List[Dict[str, str]] = None) -> str:
+        """
+        计算回复缓存键（只包含预算内实际装入 prompt 的历史），未启用回复缓存时返回 None。
+        """
+        if not settings.RESPONSE_CACHE_ENABLED:
+            return None
+        _, history, _, _, _ = prompt_builder.select(self.model, message, conversation_history)
+        return response_cache.make_key(self.model, message, history)
+
+    async def update_context(self, conversation_id: int, context: List[int] = None):
+        """
+        保存本轮生成返回的 context；本轮回复未经过模型或生成失败时（context 为空）使其失效，
+        保证缓存的 context 与对话历史一致。
+        """
+        if not settings.OLLAMA_KV_REUSE or not conversation_id:
+            return
+        if context:
+            await kv_context_store.put(conversation_id, self.model, context)
+        else:
+            await kv_context_store.invalidate(conversation_id)
+
+    async def fast_reply(self, message: str, conversation_history: List[Dict[str, str]] = None,
+                         use_cache: bool = True) -> Optional[str]:
+        """
+        不调用模型的回复：工具快速路径（数学计算等）或回复缓存，都没有时返回 None。
+        调用方据此决定是否需要占用模型的并发名额。
+        """
+        with span("fast_reply") as stage:
+            tool_reply = await tool_router.dispatch(message)
+            if tool_reply is not None:
+                stage.set(source="tool")
+                return tool_reply
+            cache_key = self.cache_key(message, conversation_history)
+            if cache_key and use_cache:
+                reply = await response_cache.get(cache_key)
+                if reply is not None:
+                    stage.set(source="cache")
+                return reply
+            return None
+
+    def flight_key(self, payload: Dict[str, Any]) -> str:
+        """
+        合并相同请求使用的键：完整请求体（模型、prompt、context、是否流式）的哈希。
+        """
+        material = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    async def join_in_flight(self, message: str, conversation_history: List[Dict[str, str]] = None,
+                             conversation_id: int = None, stream: bool = False) -> Optional[Flight]:
+        """
+        加入已在进行的相同生成，没有时返回 None（调用方需占用模型并发名额后再生成）。
+        加入的请求不再调用模型，也不占用并发名额；返回的 Flight 通过 generate_response /
+        generate_response_stream 的 flight 参数读取，不再读取时调用 flights.leave 放弃。
+        """
+        if not self.flights.enabled:
+            return None
+        payload, _ = await self.build_payload(message, conversation_history, conversation_id, stream=stream)
+        return self.flights.join(self.flight_key(payload))
+
+    async def _generate(self, payload: Dict[str, Any], cache_key: str = None) -> Tuple[str, Optional[List[int]]]:
+        """
+        调用一次非流式生成接口，连接失败时由 pool 换实例重试（回复完整返回前没有任何输出，重试是安全的）。
+        :return: (回复文本或错误提示, 本轮返回的 context；回复无效时为 None)
+        """
+        response = await self.pool.call(
+            self.model, lambda endpoint: endpoint.client.post("/api/generate", json=payload)
+        )
+        if response.status_code == 200:
+            result = response.json()
+            record_generation(result, "generate")
+            if "response" in result and result["response"]:
+                reply = result["response"].strip()
+                reply = self.strip_think_tags(reply)
+                if reply:
+                    if cache_key:
+                        await response_cache.put(cache_key, self.model, reply)
+                    return reply, result.get("context")
+                return "抱歉，AI没有生成有效回复。", None
+            elif result.get("done_reason") == "load":
+                return "抱歉，AI模型正在加载中，请稍后重试。", None
+            else:
+                return "抱歉，AI没有生成有效回复。", None
+        else:
+            logger.error("Ollama API错误: %s - %s", response.status_code, response.text)
+            return f"抱歉，AI服务暂时不可用。错误代码: {response.status_code}", None
+
+    async def _generate_stream(self, payload: Dict[str, Any], cache_key: str, flight: Flight):
+        """
+        调用一次流式生成接口，连接失败且尚未输出任何分片时由 pool 换实例重试。
+        """
+        await self.pool.call(
+            self.model,
+            lambda endpoint: self._stream_from(endpoint, payload, cache_key, flight),
+            retryable=lambda: not flight.chunks,
+        )
+
+    async def _stream_from(self, endpoint: Endpoint, payload: Dict[str, Any], cache_key: str, flight: Flight):
+        """
+        从指定实例读取流式回复，把去除 <think> 内容的分片写入 flight，回复有效时设置 flight.context。
+        """
+        think_filter = ThinkTagFilter()
+        parts = []
+        final_context = None
+        start = time.perf_counter()
+        first_token = True
+        async with endpoint.client.stream("POST", "/api/generate", json=payload) as response:
+            if response.status_code != 200:
+                await response.aread()
+                logger.error("Ollama API错误: %s - %s", response.status_code, response.text)
+                flight.push(f"抱歉，AI服务暂时不可用。错误代码: {response.status_code}")
+                return
+            # Ollama 以 NDJSON 格式逐行返回分片
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if first_token and chunk.get("response"):
+                    first_token = False
+                    OLLAMA_TTFT.observe(time.perf_counter() - start, ("stream",))
+                text = think_filter.feed(chunk.get("response", ""))
+                if text:
+                    parts.append(text)
+                    flight.push(text)
+                if chunk.get("done"):
+                    record_generation(chunk, "stream")
+                    final_context = chunk.get("context")
+                    break
+        rest = think_filter.flush()
+        if rest:
+            parts.append(rest)
+            flight.push(rest)
+        reply = "".join(parts).strip()
+        if reply:
+            flight.context = final_context
+            if cache_key:
+                await response_cache.put(cache_key, self.model, reply)
+        else:
+            flight.push("抱歉，AI没有生成有效回复。")
+
+    async def complete(self, prompt: str) -> str:
+        """
+        单次非流式生成，不经过工具、缓存和请求合并（供后台任务使用）。
+        :param prompt: 完整的模型输入。
+        :return: 去除 <think> 内容的回复文本；请求失败时抛出异常。
+        """
+        payload = {"model": self.model, "prompt": prompt, "stream": False, "options": self.model_options()}
+        response = await self.pool.call(
+            self.model, lambda endpoint: endpoint.client.post("/api/generate", json=payload)
+        )
+        response.raise_for_status()
+        result = response.json()
+        record_generation(result, "generate")
+        return self.strip_think_tags(result.get("response", ""))
+
+    async def generate_response(self, message: str, conversation_history: List[Dict[str, str]] = None,
+                                conversation_id: int = None, use_cache: bool = True,
+                                use_fast_path: bool = True, flight: Flight = None) -> str:
         """
         生成 AI 对话回复。
         :param message: 当前用户消息。
         :param conversation_history: 对话历史（可选）。
+        :param conversation_id: 对话ID（可选，用于复用 KV context）。
+        :param use_cache: 是否读取回复缓存（为 False 时仍会用新回复刷新缓存）。
+        :param use_fast_path: 是否先尝试 fast_reply（调用方已经尝试过时传 False）。
+        :param flight: join_in_flight 加入的生成（可选），传入时直接等待其结果。
         :return: AI 回复文本。
         """
+        new_context = None
         try:
-            if not self.wait_for_model_ready():
-                return "抱歉，AI模型正在加载中，请稍后重试。"
-            prompt = ""
-            # 拼接最近 5 条对话历史
-            if conversation_history:
-                for msg in conversation_history[-5:]:
-                    if msg["role"] == "user":
-                        prompt += f"用户: {msg['content']}\n"
-                    else:
-                        prompt += f"助手: {msg['content']}\n"
-            prompt += f"用户: {message}\n助手:"
-            payload = {
-                "model": self.model,
-                "prompt": prompt,
-                "stream": False
-            }
-            response = requests.post(
-                self.api_url,
-                json=payload,
-                headers={"Content-Type": "application/json"},
-                timeout=60
-            )
-            if response.status_code == 200:
-                result = response.json()
-                if "response" in result and result["response"]:
-                    reply = result["response"].strip()
-                    reply = self.strip_think_tags(reply)
-                    return reply if reply else "抱歉，AI没有生成有效回复。"
-                elif result.get("done_reason") == "load":
-                    return "抱歉，AI模型正在加载中，请稍后重试。"
-                else:
-                    return "抱歉，AI没有生成有效回复。"
-            else:
-                print(f"Ollama API错误: {response.status_code} - {response.text}")
-                return f"抱歉，AI服务暂时不可用。错误代码: {response.status_code}"
-        except requests.exceptions.ConnectionError:
-            print("连接错误: 无法连接到Ollama服务")
+            if flight is not None:
+                with span("generation", model=self.model, coalesced=True):
+                    reply, new_context = await self.flights.wait(flight)
+                return reply
+            # 1. 优先走工具快速路径和回复缓存
+            if use_fast_path:
+                reply = await self.fast_reply(message, conversation_history, use_cache)
+                if reply is not None:
+                    return reply
+            # 2. 其他情况继续走大模型
+            cache_key = self.cache_key(message, conversation_history)
+            with span("model.readiness") as stage:
+                reason = self.unavailable_reason()
+                stage.set(ready=reason is None)
+            if reason:
+                return reason
+            with span("prompt.build") as stage:
+                payload, prompt = await self.build_payload(message, conversation_history, conversation_id)
+                stage.set(tokens=prompt.tokens, history=len(prompt.history), kv_reuse="context" in payload)
+            prompt_builder.record(prompt)
+            # 相同模型和实际输入的请求同时进行时只调用一次模型，其余请求等待同一结果
+            with span("generation", model=self.model):
+                reply, new_context = await self.flights.run(
+                    self.flight_key(payload), lambda: self._generate(payload, cache_key)
+                )
+            return reply
+        except httpx.ConnectError:
+            logger.error("连接错误: 无法连接到Ollama服务")
+            self.monitor.request_refresh()
             return "无法连接到Ollama服务，请确保Ollama正在运行。"
-        except requests.exceptions.Timeout:
-            print("请求超时")
+        except httpx.TimeoutException:
+            logger.warning("请求超时")
             return "请求超时，请稍后重试。"
         except Exception as e:
-            print(f"调用Ollama API时发生错误: {str(e)}")
+            logger.exception("调用Ollama API时发生错误: %s", e)
             return "抱歉，处理您的请求时发生错误。"
+        finally:
+            await self.update_context(conversation_id, new_context)
 
-    def test_connection(self) -> bool:
-        try:
-            response = requests.get(f"{self.base_url}/api/tags", timeout=5)
-            return response.status_code == 200
-        except:
-            return False
-
-    def get_available_models(self) -> List[str]:
+    async def generate_response_stream(self, message: str, conversation_history: List[Dict[str, str]] = None,
+                                       conversation_id: int = None, use_cache: bool = True,
+                                       use_fast_path: bool = True, flight: Flight = None) -> AsyncIterator[str]:
+        """
+        流式生成 AI 对话回复，逐段返回已去除 <think> 内容的文本。
+        :param message: 当前用户消息。
+        :param conversation_history: 对话历史（可选）。
+        :param conversation_id: 对话ID（可选，用于复用 KV context）。
+        :param use_cache: 是否读取回复缓存（为 False 时仍会用新回复刷新缓存）。
+        :param use_fast_path: 是否先尝试 fast_reply（调用方已经尝试过时传 False）。
+        :param flight: join_in_flight(stream=True) 加入的生成（可选），传入时直接订阅。
+        :return: 回复文本分片的迭代器。
+        """
+        new_context = None
         try:
-            response = requests.get(f"{self.base_url}/api/tags", timeout=5)
-            if response.status_code == 200:
-                data = response.json()
-                return [model["name"] for model in data.get("models", [])]
-            return []
-        except:
-            return []
+            coalesced = flight is not None
+            if not coalesced:
+                # 1. 优先走工具快速路径和回复缓存，命中时一次性返回
+                if use_fast_path:
+                    reply = await self.fast_reply(message, conversation_history, use_cache)
+                    if reply is not None:
+                        yield reply
+                        return
+                # 2. 其他情况走大模型流式接口
+                cache_key = self.cache_key(message, conversation_history)
+                with span("model.readiness") as stage:
+                    reason = self.unavailable_reason()
+                    stage.set(ready=reason is None)
+                if reason:
+                    yield reason
+                    return
+                with span("prompt.build") as stage:
+                    payload, prompt = await self.build_payload(message, conversation_history, conversation_id, stream=True)
+                    stage.set(tokens=prompt.tokens, history=len(prompt.history), kv_reuse="context" in payload)
+                prompt_builder.record(prompt)
+                # 相同请求共享同一个上游流，晚加入的请求从头读取已生成的分片
+                flight = self.flights.stream_flight(
+                    self.flight_key(payload), lambda f: self._generate_stream(payload, cache_key, f)
+                )
+            # 生成阶段跨越多次 yield，不设为当前 span
+            generation = start_span("generation.stream", model=self.model, coalesced=coalesced)
+            start = time.perf_counter()
+            chunks = 0
+            try:
+                async for text in self.flights.subscribe(flight):
+                    if not chunks:
+                        generation.set(ttft_ms=round((time.perf_counter() - start) * 1000, 3))
+                    chunks += 1
+                    yield text
+            finally:
+                generation.set(chunks=chunks)
+                generation.finish()
+            new_context = flight.context
+        except httpx.ConnectError:
+            logger.error("连接错误: 无法连接到Ollama服务")
+            self.monitor.request_refresh()
+            yield "无法连接到Ollama服务，请确保Ollama正在运行。"
+        except httpx.TimeoutException:
+            logger.warning("请求超时")
+            yield "请求超时，请稍后重试。"
+        except Exception as e:
+            logger.exception("调用Ollama API时发生错误: %s", e)
+            yield "抱歉，处理您的请求时发生错误。"
+        finally:
+            await self.update_context(conversation_id, new_context)
 
 ai_service = OllamaService() 
\ No newline at end of file
@@ -1,20 +1,27 @@
 
 # 导入依赖库和类型注解
 from datetime import datetime, timedelta  # 时间相关
-from typing import Optional  # 可选类型
+from typing import Optional, Dict  # 可选类型
+from collections import OrderedDict  # LRU 缓存
+import threading  # 线程锁
+import time  # 缓存过期时间
+import asyncio  # 在专用线程池中执行密码哈希
+from concurrent.futures import ThreadPoolExecutor  # 密码哈希专用线程池
 from jose import JWTError, jwt  # JWT 编解码
 from passlib.context import CryptContext  # 密码加密
 from fastapi import Depends, HTTPException, status  # FastAPI 依赖和异常
 from fastapi.security import OAuth2PasswordBearer  # OAuth2 认证
-from sqlalchemy.orm import Session  # 数据库会话
-from database import get_db  # 获取数据库会话
+from sqlalchemy import event, select  # ORM 事件和查询构造
+from sqlalchemy.ext.asyncio import AsyncSession  # 异步数据库会话
+from database import get_async_db  # 获取异步数据库会话
 from models import User  # 用户模型
 from schemas import TokenData  # Token 数据结构
+from tracing import span  # 请求追踪
 from config import settings  # 配置项
 
 
-# 密码加密上下文，使用 bcrypt 算法
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# 密码加密上下文，使用 bcrypt 算法，cost 来自配置；cost 变化后旧哈希会被判定为需要更新
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
 # OAuth2 认证方案，token 获取接口为 /token
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -29,6 +36,64 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 
+class PasswordHasher:
+    """
+    在容量固定的专用线程池中执行 bcrypt，避免登录高峰占满聊天请求也在使用的默认线程池。
+    排队（含执行中）的任务超过 max_pending 时立即返回 503，而不是继续堆积。
+    """
+    def __init__(self, workers: int = None, max_pending: int = None):
+        """
+        初始化 PasswordHasher。
+        :param workers: 执行 bcrypt 的线程数。
+        :param max_pending: 允许同时排队和执行的最大任务数。
+        """
+        self.workers = workers or settings.PASSWORD_HASH_WORKERS
+        self.max_pending = max_pending or settings.PASSWORD_HASH_MAX_PENDING
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        self._pending = 0
+        self.rejected = 0  # 因队列已满被拒绝的次数
+
+    async def _run(self, func, *args):
+        """
+        提交任务到专用线程池，队列已满时抛出 503。
+        """
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Authentication service is busy, please retry later",
+                headers={"Retry-After": "1"},
+            )
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        """
+        计算密码哈希。
+        """
+        return await self._run(get_password_hash, password)
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str):
+        """
+        校验密码；如果哈希使用的 cost 与当前配置不一致，同时返回新哈希。
+        :return: (是否匹配, 新哈希或 None)
+        """
+        return await self._run(pwd_context.verify_and_update, plain_password, hashed_password)
+
+    def shutdown(self):
+        """
+        关闭线程池，应用关闭时调用。
+        """
+        self._executor.shutdown(wait=False)
+
+
+# 创建全局密码哈希执行器实例
+password_hasher = PasswordHasher()
+
+
 # 创建 JWT 访问令牌
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()  # 复制数据
@@ -42,37 +107,173 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 
 
 # 根据用户名获取用户对象
-def get_user(db: Session, username: str):
-    return db.query(User).filter(User.username == username).first()
+async def get_user(db: AsyncSession, username: str):
+    result = await db.execute(select(User).where(User.username == username))
+    return result.scalars().first()
+
+
+# 保存重新计算的密码哈希
+async def update_password_hash(db: AsyncSession, user: User, hashed_password: str):
+    user.hashed_password = hashed_password
+    await db.commit()
 
 
-# 校验用户名和密码，认证用户
-def authenticate_user(db: Session, username: str, password: str):
-    user = get_user(db, username)
+# 校验用户名和密码，认证用户；bcrypt cost 配置变化时顺便用新 cost 重新哈希
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    user = await get_user(db, username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    verified, new_hash = await password_hasher.verify_and_update(password, user.hashed_password)
+    if not verified:
         return False
+    if new_hash:
+        await update_password_hash(db, user, new_hash)
     return user
 
 
+# 已认证用户快照，缓存命中时代替 ORM 对象返回给路由
+class AuthUser:
+    def __init__(self, user: User):
+        self.id = user.id
+        self.username = user.username
+        self.email = user.email
+        self.is_active = user.is_active
+        self.created_at = user.created_at
+
+
+class TokenUserCache:
+    """
+    已验证 token 到用户快照的进程内缓存（LRU），命中时认证不需要解码 JWT，也不访问数据库。
+    缓存有效期不超过 AUTH_CACHE_TTL，也不超过 token 本身的过期时间；
+    用户被修改或删除时通过 invalidate_user 立即失效。
+    """
+    def __init__(self, max_entries: int = None, ttl: int = None):
+        """
+        初始化 TokenUserCache。
+        :param max_entries: 最多缓存的 token 数量。
+        :param ttl: 缓存有效期（秒）。
+        """
+        self.max_entries = max_entries or settings.AUTH_CACHE_SIZE
+        self.ttl = ttl or settings.AUTH_CACHE_TTL
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # token -> (过期时间戳, 用户快照)
+        self._tokens_by_user: Dict[int, set] = {}  # user_id -> token 集合，用于按用户失效
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[AuthUser]:
+        """
+        查询 token 对应的用户快照，未命中或已过期返回 None。
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(token)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._remove(token)
+            self.misses += 1
+            return None
+
+    def put(self, token: str, user: AuthUser, token_expires_at: float = None):
+        """
+        缓存 token 对应的用户快照。
+        :param token_expires_at: token 的过期时间戳（JWT exp）。
+        """
+        expires_at = time.time() + self.ttl
+        if token_expires_at is not None:
+            expires_at = min(expires_at, token_expires_at)
+        with self._lock:
+            if token in self._entries:
+                self._remove(token)
+            self._entries[token] = (expires_at, user)
+            self._tokens_by_user.setdefault(user.id, set()).add(token)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: int):
+        """
+        删除某个用户的所有缓存（用户被停用、修改或删除时调用）。
+        """
+        with self._lock:
+            for token in list(self._tokens_by_user.get(user_id, ())):
+                self._remove(token)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        缓存命中统计。
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def _remove(self, token: str):
+        """
+        删除一个 token（调用方需持有锁）。
+        """
+        _, user = self._entries.pop(token)
+        tokens = self._tokens_by_user.get(user.id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[user.id]
+
+
+# 创建全局认证缓存实例
+token_user_cache = TokenUserCache()
+
+
+# 通过 ORM 修改或删除用户时，自动清除该用户的认证缓存
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def invalidate_cached_user(mapper, connection, target):
+    token_user_cache.invalidate_user(target.id)
+
+
 # 获取当前登录用户，依赖于 token 验证
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        # 解码 JWT，获取用户名
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    with span("auth.get_current_user") as stage:
+        # 命中缓存时直接返回用户快照，不解码 JWT，也不查询数据库
+        cached_user = token_user_cache.get(token)
+        stage.set(cache_hit=cached_user is not None)
+        if cached_user is not None:
+            return cached_user
+        credentials_exception = HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+        try:
+            # 解码 JWT，获取用户名
+            with span("auth.jwt_decode"):
+                payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+            username: str = payload.get("sub")
+            if username is None:
+                raise credentials_exception
+            token_data = TokenData(username=username)
+        except JWTError:
             raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
-    user = get_user(db, username=token_data.username)
-    if user is None:
-        raise credentials_exception
-    return user
\ No newline at end of file
+        with span("auth.user_lookup"):
+            user = await get_user(db, token_data.username)
+        if user is None:
+            raise credentials_exception
+        if not user.is_active:
+            # 停用的用户不写入缓存：停用时 after_update 清除缓存后，后续请求在这里被拒绝
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Inactive user")
+        auth_user = AuthUser(user)
+        token_user_cache.put(token, auth_user, payload.get("exp"))
+        return auth_user
+
+
+# 获取当前管理员用户（用户名在 ADMIN_USERNAMES 中）
+async def get_admin_user(current_user: AuthUser = Depends(get_current_user)):
+    if current_user.username not in settings.ADMIN_USERNAMES:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin privileges required")
+    return current_user
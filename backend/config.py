@@ -9,11 +9,108 @@ load_dotenv()
 # 配置类，集中管理所有后端配置项
 class Settings:
     DATABASE_URL: str = os.getenv("DATABASE_URL")
+    ASYNC_DATABASE_URL: str = os.getenv("ASYNC_DATABASE_URL")  # 异步驱动连接字符串，未设置时由 DATABASE_URL 推导
+    # 数据库连接池配置
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))  # 常驻连接数
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "20"))  # 高峰时额外允许的连接数
+    DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # 等待空闲连接的超时秒数
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "3600"))  # 连接最长复用秒数
+    DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"  # 取出连接前检测是否可用
     SECRET_KEY: str = os.getenv("SECRET_KEY")
     ALGORITHM: str = os.getenv("ALGORITHM")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
+    # 密码哈希配置
+    BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", "12"))  # bcrypt cost，修改后用户下次登录时自动重新哈希
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))  # 执行 bcrypt 的线程数
+    PASSWORD_HASH_MAX_PENDING: int = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))  # 排队上限，超过时返回 503
+    # 认证缓存配置
+    AUTH_CACHE_SIZE: int = int(os.getenv("AUTH_CACHE_SIZE", "10000"))  # 最多缓存的 token 数量
+    AUTH_CACHE_TTL: int = int(os.getenv("AUTH_CACHE_TTL", "300"))  # 缓存有效期（秒），不会超过 token 过期时间
     OLLAMA_BASE_URL: str = os.getenv("OLLAMA_BASE_URL")
     OLLAMA_MODEL: str = os.getenv("OLLAMA_MODEL")
+    # Ollama 多实例负载均衡配置
+    OLLAMA_BASE_URLS: list = [
+        url.strip() for url in os.getenv("OLLAMA_BASE_URLS", os.getenv("OLLAMA_BASE_URL") or "").split(",") if url.strip()
+    ]  # 逗号分隔的实例地址，未设置时只使用 OLLAMA_BASE_URL
+    OLLAMA_ROUTING: str = os.getenv("OLLAMA_ROUTING", "residency")  # residency：模型已加载的实例优先；least_outstanding：只看未完成请求数
+    OLLAMA_EJECT_FAILURES: int = int(os.getenv("OLLAMA_EJECT_FAILURES", "2"))  # 连续连接失败多少次后摘除实例
+    OLLAMA_EJECT_SECONDS: float = float(os.getenv("OLLAMA_EJECT_SECONDS", "30"))  # 摘除后多少秒允许试探
+    OLLAMA_RETRIES: int = int(os.getenv("OLLAMA_RETRIES", "2"))  # 连接失败时最多换几个实例重试
+    # Ollama HTTP 连接池配置
+    OLLAMA_POOL_SIZE: int = int(os.getenv("OLLAMA_POOL_SIZE", "100"))  # 最大连接数
+    OLLAMA_POOL_KEEPALIVE: int = int(os.getenv("OLLAMA_POOL_KEEPALIVE", "20"))  # 最大空闲 keep-alive 连接数
+    OLLAMA_KEEPALIVE_EXPIRY: float = float(os.getenv("OLLAMA_KEEPALIVE_EXPIRY", "30"))  # 空闲连接保持秒数
+    OLLAMA_CONNECT_TIMEOUT: float = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))  # 连接超时秒数
+    OLLAMA_READ_TIMEOUT: float = float(os.getenv("OLLAMA_READ_TIMEOUT", "60"))  # 读取超时秒数
+    # 模型状态后台监控配置
+    OLLAMA_MONITOR_INTERVAL: float = float(os.getenv("OLLAMA_MONITOR_INTERVAL", "10"))  # 检查间隔秒数
+    OLLAMA_WARMUP: bool = os.getenv("OLLAMA_WARMUP", "false").lower() == "true"  # 实例变为可用时是否预加载模型
+    # 模型并发控制配置
+    ADMISSION_ENABLED: bool = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"  # 是否限制并发并排队
+    OLLAMA_MAX_CONCURRENCY: int = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "4"))  # 同时发往模型的生成请求数
+    ADMISSION_MAX_QUEUE: int = int(os.getenv("ADMISSION_MAX_QUEUE", "100"))  # 等待队列总长度，满时返回 503
+    ADMISSION_MAX_QUEUE_PER_USER: int = int(os.getenv("ADMISSION_MAX_QUEUE_PER_USER", "4"))  # 单个用户排队上限，超过返回 429
+    ADMISSION_MAX_WAIT: float = float(os.getenv("ADMISSION_MAX_WAIT", "20"))  # 排队等待目标秒数，预计或实际超过时返回 503
+    SINGLE_FLIGHT_ENABLED: bool = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"  # 是否合并同时进行的相同生成请求
+    # 对话上下文配置
+    HISTORY_WINDOW: int = int(os.getenv("HISTORY_WINDOW", "20"))  # 参与构建 prompt 的最近消息条数上限，实际装入条数由 token 预算决定
+    HISTORY_CACHE_SIZE: int = int(os.getenv("HISTORY_CACHE_SIZE", "1000"))  # 进程内缓存的对话数量
+    # prompt token 预算配置
+    PROMPT_NUM_CTX: int = int(os.getenv("PROMPT_NUM_CTX", "4096"))  # 模型上下文长度，随请求作为 num_ctx 发送
+    PROMPT_NUM_CTX_MODELS: dict = {
+        name.strip(): int(size) for name, _, size in
+        (item.rpartition("=") for item in os.getenv("PROMPT_NUM_CTX_MODELS", "").split(",") if "=" in item)
+    }  # 按模型单独配置上下文长度，格式 model=tokens,model2=tokens
+    PROMPT_REPLY_RESERVE: int = int(os.getenv("PROMPT_REPLY_RESERVE", "1024"))  # 为回复预留的 token 数
+    PROMPT_MAX_MESSAGE_TOKENS: int = int(os.getenv("PROMPT_MAX_MESSAGE_TOKENS", "1024"))  # 单条历史消息最多占用的 token 数，超出时截去中间部分
+    PROMPT_TOKENIZER: str = os.getenv("PROMPT_TOKENIZER")  # 可选：tokenizer.json 路径（需安装 tokenizers），用于精确计数
+    # 对话滚动摘要配置
+    SUMMARY_ENABLED: bool = os.getenv("SUMMARY_ENABLED", "true").lower() == "true"  # 是否在后台为长对话生成滚动摘要
+    SUMMARY_EVERY: int = int(os.getenv("SUMMARY_EVERY", "8"))  # 摘要之后积累多少条新消息（不含最近保留的消息）时重新生成
+    SUMMARY_KEEP_RECENT: int = int(os.getenv("SUMMARY_KEEP_RECENT", "6"))  # 始终原样发送、不进入摘要的最近消息条数
+    SUMMARY_MAX_TOKENS: int = int(os.getenv("SUMMARY_MAX_TOKENS", "400"))  # 摘要最多占用的 token 数
+    SUMMARY_CACHE_SIZE: int = int(os.getenv("SUMMARY_CACHE_SIZE", "1000"))  # 内存中缓存摘要的对话数量
+    SUMMARY_QUEUE_SIZE: int = int(os.getenv("SUMMARY_QUEUE_SIZE", "1000"))  # 等待生成摘要的对话数上限，满时跳过
+    # Ollama KV context 复用配置
+    OLLAMA_KV_REUSE: bool = os.getenv("OLLAMA_KV_REUSE", "true").lower() == "true"  # 是否复用上一轮返回的 context
+    KV_CONTEXT_CACHE_SIZE: int = int(os.getenv("KV_CONTEXT_CACHE_SIZE", "500"))  # 内存中缓存 context 的对话数量
+    KV_CONTEXT_MAX_TOKENS: int = int(os.getenv("KV_CONTEXT_MAX_TOKENS", "4096"))  # 单个 context 的最大 token 数
+    KV_CONTEXT_PERSIST: bool = os.getenv("KV_CONTEXT_PERSIST", "false").lower() == "true"  # 是否持久化到数据库
+    # AI 回复缓存配置
+    RESPONSE_CACHE_ENABLED: bool = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"  # 是否启用回复缓存
+    RESPONSE_CACHE_SIZE: int = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))  # 内存中缓存的回复条数
+    RESPONSE_CACHE_TTL: int = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))  # 缓存有效期（秒）
+    RESPONSE_CACHE_PERSIST: bool = os.getenv("RESPONSE_CACHE_PERSIST", "false").lower() == "true"  # 是否持久化到数据库
+    # 消息异步批量写入配置
+    MESSAGE_WRITE_BEHIND: bool = os.getenv("MESSAGE_WRITE_BEHIND", "false").lower() == "true"  # 是否启用异步批量写入
+    MESSAGE_WRITE_BATCH_SIZE: int = int(os.getenv("MESSAGE_WRITE_BATCH_SIZE", "200"))  # 每批最多写入的消息条数
+    MESSAGE_WRITE_FLUSH_INTERVAL: float = float(os.getenv("MESSAGE_WRITE_FLUSH_INTERVAL", "0.05"))  # 最长等待秒数，到时即写入
+    MESSAGE_WRITE_MAX_PENDING: int = int(os.getenv("MESSAGE_WRITE_MAX_PENDING", "10000"))  # 队列上限，满时写入方等待
+    MESSAGE_WRITE_RETRIES: int = int(os.getenv("MESSAGE_WRITE_RETRIES", "3"))  # 批量写入遇到连接断开、锁超时等错误时的重试次数
+    MESSAGE_WRITE_RETRY_DELAY: float = float(os.getenv("MESSAGE_WRITE_RETRY_DELAY", "0.5"))  # 第一次重试前等待的秒数，之后每次翻倍
+    # 全文搜索配置
+    SEARCH_BACKEND: str = os.getenv("SEARCH_BACKEND", "auto")  # auto（MySQL 用 FULLTEXT，其余用内置倒排索引）/ fulltext / index
+    # 数学计算配置
+    MATH_MAX_EXPR_LENGTH: int = int(os.getenv("MATH_MAX_EXPR_LENGTH", "200"))  # 算式最大长度（字符）
+    MATH_MAX_NODES: int = int(os.getenv("MATH_MAX_NODES", "100"))  # 算式 AST 最大节点数
+    MATH_MAX_RESULT_BITS: int = int(os.getenv("MATH_MAX_RESULT_BITS", "4096"))  # 整数结果（含中间结果）最大位数
+    MATH_TIMEOUT: float = float(os.getenv("MATH_TIMEOUT", "1.0"))  # 单次计算的硬超时秒数，超时终止工作进程
+    MATH_WORKERS: int = int(os.getenv("MATH_WORKERS", "2"))  # 计算进程数
+    MATH_CACHE_SIZE: int = int(os.getenv("MATH_CACHE_SIZE", "1024"))  # 缓存的算式数量
+    # 请求追踪和采样分析配置
+    TRACING_ENABLED: bool = os.getenv("TRACING_ENABLED", "true").lower() == "true"  # 是否为每个请求记录 span 树
+    TRACE_BUFFER_SIZE: int = int(os.getenv("TRACE_BUFFER_SIZE", "200"))  # 内存中保存的最近追踪数量
+    TRACE_EXPORT_PATH: str = os.getenv("TRACE_EXPORT_PATH")  # 可选：追踪导出的 JSON Lines 文件路径
+    TRACE_SLOW_MS: float = float(os.getenv("TRACE_SLOW_MS", "2000"))  # 慢请求阈值（毫秒），超过时以 WARNING 日志输出 span 树，0 表示不输出
+    TRACE_EXCLUDE_PATHS: list = [
+        path.strip() for path in os.getenv("TRACE_EXCLUDE_PATHS", "/metrics,/ai/status/stream,/admin").split(",") if path.strip()
+    ]  # 不追踪的路径前缀（长连接和监控接口）
+    ADMIN_USERNAMES: list = [
+        name.strip() for name in os.getenv("ADMIN_USERNAMES", "").split(",") if name.strip()
+    ]  # 可以查看追踪和开启采样分析的用户名，逗号分隔
+    PROFILE_SAMPLE_INTERVAL: float = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))  # 采样间隔秒数
+    PROFILE_MAX_REQUESTS: int = int(os.getenv("PROFILE_MAX_REQUESTS", "100"))  # 一次最多分析的请求数
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO").upper()  # 日志级别（DEBUG / INFO / WARNING / ERROR）
 
 # 实例化配置对象，供全局导入使用
 settings = Settings()
\ No newline at end of file
@@ -0,0 +1,98 @@
+"""
+对话上下文提供者：只读取生成 prompt 需要的最近若干条消息
+"""
+# 导入所需的库
+import threading  # 线程锁
+from collections import OrderedDict, deque  # LRU 与环形缓冲区
+from typing import List, Dict  # 类型注解
+from sqlalchemy import select  # 查询构造
+from sqlalchemy.ext.asyncio import AsyncSession  # 异步数据库会话
+from models import Message  # 消息模型
+from config import settings  # 导入配置项
+
+
+class ConversationContextProvider:
+    """
+    为每个对话维护最近 window 条消息的环形缓冲区（进程内 LRU，最多 max_conversations 个对话）。
+    缓存命中时构建 prompt 不需要访问数据库；未命中时用 DESC + LIMIT 查询只取尾部窗口。
+    """
+    def __init__(self, window: int = None, max_conversations: int = None):
+        """
+        初始化 ConversationContextProvider。
+        :param window: 每个对话保留的最近消息条数。
+        :param max_conversations: 最多缓存的对话数量。
+        """
+        self.window = window or settings.HISTORY_WINDOW
+        self.max_conversations = max_conversations or settings.HISTORY_CACHE_SIZE
+        self._buffers: "OrderedDict[int, deque]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._uncached_writes = 0  # 写入未缓存对话的次数，用于判断查询结果是否可能过期
+
+    async def get_history(self, db: AsyncSession, conversation_id: int) -> List[Dict[str, str]]:
+        """
+        获取对话最近的消息，按时间正序返回。
+        :param db: 数据库会话（仅缓存未命中时使用）。
+        :param conversation_id: 对话ID。
+        :return: [{"role": ..., "content": ..., "seq": ...}, ...]
+        """
+        with self._lock:
+            buffer = self._buffers.get(conversation_id)
+            if buffer is not None:
+                self._buffers.move_to_end(conversation_id)
+                return list(buffer)
+            writes_before = self._uncached_writes
+        # 按 (conversation_id, seq) 索引倒序取尾部窗口
+        result = await db.execute(
+            select(Message.role, Message.content, Message.seq)
+            .where(Message.conversation_id == conversation_id)
+            .order_by(Message.seq.desc())
+            .limit(self.window)
+        )
+        messages = result.all()
+        history = [{"role": role, "content": content, "seq": seq} for role, content, seq in reversed(messages)]
+        with self._lock:
+            # 查询期间有并发写入时结果可能缺少最新消息，不写入缓存
+            if conversation_id not in self._buffers and writes_before == self._uncached_writes:
+                self._store(conversation_id, deque(history, maxlen=self.window))
+        return history
+
+    def prime(self, conversation_id: int):
+        """
+        为新建的对话建立空缓冲区，首轮对话无需查询数据库。
+        """
+        with self._lock:
+            self._store(conversation_id, deque(maxlen=self.window))
+
+    def append(self, conversation_id: int, role: str, content: str):
+        """
+        消息提交（或进入批量写入队列）后更新缓冲区，序号接在缓冲区最后一条消息之后；
+        对话不在缓存中时忽略，下次读取时从数据库加载。
+        """
+        with self._lock:
+            buffer = self._buffers.get(conversation_id)
+            if buffer is not None:
+                seq = buffer[-1]["seq"] + 1 if buffer else 1
+                buffer.append({"role": role, "content": content, "seq": seq})
+                self._buffers.move_to_end(conversation_id)
+            else:
+                self._uncached_writes += 1
+
+    def invalidate(self, conversation_id: int):
+        """
+        移除对话的缓冲区（例如对话被删除时）。
+        """
+        with self._lock:
+            self._buffers.pop(conversation_id, None)
+
+    def _store(self, conversation_id: int, buffer: deque):
+        """
+        写入缓冲区并淘汰最久未使用的对话（调用方需持有锁）。
+        """
+        self._buffers[conversation_id] = buffer
+        self._buffers.move_to_end(conversation_id)
+        while len(self._buffers) > self.max_conversations:
+            self._buffers.popitem(last=False)
+
+
+# 创建全局上下文提供者实例
+context_provider = ConversationContextProvider()
@@ -1,15 +1,119 @@
-
 # 导入 SQLAlchemy 相关模块和配置
-from sqlalchemy import create_engine  # 创建数据库引擎
+from sqlalchemy import create_engine, event  # 创建数据库引擎和连接事件
+from sqlalchemy.dialects import mysql, postgresql, sqlite  # 各方言的 upsert 语句
+from sqlalchemy.engine import make_url  # 解析数据库连接字符串
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession  # 异步引擎和会话
 from sqlalchemy.ext.declarative import declarative_base  # 声明基类
 from sqlalchemy.orm import sessionmaker  # 会话工厂
 from config import settings  # 导入配置项
+from metrics import DB_POOL_CHECKOUT_WAIT, DB_QUERY_DURATION, DB_QUERY_ERRORS, metrics  # 查询和连接池指标
+import time  # 查询计时
+
+# 同步驱动到异步驱动的映射
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+# 根据同步连接字符串推导异步连接字符串（可用 ASYNC_DATABASE_URL 显式指定）
+def get_async_database_url() -> str:
+    if settings.ASYNC_DATABASE_URL:
+        return settings.ASYNC_DATABASE_URL
+    url = make_url(settings.DATABASE_URL)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername)).render_as_string(hide_password=False)
+
+
+# 连接池参数，全部来自配置；SQLite 不使用连接池参数
+def get_pool_options(database_url: str) -> dict:
+    if make_url(database_url).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": settings.DB_POOL_SIZE,  # 常驻连接数
+        "max_overflow": settings.DB_MAX_OVERFLOW,  # 高峰时额外允许的连接数
+        "pool_timeout": settings.DB_POOL_TIMEOUT,  # 等待空闲连接的超时秒数
+        "pool_recycle": settings.DB_POOL_RECYCLE,  # 连接最长复用秒数，避免被 MySQL wait_timeout 断开
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,  # 取出连接前检测是否可用
+    }
+
+
+# 在方言默认的连接池类上增加取连接等待时间的统计（连接池满时等待空闲连接的时间也计入）
+def get_timed_pool_class(database_url: str):
+    url = make_url(database_url)
+    base = url.get_dialect().get_pool_class(url)
 
-# 创建数据库引擎，连接到指定数据库
-engine = create_engine(settings.DATABASE_URL)
+    class TimedPool(base):
+        def connect(self):
+            start = time.perf_counter()
+            try:
+                return super().connect()
+            finally:
+                DB_POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+
+    TimedPool.__name__ = f"Timed{base.__name__}"
+    return TimedPool
+
+
+# 创建数据库引擎，连接到指定数据库（供数据库迁移等同步操作使用）
+engine = create_engine(settings.DATABASE_URL, **get_pool_options(settings.DATABASE_URL))
 # 创建数据库会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 创建异步数据库引擎，路由中的数据库操作不再占用线程池
+async_engine = create_async_engine(
+    get_async_database_url(),
+    poolclass=get_timed_pool_class(get_async_database_url()),
+    **get_pool_options(settings.DATABASE_URL)
+)
+# 创建异步数据库会话工厂；提交后不过期对象，避免提交后访问属性触发隐式查询
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+
+# SQLite 默认不检查外键，连接时开启，删除对话时才会级联删除消息
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+if engine.dialect.name == "sqlite":
+    event.listen(engine, "connect", enable_sqlite_foreign_keys)
+    event.listen(async_engine.sync_engine, "connect", enable_sqlite_foreign_keys)
+
+# 导出连接池当前借出的连接数（只有 QueuePool 类连接池有该统计）
+if hasattr(async_engine.pool, "checkedout"):
+    metrics.gauge("db_pool_checked_out", "Database connections currently checked out of the pool", (),
+                  lambda: [((), async_engine.pool.checkedout())])
+
+
+# 统计每条 SQL 的执行耗时，按语句类型（SELECT / INSERT / UPDATE / DELETE 等）分类
+def statement_operation(statement: str) -> str:
+    words = statement.lstrip().split(None, 1)
+    return words[0].upper() if words else "OTHER"
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info["query_start"].pop()
+    DB_QUERY_DURATION.observe(time.perf_counter() - start, (statement_operation(statement),))
+
+
+def handle_db_error(exception_context):
+    starts = exception_context.connection.info.get("query_start") if exception_context.connection else None
+    if starts:
+        starts.pop()
+    DB_QUERY_ERRORS.inc(labels=(statement_operation(exception_context.statement or ""),))
+
+
+for sync_engine in (engine, async_engine.sync_engine):
+    event.listen(sync_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(sync_engine, "handle_error", handle_db_error)
+
 # 所有 ORM 模型的基类
 Base = declarative_base()
 
@@ -19,4 +123,21 @@ def get_db():
     try:
         yield db  # 提供数据库会话
     finally:
-        db.close()  # 用完后关闭
\ No newline at end of file
+        db.close()  # 用完后关闭
+
+
+# 获取异步数据库会话的依赖，用于 FastAPI 异步路由
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db  # 提供异步数据库会话
+
+
+# 按主键插入或更新一行（upsert）：并发写入同一主键时由数据库合并，不会因主键冲突失败
+def upsert(model, values: dict):
+    table = model.__table__
+    keys = [column.name for column in table.primary_key.columns]
+    updates = {name: value for name, value in values.items() if name not in keys}
+    if engine.dialect.name == "mysql":
+        return mysql.insert(table).values(**values).on_duplicate_key_update(**updates)
+    dialect = postgresql if engine.dialect.name == "postgresql" else sqlite
+    return dialect.insert(table).values(**values).on_conflict_do_update(index_elements=keys, set_=updates)
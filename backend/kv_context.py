@@ -0,0 +1,118 @@
+"""
+Ollama KV 上下文缓存：保存每个对话上一轮返回的 context，下一轮只需预填充新消息
+"""
+# 导入所需的库
+import json       # context 序列化
+import threading  # 线程锁
+from collections import OrderedDict  # LRU 缓存
+from typing import List, Optional  # 类型注解
+from sqlalchemy import delete  # 删除语句
+from database import AsyncSessionLocal  # 异步数据库会话工厂
+from models import ConversationContext  # 对话 context 持久化模型
+from config import settings  # 导入配置项
+
+
+class KVContextStore:
+    """
+    按对话缓存 Ollama /api/generate 返回的 context token 数组。
+    内存中最多保留 max_conversations 个对话，超过 max_tokens 的 context 不再复用；
+    开启持久化时同时写入 conversation_contexts 表，重启后仍可命中。
+    context 与生成它的模型绑定，模型变化时自动失效。
+    """
+    def __init__(self, max_conversations: int = None, max_tokens: int = None, persist: bool = None):
+        """
+        初始化 KVContextStore。
+        :param max_conversations: 内存中最多缓存的对话数量。
+        :param max_tokens: 单个 context 允许的最大 token 数。
+        :param persist: 是否持久化到数据库。
+        """
+        self.max_conversations = max_conversations or settings.KV_CONTEXT_CACHE_SIZE
+        self.max_tokens = max_tokens or settings.KV_CONTEXT_MAX_TOKENS
+        self.persist = settings.KV_CONTEXT_PERSIST if persist is None else persist
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()  # conversation_id -> (model, context)
+        self._lock = threading.Lock()
+
+    async def get(self, conversation_id: int, model: str) -> Optional[List[int]]:
+        """
+        获取对话可复用的 context。
+        :param conversation_id: 对话ID。
+        :param model: 当前使用的模型名称。
+        :return: context token 列表，不存在或模型不一致时返回 None。
+        """
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is not None:
+                self._entries.move_to_end(conversation_id)
+        if entry is None and self.persist:
+            entry = await self._load(conversation_id)
+            if entry is not None:
+                self._remember(conversation_id, entry)
+        if entry is None:
+            return None
+        if entry[0] != model:
+            await self.invalidate(conversation_id)
+            return None
+        return entry[1]
+
+    async def put(self, conversation_id: int, model: str, context: List[int]):
+        """
+        保存对话最新的 context，超过长度上限时丢弃（下一轮改为重新拼接历史）。
+        """
+        if not context or len(context) > self.max_tokens:
+            await self.invalidate(conversation_id)
+            return
+        self._remember(conversation_id, (model, context))
+        if self.persist:
+            await self._save(conversation_id, model, context)
+
+    async def invalidate(self, conversation_id: int):
+        """
+        删除对话的 context（例如本轮回复未经过模型，或对话被删除）。
+        """
+        self.discard(conversation_id)
+        if self.persist:
+            await self._delete(conversation_id)
+
+    def discard(self, conversation_id: int):
+        """
+        只删除内存中的 context（数据库记录由调用方在同一事务中删除）。
+        """
+        with self._lock:
+            self._entries.pop(conversation_id, None)
+
+    def _remember(self, conversation_id: int, entry: tuple):
+        """
+        写入内存缓存并淘汰最久未使用的对话。
+        """
+        with self._lock:
+            self._entries[conversation_id] = entry
+            self._entries.move_to_end(conversation_id)
+            while len(self._entries) > self.max_conversations:
+                self._entries.popitem(last=False)
+
+    async def _load(self, conversation_id: int) -> Optional[tuple]:
+        async with AsyncSessionLocal() as db:
+            row = await db.get(ConversationContext, conversation_id)
+            return (row.model, json.loads(row.context)) if row else None
+
+    async def _save(self, conversation_id: int, model: str, context: List[int]):
+        async with AsyncSessionLocal() as db:
+            row = await db.get(ConversationContext, conversation_id)
+            if row is None:
+                row = ConversationContext(conversation_id=conversation_id)
+                db.add(row)
+            row.model = model
+            row.context = json.dumps(context, separators=(",", ":"))
+            row.token_count = len(context)
+            await db.commit()
+
+    async def _delete(self, conversation_id: int):
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(ConversationContext).where(
+                ConversationContext.conversation_id == conversation_id
+            ))
+            await db.commit()
+
+
+# 创建全局 KV 上下文缓存实例
+kv_context_store = KVContextStore()
@@ -1,29 +1,80 @@
 
 # 导入 FastAPI 及相关依赖
-from fastapi import FastAPI, Depends, HTTPException, status  # FastAPI 主体和依赖注入
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, status  # FastAPI 主体和依赖注入
 from fastapi.security import OAuth2PasswordRequestForm  # OAuth2 表单
 from fastapi.middleware.cors import CORSMiddleware  # 跨域中间件
-from sqlalchemy.orm import Session  # 数据库会话
+from fastapi.responses import PlainTextResponse, StreamingResponse  # 指标文本和流式响应
+from starlette.background import BackgroundTask  # 响应结束后归还并发名额
+import anyio  # 屏蔽取消，保证断开连接时仍能落库
+from sqlalchemy.ext.asyncio import AsyncSession  # 异步数据库会话
+from sqlalchemy.orm import selectinload  # 预加载关联消息（异步会话不支持懒加载）
 from datetime import timedelta  # 时间处理
-from typing import List  # 类型注解
+from typing import List, Optional  # 类型注解
+import base64  # 分页游标编码
+from datetime import datetime  # 分页游标解析
+from sqlalchemy import select, or_, and_  # 查询构造和组合查询条件
+import json  # SSE 数据序列化
+import asyncio  # 异步等待
+import logging  # 日志
 
 # 导入本地模块
-from database import engine, get_db  # 数据库引擎和依赖
-from models import Base, User, Conversation, Message  # ORM 模型
-from schemas import UserCreate, User as UserSchema, Token, Conversation as ConversationSchema, Message as MessageSchema, ChatRequest, ChatResponse  # 数据结构
-from auth import authenticate_user, create_access_token, get_current_user, get_password_hash  # 认证相关
+from database import get_async_db  # 数据库会话依赖
+from models import User, Conversation, Message  # ORM 模型
+from schemas import UserCreate, User as UserSchema, Token, Conversation as ConversationSchema, Message as MessageSchema, ChatRequest, ChatResponse, ConversationSummaryPage, MessagePage, SearchPage  # 数据结构
+from auth import authenticate_user, create_access_token, get_admin_user, get_current_user, password_hasher, token_user_cache  # 认证相关
 from config import settings  # 配置
 
 # 导入本地和联网 AI 服务
 from ai_service import ai_service
+from context_provider import context_provider  # 对话上下文（最近消息窗口）
+from kv_context import kv_context_store  # 对话 KV context 缓存
+from response_cache import response_cache  # AI 回复缓存
+from message_store import message_writer  # 保存消息（可选异步批量写入）并维护对话汇总字段
+from search import search_index  # 全文搜索
+from math_mcp import math_engine  # 数学计算（进程池 + 缓存）
+from tool_router import tool_router  # 模型前的工具快速路径
+from admission import admission  # 模型并发控制和公平排队
+from prompt_builder import prompt_builder  # 按 token 预算构建 prompt
+from summarizer import conversation_summarizer  # 对话滚动摘要
+from metrics import MetricsMiddleware, metrics  # Prometheus 指标
+from tracing import TracingMiddleware, span, tracer  # 请求追踪
+from profiler import profiler  # 按需采样分析
+
+# 配置日志输出，各模块通过 logging.getLogger(__name__) 记录错误和告警
+logging.basicConfig(level=settings.LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+# httpx 在 INFO 级别记录每个 HTTP 请求（包括每次调用 Ollama），只保留告警
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logger = logging.getLogger(__name__)
 
 
-# 创建数据库表（如未存在）
-Base.metadata.create_all(bind=engine)
-
 # 创建 FastAPI 应用实例
 app = FastAPI(title="AI Chat API", version="1.0.0")
 
+
+# 应用启动时开始后台监控模型状态，并启动消息批量写入任务
+@app.on_event("startup")
+async def start_ai_monitor():
+    ai_service.monitor.start()
+    message_writer.start()
+    conversation_summarizer.start()
+
+
+# 应用关闭时写完待落库消息、停止监控并释放 Ollama 连接池和密码哈希线程池
+@app.on_event("shutdown")
+async def close_ai_service():
+    password_hasher.shutdown()
+    await message_writer.stop()  # 写完队列中尚未落库的消息
+    await conversation_summarizer.stop()
+    math_engine.shutdown()
+    await ai_service.monitor.stop()
+    await ai_service.close()
+    tracer.close()
+
+# 记录每个请求的耗时
+app.add_middleware(MetricsMiddleware)
+# 记录每个请求各阶段的 span 树
+app.add_middleware(TracingMiddleware)
+
 # 配置 CORS，允许前端跨域访问
 app.add_middleware(
     CORSMiddleware,
@@ -34,30 +85,39 @@ app.add_middleware(
 )
 
 
-# 用户注册接口
-@app.post("/register", response_model=UserSchema)
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    # 检查用户名是否已注册
-    db_user = db.query(User).filter(User.username == user.username).first()
-    if db_user:
+# 检查用户名和邮箱是否已被注册
+async def check_user_available(db: AsyncSession, user: UserCreate):
+    result = await db.execute(select(User.id).where(User.username == user.username))
+    if result.first():
         raise HTTPException(status_code=400, detail="Username already registered")
-    # 检查邮箱是否已注册
-    db_user = db.query(User).filter(User.email == user.email).first()
-    if db_user:
+    result = await db.execute(select(User.id).where(User.email == user.email))
+    if result.first():
         raise HTTPException(status_code=400, detail="Email already registered")
-    # 加密密码并保存新用户
-    hashed_password = get_password_hash(user.password)
+
+
+# 保存新用户
+async def create_user(db: AsyncSession, user: UserCreate, hashed_password: str) -> User:
     db_user = User(username=user.username, email=user.email, hashed_password=hashed_password)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 
+# 用户注册接口
+@app.post("/register", response_model=UserSchema)
+async def register(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    # 检查用户名和邮箱是否已注册
+    await check_user_available(db, user)
+    # 在专用线程池中加密密码，再保存新用户
+    hashed_password = await password_hasher.hash(user.password)
+    return await create_user(db, user, hashed_password)
+
+
 # 用户登录接口，返回 JWT Token
 @app.post("/token", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -73,88 +133,187 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
 
 # 获取当前登录用户信息
 @app.get("/users/me", response_model=UserSchema)
-def read_users_me(current_user: User = Depends(get_current_user)):
+async def read_users_me(current_user: User = Depends(get_current_user)):
     return current_user
 
 
 # 创建新对话
 @app.post("/conversations", response_model=ConversationSchema)
-def create_conversation(
+async def create_conversation(
     conversation: ConversationSchema,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     db_conversation = Conversation(
         title=conversation.title,
         user_id=current_user.id
     )
     db.add(db_conversation)
-    db.commit()
-    db.refresh(db_conversation)
+    await db.flush()
+    await search_index.index_title(db, db_conversation)
+    await db.commit()
+    # 异步会话不能懒加载，刷新时一并加载（空的）消息列表
+    await db.refresh(db_conversation, ["id", "created_at", "updated_at", "messages"])
     return db_conversation
 
 
 # 获取当前用户的所有对话
 @app.get("/conversations", response_model=List[ConversationSchema])
-def get_conversations(
+async def get_conversations(
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    await message_writer.sync(current_user.id)  # 先写入该用户未落库的消息，保证读到自己的写入
+    result = await db.execute(
+        select(Conversation)
+        .where(Conversation.user_id == current_user.id)
+        .options(selectinload(Conversation.messages))
+    )
+    return result.scalars().all()
+
+
+# 编码对话列表分页游标
+def encode_conversation_cursor(conversation: Conversation) -> str:
+    raw = f"{conversation.updated_at.isoformat()}|{conversation.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+# 解析对话列表分页游标
+def decode_conversation_cursor(cursor: str):
+    try:
+        updated_at, conversation_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(updated_at), int(conversation_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+# 分页获取当前用户的对话摘要（按最近活跃时间倒序，不加载消息）
+@app.get("/conversations/summary", response_model=ConversationSummaryPage)
+async def get_conversation_summaries(
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    conversations = db.query(Conversation).filter(Conversation.user_id == current_user.id).all()
-    return conversations
+    await message_writer.sync(current_user.id)
+    query = select(Conversation).where(Conversation.user_id == current_user.id)
+    if cursor:
+        # 键集分页：从上一页最后一条之后继续，走 (user_id, updated_at, id) 索引
+        updated_at, conversation_id = decode_conversation_cursor(cursor)
+        query = query.where(or_(
+            Conversation.updated_at < updated_at,
+            and_(Conversation.updated_at == updated_at, Conversation.id < conversation_id)
+        ))
+    result = await db.execute(query.order_by(
+        Conversation.updated_at.desc(), Conversation.id.desc()
+    ).limit(limit + 1))
+    conversations = result.scalars().all()
+    next_cursor = None
+    if len(conversations) > limit:
+        conversations = conversations[:limit]
+        next_cursor = encode_conversation_cursor(conversations[-1])
+    return ConversationSummaryPage(items=conversations, next_cursor=next_cursor)
 
 
 # 获取指定对话详情
 @app.get("/conversations/{conversation_id}", response_model=ConversationSchema)
-def get_conversation(
+async def get_conversation(
     conversation_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    conversation = db.query(Conversation).filter(
-        Conversation.id == conversation_id,
-        Conversation.user_id == current_user.id
-    ).first()
+    await message_writer.sync(current_user.id)
+    result = await db.execute(
+        select(Conversation)
+        .where(Conversation.id == conversation_id, Conversation.user_id == current_user.id)
+        .options(selectinload(Conversation.messages))
+    )
+    conversation = result.scalars().first()
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
     return conversation
 
 
+# 分页获取对话消息：默认返回最新一页，before_id 向前翻页，after_id 增量同步新消息
+@app.get("/conversations/{conversation_id}/messages", response_model=MessagePage)
+async def get_conversation_messages(
+    conversation_id: int,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    if before_id is not None and after_id is not None:
+        raise HTTPException(status_code=400, detail="before_id and after_id cannot be used together")
+    await message_writer.sync(current_user.id)
+    result = await db.execute(select(Conversation.id).where(
+        Conversation.id == conversation_id,
+        Conversation.user_id == current_user.id
+    ))
+    if not result.first():
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    query = select(Message).where(Message.conversation_id == conversation_id)
+    # 对话内消息ID与序号同序，按 (conversation_id, seq) 索引范围扫描
+    if after_id is not None:
+        # 增量同步：只取比客户端已有的最后一条更新的消息
+        result = await db.execute(query.where(Message.id > after_id).order_by(Message.seq).limit(limit + 1))
+        messages = result.scalars().all()
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+    else:
+        if before_id is not None:
+            query = query.where(Message.id < before_id)
+        result = await db.execute(query.order_by(Message.seq.desc()).limit(limit + 1))
+        messages = result.scalars().all()
+        has_more = len(messages) > limit
+        messages = list(reversed(messages[:limit]))
+    return MessagePage(items=messages, has_more=has_more)
+
+
 # 删除指定对话及其消息
 @app.delete("/conversations/{conversation_id}", status_code=204)
-def delete_conversation(
+async def delete_conversation(
     conversation_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    conversation = db.query(Conversation).filter(
+    await message_writer.sync(current_user.id)
+    result = await db.execute(select(Conversation).where(
         Conversation.id == conversation_id,
         Conversation.user_id == current_user.id
-    ).first()
+    ))
+    conversation = result.scalars().first()
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
-    # 级联删除消息
-    db.query(Message).filter(Message.conversation_id == conversation_id).delete()
-    db.delete(conversation)
-    db.commit()
+    # 消息和 KV context 由数据库外键 ON DELETE CASCADE 级联删除
+    await db.delete(conversation)
+    await db.commit()
+    context_provider.invalidate(conversation_id)
+    kv_context_store.discard(conversation_id)
+    conversation_summarizer.discard(conversation_id)
     return None
 
 
-# 聊天接口，支持多轮对话
-from fastapi import Request
-
-
-
-# 聊天接口，支持多轮对话和联网切换
-from fastapi import Request
-
-@app.post("/chat", response_model=ChatResponse)
-def chat(
-    chat_request: ChatRequest,
-    request: Request,
+# 搜索当前用户的消息内容和对话标题，按相关度排序分页返回高亮片段
+@app.get("/search", response_model=SearchPage)
+async def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    offset: int = Query(0, ge=0, le=1000),
+    limit: int = Query(20, ge=1, le=50),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
+    await message_writer.sync(current_user.id)
+    items, has_more = await search_index.search(db, current_user.id, q, offset, limit)
+    return SearchPage(items=items, next_offset=offset + limit if has_more else None)
+
+
+# 获取或创建聊天请求对应的对话
+async def resolve_conversation(db: AsyncSession, chat_request: ChatRequest, current_user: User) -> Conversation:
+    """
+    获取聊天请求对应的对话，未指定对话ID时创建新对话。
+    """
     # 如果没有指定对话ID，创建新对话
     if not chat_request.conversation_id:
         conversation = Conversation(
@@ -162,67 +321,317 @@ def chat(
             user_id=current_user.id
         )
         db.add(conversation)
-        db.commit()
-        db.refresh(conversation)
-        conversation_id = conversation.id
-    else:
-        conversation_id = chat_request.conversation_id
-        # 验证对话是否属于当前用户
-        conversation = db.query(Conversation).filter(
-            Conversation.id == conversation_id,
-            Conversation.user_id == current_user.id
-        ).first()
-        if not conversation:
-            raise HTTPException(status_code=404, detail="Conversation not found")
+        await db.flush()
+        await search_index.index_title(db, conversation)
+        await db.commit()  # 提交后不过期对象，无需再 refresh 读回
+        context_provider.prime(conversation.id)
+        return conversation
+    # 验证对话是否属于当前用户
+    result = await db.execute(select(Conversation).where(
+        Conversation.id == chat_request.conversation_id,
+        Conversation.user_id == current_user.id
+    ))
+    conversation = result.scalars().first()
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return conversation
+
+
+# 读取对话历史（只取 prompt 需要的最近消息窗口）
+async def load_conversation_history(db: AsyncSession, conversation_id: int, user_id: int) -> List[dict]:
+    """
+    读取对话历史，转换为 AI 服务需要的格式；有滚动摘要时用摘要替换已覆盖的消息。
+    """
+    with span("history.load") as stage:
+        # 缓存未命中时需要查询数据库，先写入该用户未落库的消息
+        with span("history.sync"):
+            await message_writer.sync(user_id)
+        with span("history.query"):
+            history = await context_provider.get_history(db, conversation_id)
+        with span("history.summary"):
+            history = await conversation_summarizer.apply(conversation_id, history)
+        stage.set(messages=len(history))
+        return history
+
+
+# 聊天接口
+@app.post("/chat", response_model=ChatResponse)
+async def chat(
+    chat_request: ChatRequest,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    with span("conversation.resolve"):
+        conversation = await resolve_conversation(db, chat_request, current_user)
+    conversation_id = conversation.id
     # 获取对话历史
-    conversation_history = []
-    if conversation_id:
-        messages = db.query(Message).filter(
-            Message.conversation_id == conversation_id
-        ).order_by(Message.created_at).all()
-        for msg in messages:
-            conversation_history.append({
-                "role": msg.role,
-                "content": msg.content
-            })
-    # 保存用户消息
-    user_message = Message(
-        content=chat_request.message,
-        role="user",
-        conversation_id=conversation_id
+    conversation_history = await load_conversation_history(db, conversation_id, current_user.id)
+    # 工具快速路径和回复缓存不调用模型，不占用模型并发名额
+    ai_response = await ai_service.fast_reply(
+        chat_request.message, conversation_history, use_cache=not chat_request.bypass_cache
     )
-    db.add(user_message)
+    if ai_response is not None:
+        # 本轮回复不经过模型，缓存的 KV context 缺少这一轮，使其失效
+        await ai_service.update_context(conversation_id)
+    ticket = None
+    flight = None
+    if ai_response is None:
+        # 合并到正在进行的相同生成上的请求不再调用模型，也不占用并发名额；
+        # 加入时即登记，之后等待的是这一次生成的结果，不会在它结束后重新发起
+        flight = await ai_service.join_in_flight(chat_request.message, conversation_history, conversation_id)
+        if flight is None:
+            # 排队期间不占用数据库连接；被拒绝时直接返回 429/503，不保存用户消息
+            await db.close()
+            with span("admission.wait"):
+                ticket = await admission.acquire(current_user.id)
+    try:
+        # 先在短事务中保存用户消息（或放入批量写入队列），再结束会话事务，
+        # 连接归还连接池，生成回复期间不占用数据库连接
+        try:
+            await message_writer.save(db, current_user.id, conversation_id, [("user", chat_request.message)])
+            await db.close()
+        except BaseException:
+            if flight is not None:
+                ai_service.flights.leave(flight)
+            raise
+        if ai_response is None:
+            # 只用本地模型
+            try:
+                ai_response = await ai_service.generate_response(
+                    chat_request.message,
+                    conversation_history,
+                    conversation_id,
+                    use_fast_path=False,
+                    flight=flight
+                )
+            except Exception as e:
+                # 生成失败时保存错误提示作为回复，保持用户消息和回复成对
+                logger.exception("生成回复时发生错误: %s", e)
+                ai_response = "抱歉，处理您的请求时发生错误。"
+    finally:
+        if ticket is not None:
+            ticket.release()
+
+    # 在新的短事务中保存 AI 消息；屏蔽取消，客户端断开时回复仍能落库
+    with anyio.CancelScope(shield=True):
+        await message_writer.save(db, current_user.id, conversation_id, [("assistant", ai_response)])
+    return ChatResponse(response=ai_response, conversation_id=conversation_id)
+
+
+# 编码 SSE 事件
+def sse_event(event: str, data: dict) -> str:
+    """
+    按 Server-Sent Events 格式编码一条事件。
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+# 在独立会话中保存一条消息，返回消息ID
+async def save_message(user_id: int, conversation_id: int, role: str, content: str) -> Optional[int]:
+    """
+    使用新的数据库会话保存消息，供流式响应结束后调用。
+    启用异步批量写入时消息尚未落库，返回 None。
+    """
+    saved = await message_writer.save(None, user_id, conversation_id, [(role, content)])
+    return saved[0].id if saved else None
 
-    # 只用本地模型
-    ai_response = ai_service.generate_response(
-        chat_request.message,
-        conversation_history
-    )
 
-    # 保存 AI 消息
-    ai_message = Message(
-        content=ai_response,
-        role="assistant",
-        conversation_id=conversation_id
+# 流式聊天接口，以 SSE 逐段推送 AI 回复
+@app.post("/chat/stream")
+async def chat_stream(
+    chat_request: ChatRequest,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    with span("conversation.resolve"):
+        conversation = await resolve_conversation(db, chat_request, current_user)
+    conversation_id = conversation.id
+    conversation_history = await load_conversation_history(db, conversation_id, current_user.id)
+    fast_reply = await ai_service.fast_reply(
+        chat_request.message, conversation_history, use_cache=not chat_request.bypass_cache
+    )
+    if fast_reply is not None:
+        # 本轮回复不经过模型，缓存的 KV context 缺少这一轮，使其失效
+        await ai_service.update_context(conversation_id)
+    ticket = None
+    # 加入的正在进行的流式生成；交给生成器订阅后清空，没有订阅时由 release 离开
+    joined = []
+    if fast_reply is None:
+        flight = await ai_service.join_in_flight(
+            chat_request.message, conversation_history, conversation_id, stream=True
+        )
+        if flight is not None:
+            joined.append(flight)
+        else:
+            # 在返回响应头之前排队，被拒绝时客户端收到 429/503
+            await db.close()
+            with span("admission.wait"):
+                ticket = await admission.acquire(current_user.id)
+
+    def release():
+        """
+        归还并发名额，离开没有订阅的合并生成（可重复调用）。
+        """
+        if ticket is not None:
+            ticket.release()
+        while joined:
+            ai_service.flights.leave(joined.pop())
+
+    try:
+        # 先保存用户消息，然后结束请求会话的事务，流式输出期间不占用数据库连接
+        await message_writer.save(db, current_user.id, conversation_id, [("user", chat_request.message)])
+        await db.close()
+    except BaseException:
+        release()
+        raise
+
+    async def event_stream():
+        parts = []
+        try:
+            yield sse_event("start", {"conversation_id": conversation_id})
+            if fast_reply is not None:
+                parts.append(fast_reply)
+                yield sse_event("delta", {"content": fast_reply})
+            else:
+                async for text in ai_service.generate_response_stream(
+                        chat_request.message, conversation_history, conversation_id,
+                        use_fast_path=False, flight=joined.pop() if joined else None):
+                    parts.append(text)
+                    yield sse_event("delta", {"content": text})
+        finally:
+            release()
+            # 流结束（包括客户端断开）时保存 AI 消息
+            ai_response = "".join(parts).strip()
+            message_id = None
+            if ai_response:
+                with anyio.CancelScope(shield=True):
+                    message_id = await save_message(current_user.id, conversation_id, "assistant", ai_response)
+        yield sse_event("done", {"conversation_id": conversation_id, "message_id": message_id})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # 客户端在流开始前断开时生成器不会执行，由后台任务兜底归还名额、离开合并的生成
+        background=BackgroundTask(release)
     )
-    db.add(ai_message)
-    db.commit()
-    return ChatResponse(response=ai_response, conversation_id=conversation_id)
 
 
 # 获取 AI 服务状态
 @app.get("/ai/status")
-def get_ai_status():
-    """获取AI服务状态"""
-    is_connected = ai_service.test_connection()
-    available_models = ai_service.get_available_models() if is_connected else []
+async def get_ai_status():
+    """获取AI服务状态（读取后台监控的缓存结果）"""
+    return ai_status_payload(ai_service.monitor.status)
+
+
+# 推送 AI 服务状态变化（SSE）
+@app.get("/ai/status/stream")
+async def stream_ai_status(request: Request):
+    queue = ai_service.monitor.subscribe()
+
+    async def event_stream():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    status = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"  # 注释行，保持连接
+                    continue
+                yield sse_event("status", ai_status_payload(status))
+        finally:
+            ai_service.monitor.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# 将监控状态转换为接口返回格式
+def ai_status_payload(status: dict) -> dict:
     return {
-        "connected": is_connected,
-        "available_models": available_models,
-        "current_model": ai_service.model
+        "connected": status["connected"],
+        "available_models": status["available_models"],
+        "current_model": ai_service.model,
+        "model_loaded": status["model_loaded"],
+        "checked_at": status["checked_at"],
+        "endpoints": status["endpoints"],
+        "response_cache": response_cache.stats()
     }
 
 
+# 获取缓存命中统计
+@app.get("/cache/stats")
+async def get_cache_stats(current_user: User = Depends(get_current_user)):
+    return {
+        "auth": token_user_cache.stats(),
+        "password_hash_rejected": password_hasher.rejected,
+        "message_writer": message_writer.stats(),
+        "math": math_engine.stats(),
+        "tools": tool_router.stats(),
+        "admission": admission.stats(),
+        "single_flight": ai_service.flights.stats(),
+        "ollama": ai_service.pool.stats(),
+        "prompt": prompt_builder.stats(),
+        "summary": conversation_summarizer.stats(),
+        "tracing": tracer.stats(),
+        "response": response_cache.stats()
+    }
+
+
+# 各模块已有的统计在 /metrics 中导出为 gauge
+metrics.register_stats("auth_cache", token_user_cache.stats)
+metrics.register_stats("message_writer", message_writer.stats)
+metrics.register_stats("math", math_engine.stats)
+metrics.register_stats("tools", tool_router.stats, labels={"tools": "tool"})
+metrics.register_stats("admission", admission.stats)
+metrics.register_stats("single_flight", ai_service.flights.stats)
+metrics.register_stats("response_cache", response_cache.stats)
+metrics.register_stats("prompt", prompt_builder.stats)
+metrics.register_stats("summary", conversation_summarizer.stats)
+metrics.register_stats("tracing", tracer.stats)
+
+
+# Prometheus 指标（文本格式）
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+# 最近的请求追踪（span 树），仅管理员可查看
+@app.get("/admin/traces")
+async def get_traces(
+    limit: int = Query(50, ge=1, le=500),
+    slow: bool = False,
+    admin_user: User = Depends(get_admin_user)
+):
+    return {"stats": tracer.stats(), "items": tracer.recent(limit, slow_only=slow)}
+
+
+# 对接下来的若干个请求采样分析调用栈，仅管理员可开启
+@app.post("/admin/profile")
+async def start_profile(
+    requests: int = Query(20, ge=1, le=settings.PROFILE_MAX_REQUESTS),
+    admin_user: User = Depends(get_admin_user)
+):
+    profiler.arm(requests)
+    return profiler.status()
+
+
+# 采样分析进度
+@app.get("/admin/profile")
+async def get_profile_status(admin_user: User = Depends(get_admin_user)):
+    return profiler.status()
+
+
+# 采样分析结果（collapsed 格式，可直接生成火焰图）
+@app.get("/admin/profile/collapsed", response_class=PlainTextResponse)
+async def get_profile_collapsed(admin_user: User = Depends(get_admin_user)):
+    return PlainTextResponse(profiler.collapsed())
+
+
 # 根路由，健康检查
 @app.get("/")
 def read_root():
@@ -2,55 +2,288 @@
 MCP（Model Context Protocol）数学计算服务模块
 """
 import ast
+import asyncio
+import math
+import multiprocessing
 import operator
-from typing import Optional
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+from config import settings
 
-def mcp_math_request(query: str) -> dict:
+# 只允许数字、运算符、括号和空格
+ALLOWED_CHARS = set('0123456789+-*/().eE ')
+# 支持的运算
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Pow: operator.pow,
+}
+UNARY_OPERATORS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+ALLOWED_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant) + tuple(BINARY_OPERATORS) + tuple(UNARY_OPERATORS)
+UNAVAILABLE_REASON = '计算服务不可用'  # 进程池异常，结果不缓存
+TIMEOUT_REASON = '计算超时'  # 超时可能来自冷启动、CPU 争用或同批的其他算式，结果不缓存
+# 与算式本身无关的失败，不写入缓存
+TRANSIENT_REASONS = (UNAVAILABLE_REASON, TIMEOUT_REASON)
+
+
+def make_response(status: str, result=None, reason: Optional[str] = None) -> dict:
     """
-    MCP请求：输入query字符串，返回MCP格式响应。
+    构造 MCP 格式响应。
+    """
+    return {
+        "type": "mcp.math",
+        "status": status,
+        "result": result,
+        "reason": reason
+    }
+
+
+def extract_expression(query: str) -> Optional[str]:
+    """
+    从用户输入中提取算式，不是算式时返回 None。
     """
-    # 只允许数字、运算符、括号和空格
-    allowed = set('0123456789+-*/().eE ')
     expr = query.replace('等于多少', '').replace('等于几', '').replace('是多少', '').replace('=','').strip()
-    if not expr or not all(c in allowed for c in expr):
-        return {
-            "type": "mcp.math",
-            "status": "not_applicable",
-            "result": None,
-            "reason": "not a math expression"
-        }
+    if not expr or not all(c in ALLOWED_CHARS for c in expr):
+        return None
+    return expr
+
+
+def parse_expression(expr: str) -> ast.Expression:
+    """
+    解析算式并检查预算：长度、AST 节点数和节点类型。
+    """
+    if len(expr) > settings.MATH_MAX_EXPR_LENGTH:
+        raise ValueError('表达式过长')
+    tree = ast.parse(expr, mode='eval')
+    nodes = list(ast.walk(tree))
+    if len(nodes) > settings.MATH_MAX_NODES:
+        raise ValueError('表达式过于复杂')
+    for node in nodes:
+        if not isinstance(node, ALLOWED_NODES):
+            raise ValueError('不支持的表达式')
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            raise ValueError('不支持的表达式')
+    return tree
+
+
+def has_power(tree: ast.Expression) -> bool:
+    """
+    是否包含乘方；只有乘方可能在很少的节点内产生巨大的整数。
+    """
+    return any(isinstance(node, ast.Pow) for node in ast.walk(tree))
+
+
+def check_power(base, exponent):
+    """
+    计算整数乘方前估算结果位数，超过预算时拒绝计算。
+    """
+    if isinstance(base, int) and isinstance(exponent, int) and exponent > 0 and abs(base) > 1:
+        if exponent * math.log2(abs(base)) > settings.MATH_MAX_RESULT_BITS:
+            raise ValueError('结果过大')
+
+
+def check_size(value):
+    """
+    检查中间结果的整数位数。
+    """
+    if isinstance(value, int) and value.bit_length() > settings.MATH_MAX_RESULT_BITS:
+        raise ValueError('结果过大')
+    return value
+
+
+def evaluate_tree(node):
+    """
+    递归计算已通过预算检查的 AST。
+    """
+    if isinstance(node, ast.Expression):
+        return evaluate_tree(node.body)
+    if isinstance(node, ast.BinOp):
+        left, right = evaluate_tree(node.left), evaluate_tree(node.right)
+        if isinstance(node.op, ast.Pow):
+            check_power(left, right)
+        return check_size(BINARY_OPERATORS[type(node.op)](left, right))
+    if isinstance(node, ast.UnaryOp):
+        return UNARY_OPERATORS[type(node.op)](evaluate_tree(node.operand))
+    return node.value
+
+
+def evaluate_expression(expr: str) -> dict:
+    """
+    解析并计算算式，返回 MCP 格式响应。
+    """
     try:
-        node = ast.parse(expr, mode='eval')
-        def eval_(n):
-            if isinstance(n, ast.Expression):
-                return eval_(n.body)
-            elif isinstance(n, ast.BinOp):
-                left, right = eval_(n.left), eval_(n.right)
-                if isinstance(n.op, ast.Add): return operator.add(left, right)
-                if isinstance(n.op, ast.Sub): return operator.sub(left, right)
-                if isinstance(n.op, ast.Mult): return operator.mul(left, right)
-                if isinstance(n.op, ast.Div): return operator.truediv(left, right)
-                if isinstance(n.op, ast.Pow): return operator.pow(left, right)
-            elif isinstance(n, ast.UnaryOp):
-                if isinstance(n.op, ast.UAdd): return +eval_(n.operand)
-                if isinstance(n.op, ast.USub): return -eval_(n.operand)
-            elif isinstance(n, ast.Num):
-                return n.n
-            elif isinstance(n, ast.Constant):
-                return n.value
-            else:
-                raise ValueError('不支持的表达式')
-        result = eval_(node)
-        return {
-            "type": "mcp.math",
-            "status": "success",
-            "result": result,
-            "reason": None
-        }
+        return make_response("success", result=evaluate_tree(parse_expression(expr)))
     except Exception as e:
-        return {
-            "type": "mcp.math",
-            "status": "error",
-            "result": None,
-            "reason": str(e)
-        }
+        return make_response("error", reason=str(e))
+
+
+def evaluate_batch(expressions: List[str]) -> List[dict]:
+    """
+    在工作进程中批量计算算式。
+    """
+    return [evaluate_expression(expr) for expr in expressions]
+
+
+class MathEngine:
+    """
+    数学计算引擎：解析结果和计算结果进入 LRU 缓存；不含乘方的算式在当前进程直接计算，
+    含乘方的算式在独立的进程池中计算，超过硬超时的工作进程会被终止，
+    单个恶意算式不会占满服务进程的 CPU。
+    """
+    def __init__(self, workers: int = None, timeout: float = None, cache_size: int = None):
+        """
+        初始化 MathEngine。
+        :param workers: 计算进程数。
+        :param timeout: 单次（批量）计算的硬超时秒数。
+        :param cache_size: 最多缓存的算式数量。
+        """
+        self.workers = workers or settings.MATH_WORKERS
+        self.timeout = timeout or settings.MATH_TIMEOUT
+        self.cache_size = cache_size or settings.MATH_CACHE_SIZE
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        self._cache: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0  # 缓存命中次数
+        self.misses = 0  # 缓存未命中次数
+        self.timeouts = 0  # 超时被终止的计算次数
+
+    async def request(self, query: str) -> dict:
+        """
+        MCP请求：输入query字符串，返回MCP格式响应。
+        """
+        expr = extract_expression(query)
+        if expr is None:
+            return make_response("not_applicable", reason="not a math expression")
+        return (await self.evaluate_many([expr]))[0]
+
+    async def evaluate_many(self, expressions: List[str]) -> List[dict]:
+        """
+        批量计算算式，一次调用只向进程池提交一次。
+        :param expressions: 算式列表。
+        :return: 与输入顺序一致的 MCP 格式响应列表。
+        """
+        results: List[Optional[dict]] = [None] * len(expressions)
+        pending: "OrderedDict[str, List[int]]" = OrderedDict()
+        for index, expr in enumerate(expressions):
+            key = "".join(expr.split())
+            cached = self._get(key)
+            if cached is not None:
+                results[index] = cached
+            else:
+                pending.setdefault(key, []).append(index)
+        remote = []
+        for key in pending:
+            try:
+                tree = parse_expression(key)
+            except Exception as e:
+                self._finish(key, make_response("error", reason=str(e)), pending, results)
+                continue
+            if has_power(tree):
+                remote.append(key)
+            else:
+                # 只有加减乘除时节点数预算已足以限制计算量
+                try:
+                    response = make_response("success", result=evaluate_tree(tree))
+                except Exception as e:
+                    response = make_response("error", reason=str(e))
+                self._finish(key, response, pending, results)
+        if remote:
+            for key, response in zip(remote, await self._run_in_pool(remote)):
+                self._finish(key, response, pending, results, cache=response["reason"] not in TRANSIENT_REASONS)
+        return results
+
+    def stats(self) -> Dict[str, int]:
+        """
+        缓存和超时统计。
+        """
+        with self._lock:
+            return {
+                "entries": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "timeouts": self.timeouts,
+            }
+
+    def shutdown(self):
+        """
+        关闭计算进程池。
+        """
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            response = self._cache.get(key)
+            if response is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return response
+
+    def _finish(self, key: str, response: dict, pending: dict, results: list, cache: bool = True):
+        """
+        写入缓存并填充结果（结果和错误只取决于算式本身，也缓存，避免反复计算；超时等临时失败由调用方跳过缓存）。
+        """
+        if cache:
+            with self._lock:
+                self._cache[key] = response
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        for index in pending[key]:
+            results[index] = response
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                # spawn 启动的工作进程不继承服务进程的线程和事件循环
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._pool
+
+    def _terminate_pool(self, pool: ProcessPoolExecutor):
+        """
+        终止进程池中的工作进程（超时计算无法取消，只能结束进程），下次使用时重建。
+        """
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = None
+        for process in list((pool._processes or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    async def _run_in_pool(self, expressions: List[str], retry: bool = True) -> List[dict]:
+        loop = asyncio.get_running_loop()
+        pool = self._get_pool()
+        try:
+            return await asyncio.wait_for(
+                loop.run_in_executor(pool, evaluate_batch, expressions), self.timeout
+            )
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            self._terminate_pool(pool)
+            return [make_response("error", reason=TIMEOUT_REASON) for _ in expressions]
+        except BrokenProcessPool:
+            # 进程池因其他请求超时被终止，重建后重试一次
+            self._terminate_pool(pool)
+            if retry:
+                return await self._run_in_pool(expressions, retry=False)
+            return [make_response("error", reason=UNAVAILABLE_REASON) for _ in expressions]
+
+
+# 创建全局数学计算引擎实例
+math_engine = MathEngine()
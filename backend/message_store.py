@@ -0,0 +1,280 @@
+"""
+消息写入：保存消息并同步维护对话的汇总字段和上下文缓存
+"""
+# 导入所需的库
+import asyncio  # 后台批量写入任务
+import logging  # 写入失败日志
+from typing import Dict, List, Optional, Tuple  # 类型注解
+from sqlalchemy import insert, select, update  # 插入、查询和更新语句
+from sqlalchemy.exc import OperationalError  # 可重试的数据库错误（连接断开、锁等待超时等）
+from sqlalchemy.ext.asyncio import AsyncSession  # 异步数据库会话
+from sqlalchemy.sql import func  # SQL 函数
+from database import AsyncSessionLocal  # 异步数据库会话工厂
+from models import Conversation, Message  # ORM 模型
+from context_provider import context_provider  # 对话上下文缓存
+from search import search_index  # 全文搜索（维护内置倒排索引）
+from config import settings  # 导入配置项
+
+PREVIEW_LENGTH = 100  # 对话列表中最后一条消息预览的长度
+
+logger = logging.getLogger(__name__)
+
+
+def make_preview(content: str) -> str:
+    """
+    生成消息预览：合并换行，截断到 PREVIEW_LENGTH 个字符。
+    """
+    text = " ".join(content.split())
+    return text[:PREVIEW_LENGTH]
+
+
+async def update_conversation_summary(db: AsyncSession, conversation_id: int, count: int, last_content: str) -> Tuple[int, int]:
+    """
+    更新对话的消息数、最后一条消息预览和活跃时间（不提交），并为新消息分配序号。
+    message_count 同时作为对话内的序号分配器：自增语句持有对话行锁直到事务结束，
+    同一对话的并发写入按顺序拿到互不重叠的序号。
+    :return: (本次写入的第一条消息的序号, 对话所属用户ID)
+    """
+    # 用原子自增维护计数，并发写入同一对话时不会丢失
+    await db.execute(
+        update(Conversation)
+        .where(Conversation.id == conversation_id)
+        .values(
+            message_count=Conversation.message_count + count,
+            last_message_preview=make_preview(last_content),
+            updated_at=func.now(),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    result = await db.execute(
+        select(Conversation.message_count, Conversation.user_id).where(Conversation.id == conversation_id)
+    )
+    message_count, user_id = result.one()
+    return message_count - count + 1, user_id
+
+
+async def save_messages(db: AsyncSession, conversation_id: int, messages: List[Tuple[str, str]]) -> List[Message]:
+    """
+    在一个事务中保存消息，同时更新对话的消息数、最后一条消息预览和活跃时间，
+    提交后把消息追加到上下文缓存。
+    :param db: 异步数据库会话。
+    :param conversation_id: 对话ID。
+    :param messages: [(role, content), ...]，按时间顺序排列。
+    :return: 已保存的 Message 对象列表。
+    """
+    first_seq, user_id = await update_conversation_summary(db, conversation_id, len(messages), messages[-1][1])
+    rows = [
+        Message(content=content, role=role, conversation_id=conversation_id, seq=first_seq + offset)
+        for offset, (role, content) in enumerate(messages)
+    ]
+    db.add_all(rows)
+    if search_index.maintains_index:
+        await search_index.index_documents(db, [
+            term_row
+            for row in rows
+            for term_row in search_index.term_rows(user_id, conversation_id, row.seq, row.content)
+        ])
+    await db.commit()
+    for role, content in messages:
+        context_provider.append(conversation_id, role, content)
+    return rows
+
+
+class MessageWriter:
+    """
+    消息异步批量写入（write-behind）。
+    启用后消息先进入进程内有界队列，由后台任务按条数或时间阈值合并成多行 INSERT，
+    每批只提交一次；同一用户后续的读请求先等待其未落库的消息写入，保证读到自己的写入。
+    未启用或后台任务未运行时直接同步写入。
+    """
+    def __init__(self, enabled: bool = None, batch_size: int = None,
+                 flush_interval: float = None, max_pending: int = None,
+                 retries: int = None, retry_delay: float = None):
+        """
+        初始化 MessageWriter。
+        :param enabled: 是否启用异步批量写入。
+        :param batch_size: 每批最多写入的消息条数。
+        :param flush_interval: 收到第一条消息后最长等待多少秒即写入。
+        :param max_pending: 队列中最多积压的消息条数，满时写入方等待。
+        :param retries: 整批写入遇到可重试错误时的重试次数。
+        :param retry_delay: 第一次重试前等待的秒数，之后每次翻倍。
+        """
+        self.enabled = settings.MESSAGE_WRITE_BEHIND if enabled is None else enabled
+        self.batch_size = batch_size or settings.MESSAGE_WRITE_BATCH_SIZE
+        self.flush_interval = flush_interval or settings.MESSAGE_WRITE_FLUSH_INTERVAL
+        self.max_pending = max_pending or settings.MESSAGE_WRITE_MAX_PENDING
+        self.retries = settings.MESSAGE_WRITE_RETRIES if retries is None else retries
+        self.retry_delay = settings.MESSAGE_WRITE_RETRY_DELAY if retry_delay is None else retry_delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._flush_now: Optional[asyncio.Event] = None
+        self._written: Optional[asyncio.Condition] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pending: Dict[int, int] = {}  # user_id -> 未落库的消息数
+        self.batches = 0  # 已写入的批次数
+        self.written = 0  # 已写入的消息数
+        self.retried = 0  # 整批写入的重试次数
+        self.dropped = 0  # 写入失败被丢弃的消息数
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """
+        启动后台写入任务（需在事件循环中调用）。
+        """
+        if not self.enabled or self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._flush_now = asyncio.Event()
+        self._written = asyncio.Condition()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        停止后台写入任务，退出前写完队列中剩余的消息。
+        """
+        if not self.running:
+            return
+        await self._queue.put(None)  # 结束标记，排在所有已入队消息之后
+        self._flush_now.set()
+        await self._task
+        self._task = None
+
+    async def save(self, db: Optional[AsyncSession], user_id: int, conversation_id: int,
+                   messages: List[Tuple[str, str]]) -> Optional[List[Message]]:
+        """
+        保存消息。启用异步批量写入时只入队并立即更新上下文缓存，返回 None；
+        否则在给定会话（为 None 时新建会话）中同步写入并返回 Message 对象列表。
+        """
+        if not self.running:
+            if db is not None:
+                return await save_messages(db, conversation_id, messages)
+            async with AsyncSessionLocal() as db:
+                return await save_messages(db, conversation_id, messages)
+        self._pending[user_id] = self._pending.get(user_id, 0) + len(messages)
+        for role, content in messages:
+            await self._queue.put((user_id, conversation_id, role, content))
+            # 入队即更新上下文缓存，下一轮对话无需等待落库
+            context_provider.append(conversation_id, role, content)
+        if self._queue.qsize() >= self.batch_size:
+            self._flush_now.set()
+        return None
+
+    async def sync(self, user_id: int):
+        """
+        等待用户所有未落库的消息写入数据库（读请求前调用）。
+        """
+        if not self.running or not self._pending.get(user_id):
+            return
+        self._flush_now.set()
+        async with self._written:
+            await self._written.wait_for(lambda: not self._pending.get(user_id))
+
+    def stats(self) -> Dict[str, int]:
+        """
+        写入统计。
+        """
+        return {
+            "enabled": self.enabled,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "batches": self.batches,
+            "written": self.written,
+            "retried": self.retried,
+            "dropped": self.dropped,
+        }
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [await self._queue.get()]
+            if batch[0] is None:
+                break
+            # 等到攒满一批、有读请求要求立即写入，或到达时间阈值
+            if not self._flush_now.is_set():
+                try:
+                    await asyncio.wait_for(self._flush_now.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._flush_now.clear()
+            while len(batch) < self.batch_size and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._write(batch)
+
+    async def _write(self, batch: List[tuple]):
+        """
+        把一批消息写入数据库：可重试的错误（连接断开、锁等待超时等）按退避间隔重试整批；
+        仍失败或遇到其他错误时逐条写入，只丢弃逐条写入仍失败的消息（如对话已被删除）。
+        """
+        try:
+            try:
+                await self._insert_with_retry(batch)
+            except Exception:
+                logger.warning("批量写入 %d 条消息失败，改为逐条写入", len(batch), exc_info=True)
+                for item in batch:
+                    try:
+                        await self._insert([item])
+                    except Exception:
+                        logger.error("写入消息失败，已丢弃（conversation_id=%s, role=%s）", item[1], item[2],
+                                     exc_info=True)
+                        self.dropped += 1
+                        # 上下文缓存中已包含这条消息，失效后从数据库重新加载
+                        context_provider.invalidate(item[1])
+        finally:
+            for user_id, *_ in batch:
+                self._pending[user_id] -= 1
+                if not self._pending[user_id]:
+                    del self._pending[user_id]
+            async with self._written:
+                self._written.notify_all()
+
+    async def _insert_with_retry(self, batch: List[tuple]):
+        """
+        写入一批消息，遇到可重试的错误时等待后重试（每次写入是独立事务，失败时整批回滚，重试不会重复写入）。
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                await self._insert(batch)
+                return
+            except OperationalError:
+                if attempt == self.retries:
+                    raise
+                delay = self.retry_delay * 2 ** attempt
+                logger.warning("写入 %d 条消息失败，%.1f 秒后重试", len(batch), delay, exc_info=True)
+                self.retried += 1
+                await asyncio.sleep(delay)
+
+    async def _insert(self, batch: List[tuple]):
+        # 按对话合并汇总字段：[消息数, 最后一条内容]
+        summaries: Dict[int, list] = {}
+        for _, conversation_id, _, content in batch:
+            summary = summaries.setdefault(conversation_id, [0, content])
+            summary[0] += 1
+            summary[1] = content
+        async with AsyncSessionLocal() as db:
+            # 按对话ID顺序加行锁并分配序号
+            next_seq = {}
+            for conversation_id in sorted(summaries):
+                count, last_content = summaries[conversation_id]
+                next_seq[conversation_id], _ = await update_conversation_summary(db, conversation_id, count, last_content)
+            rows, term_rows = [], []
+            for user_id, conversation_id, role, content in batch:
+                seq = next_seq[conversation_id]
+                rows.append({"conversation_id": conversation_id, "role": role, "content": content, "seq": seq})
+                if search_index.maintains_index:
+                    term_rows.extend(search_index.term_rows(user_id, conversation_id, seq, content))
+                next_seq[conversation_id] += 1
+            # executemany 由驱动合并成多行 INSERT，整批只提交一次
+            await db.execute(insert(Message), rows)
+            await search_index.index_documents(db, term_rows)
+            await db.commit()
+        self.batches += 1
+        self.written += len(batch)
+
+
+# 创建全局消息写入实例
+message_writer = MessageWriter()
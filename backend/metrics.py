@@ -0,0 +1,306 @@
+"""
+Prometheus 文本格式指标：计数器和直方图按线程分片，记录时不加锁，/metrics 读取时合并各分片；
+缓存、准入控制等模块已有的统计在读取时通过回调导出
+"""
+# 导入所需的库
+import logging  # 日志
+import threading  # 线程分片
+import time       # 请求耗时
+from bisect import bisect_left  # 直方图分桶
+from typing import Callable, Dict, Iterable, List, Optional, Tuple  # 类型注解
+
+logger = logging.getLogger(__name__)
+
+# 默认的耗时分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 数据库查询和连接池等待的分桶（秒）
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+# 生成速度的分桶（tokens/s）
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 200, 500, 1000, 5000)
+
+
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    """
+    编码标签，转义反斜杠、双引号和换行。
+    """
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def format_value(value: float) -> str:
+    if isinstance(value, bool):
+        return str(int(value))
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    分片存储的指标：每个线程写自己的分片（dict），不需要锁；读取时合并所有分片。
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: List[dict] = []
+        self._shards_lock = threading.Lock()  # 只在线程首次写入、创建分片时使用
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            return shard
+
+    def _snapshots(self) -> List[list]:
+        with self._shards_lock:
+            shards = list(self._shards)
+        # list(dict.items()) 在持有 GIL 时一次完成，分片所属线程同时写入也不会出错
+        return [list(shard.items()) for shard in shards]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """
+    单调递增的计数器。
+    """
+    kind = "counter"
+
+    def inc(self, amount: float = 1, labels: Tuple[str, ...] = ()):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        totals: Dict[tuple, float] = {}
+        for items in self._snapshots():
+            for labels, value in items:
+                totals[labels] = totals.get(labels, 0) + value
+        return [f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}"
+                for labels, value in sorted(totals.items())]
+
+
+class Histogram(Metric):
+    """
+    直方图：每个分片按标签保存 [各桶计数..., 总和, 总数]，输出时累加成 Prometheus 的累计桶。
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, labels: Tuple[str, ...] = ()):
+        shard = self._shard()
+        data = shard.get(labels)
+        if data is None:
+            data = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        data[bisect_left(self.buckets, value)] += 1
+        data[-2] += value
+        data[-1] += 1
+
+    def render(self) -> List[str]:
+        size = len(self.buckets) + 3
+        totals: Dict[tuple, list] = {}
+        for items in self._snapshots():
+            for labels, data in items:
+                merged = totals.setdefault(labels, [0] * size)
+                for index, value in enumerate(list(data)):
+                    merged[index] += value
+        lines = []
+        for labels, data in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), data):
+                cumulative += count
+                bucket_labels = format_labels(self.labelnames + ("le",), labels + (format_value(float(bound)),))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            label_text = format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {format_value(data[-2])}")
+            lines.append(f"{self.name}_count{label_text} {data[-1]}")
+        return lines
+
+
+class GaugeFunc(Metric):
+    """
+    读取时由回调给出当前值的仪表（如进行中的请求数），记录路径上没有任何开销。
+    回调返回 [(标签值元组, 数值), ...]。
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...],
+                 func: Callable[[], Iterable[Tuple[tuple, float]]]):
+        super().__init__(name, help_text, labelnames)
+        self.func = func
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}"
+                for labels, value in self.func()]
+
+
+class MetricsRegistry:
+    """
+    指标注册表：管理所有指标和统计回调，生成 /metrics 的文本。
+    """
+    def __init__(self, prefix: str = "aichat"):
+        self.prefix = prefix
+        self._metrics: List[Metric] = []
+        self._stats: List[Tuple[str, Callable[[], dict], Dict[str, str]]] = []
+
+    def counter(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._add(Counter(f"{self.prefix}_{name}", help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(f"{self.prefix}_{name}", help_text, labelnames, buckets))
+
+    def gauge(self, name: str, help_text: str, labelnames: Tuple[str, ...],
+              func: Callable[[], Iterable[Tuple[tuple, float]]]) -> GaugeFunc:
+        return self._add(GaugeFunc(f"{self.prefix}_{name}", help_text, labelnames, func))
+
+    def register_stats(self, name: str, func: Callable[[], dict], labels: Dict[str, str] = None):
+        """
+        导出模块已有的 stats() 统计：数值项导出为 <prefix>_<name>_<key>，
+        值为数值字典的项（如按原因统计的拒绝数）导出为带 key 标签的同名指标；
+        值为字典的字典的项（如按工具统计的命中数）按内层字段展开：labels 为该项指定了标签名时
+        导出为 <prefix>_<name>_<字段>{<标签名>="..."}，否则导出为 <prefix>_<name>_<key>_<字段>{key="..."}。
+        """
+        self._stats.append((name, func, labels or {}))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        for name, func, labels in self._stats:
+            try:
+                stats = func()
+            except Exception as e:
+                logger.warning("读取 %s 统计失败: %s", name, e)
+                continue
+            for key, value in stats.items():
+                metric_name = f"{self.prefix}_{name}_{key}"
+                if isinstance(value, (bool, int, float)):
+                    lines.append(f"# TYPE {metric_name} gauge")
+                    lines.append(f"{metric_name} {format_value(value)}")
+                elif isinstance(value, dict) and all(isinstance(v, (bool, int, float)) for v in value.values()):
+                    lines.append(f"# TYPE {metric_name} gauge")
+                    lines.extend(f"{metric_name}{format_labels(('key',), (k,))} {format_value(v)}"
+                                 for k, v in value.items())
+                elif isinstance(value, dict) and all(isinstance(v, dict) for v in value.values()):
+                    lines.extend(self._render_nested(name, key, value, labels.get(key)))
+        return "\n".join(lines) + "\n"
+
+    def _render_nested(self, name: str, key: str, value: Dict[str, dict], label: Optional[str]) -> List[str]:
+        """
+        展开字典的字典：每个内层数值字段一个指标，外层键作为标签。
+        """
+        prefix = f"{self.prefix}_{name}" if label else f"{self.prefix}_{name}_{key}"
+        label = label or "key"
+        fields = dict.fromkeys(
+            field for inner in value.values() for field, v in inner.items() if isinstance(v, (bool, int, float))
+        )
+        lines = []
+        for field in fields:
+            metric_name = f"{prefix}_{field}"
+            lines.append(f"# TYPE {metric_name} gauge")
+            lines.extend(f"{metric_name}{format_labels((label,), (k,))} {format_value(inner[field])}"
+                         for k, inner in value.items() if isinstance(inner.get(field), (bool, int, float)))
+        return lines
+
+    def _add(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+
+class MetricsMiddleware:
+    """
+    记录每个请求的耗时（按方法、路由模板和状态码）。纯 ASGI 中间件，流式响应统计到最后一个分片发送完毕。
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            # 使用路由模板（如 /conversations/{conversation_id}），避免标签基数随 ID 增长
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, (scope["method"], path, str(status_code)))
+
+
+# 创建全局指标注册表和各模块使用的指标
+metrics = MetricsRegistry()
+HTTP_REQUEST_DURATION = metrics.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"))
+DB_QUERY_DURATION = metrics.histogram(
+    "db_query_duration_seconds", "Database query latency by statement type", ("operation",), DB_BUCKETS)
+DB_QUERY_ERRORS = metrics.counter(
+    "db_query_errors_total", "Database queries that raised an error", ("operation",))
+DB_POOL_CHECKOUT_WAIT = metrics.histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a database connection from the pool", (), DB_BUCKETS)
+OLLAMA_REQUEST_DURATION = metrics.histogram(
+    "ollama_request_duration_seconds", "Ollama upstream request latency (whole stream for streaming requests)",
+    ("endpoint", "outcome"))
+OLLAMA_TTFT = metrics.histogram(
+    "ollama_time_to_first_token_seconds",
+    "Time to first token: measured for streams, load_duration + prompt_eval_duration otherwise", ("mode",))
+OLLAMA_LOAD_DURATION = metrics.histogram(
+    "ollama_load_duration_seconds", "Model load time reported by Ollama", ())
+OLLAMA_TOKENS = metrics.counter(
+    "ollama_tokens_total", "Tokens processed by Ollama", ("kind",))
+OLLAMA_TOKENS_PER_SECOND = metrics.histogram(
+    "ollama_tokens_per_second", "Ollama throughput per request (eval: generation, prompt: prefill)",
+    ("kind",), RATE_BUCKETS)
+
+
+def record_generation(result: dict, mode: str):
+    """
+    记录 Ollama 在最后一个分片（或非流式响应）中返回的计数和耗时（纳秒）。
+    :param result: Ollama 返回的 JSON。
+    :param mode: stream 或 generate；stream 的首 token 时间由调用方实测，这里不再推算。
+    """
+    eval_count = result.get("eval_count") or 0
+    eval_duration = result.get("eval_duration") or 0
+    prompt_count = result.get("prompt_eval_count") or 0
+    prompt_duration = result.get("prompt_eval_duration") or 0
+    load_duration = result.get("load_duration") or 0
+    if eval_count:
+        OLLAMA_TOKENS.inc(eval_count, ("eval",))
+        if eval_duration:
+            OLLAMA_TOKENS_PER_SECOND.observe(eval_count / eval_duration * 1e9, ("eval",))
+    if prompt_count:
+        OLLAMA_TOKENS.inc(prompt_count, ("prompt",))
+        if prompt_duration:
+            OLLAMA_TOKENS_PER_SECOND.observe(prompt_count / prompt_duration * 1e9, ("prompt",))
+    if load_duration:
+        OLLAMA_LOAD_DURATION.observe(load_duration / 1e9)
+    if mode != "stream" and (load_duration or prompt_duration):
+        OLLAMA_TTFT.observe((load_duration + prompt_duration) / 1e9, (mode,))
@@ -0,0 +1,57 @@
+"""
+Alembic 迁移环境：使用 config.settings.DATABASE_URL 连接数据库，以 ORM 模型作为目标表结构
+"""
+# 导入所需的库
+from logging.config import fileConfig  # 日志配置
+from alembic import context  # 迁移上下文
+from sqlalchemy import create_engine, pool  # 数据库引擎
+from config import settings  # 导入配置项
+from database import Base  # ORM 模型基类
+import models  # noqa: F401  注册所有 ORM 模型
+
+config = context.config
+
+# 读取 alembic.ini 中的日志配置
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+# 自动生成迁移时比较的目标表结构
+target_metadata = Base.metadata
+
+
+def run_migrations_offline():
+    """
+    离线模式：只输出 SQL 语句，不连接数据库。
+    """
+    context.configure(
+        url=settings.DATABASE_URL,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+        render_as_batch=settings.DATABASE_URL.startswith("sqlite"),
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    """
+    在线模式：连接数据库执行迁移。
+    使用独立的引擎（不开启 SQLite 外键检查），批量模式重建表时不会触发级联删除。
+    """
+    connectable = create_engine(settings.DATABASE_URL, poolclass=pool.NullPool)
+    with connectable.connect() as connection:
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            # SQLite 不支持大部分 ALTER TABLE，使用批量模式重建表
+            render_as_batch=connection.dialect.name == "sqlite",
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
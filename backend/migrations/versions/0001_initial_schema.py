@@ -0,0 +1,69 @@
+"""initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 00:00:00
+
+与基线 database/init.sql 建出的表结构一致。
+已有数据库（由 init.sql 或 create_all 建表）先执行 `alembic stamp 0001`，再执行 `alembic upgrade head`。
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# Alembic 使用的版本标识
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # MySQL 的 updated_at 在行更新时自动刷新（ON UPDATE CURRENT_TIMESTAMP）
+    if op.get_bind().dialect.name == "mysql":
+        updated_default = sa.text("CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP")
+    else:
+        updated_default = sa.func.current_timestamp()
+
+    # 用户表
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("username", sa.String(50), nullable=False, unique=True),
+        sa.Column("email", sa.String(100), nullable=False, unique=True),
+        sa.Column("hashed_password", sa.String(255), nullable=False),
+        sa.Column("is_active", sa.Boolean(), server_default=sa.true()),
+        sa.Column("created_at", sa.TIMESTAMP(), server_default=sa.func.current_timestamp()),
+    )
+
+    # 对话表
+    op.create_table(
+        "conversations",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("title", sa.String(200), nullable=False),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("created_at", sa.TIMESTAMP(), server_default=sa.func.current_timestamp()),
+        sa.Column("updated_at", sa.TIMESTAMP(), server_default=updated_default),
+    )
+
+    # 消息表
+    op.create_table(
+        "messages",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("content", sa.Text(), nullable=False),
+        sa.Column("role", sa.String(20), nullable=False),
+        sa.Column("conversation_id", sa.Integer(), sa.ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("created_at", sa.TIMESTAMP(), server_default=sa.func.current_timestamp()),
+    )
+
+    # 索引
+    op.create_index("idx_users_username", "users", ["username"])
+    op.create_index("idx_users_email", "users", ["email"])
+    op.create_index("idx_conversations_user_id", "conversations", ["user_id"])
+    op.create_index("idx_messages_conversation_id", "messages", ["conversation_id"])
+    op.create_index("idx_messages_created_at", "messages", ["created_at"])
+
+
+def downgrade():
+    op.drop_table("messages")
+    op.drop_table("conversations")
+    op.drop_table("users")
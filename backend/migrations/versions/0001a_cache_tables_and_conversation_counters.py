@@ -0,0 +1,105 @@
+"""cache tables and conversation counters
+
+Revision ID: 0001a
+Revises: 0001
+Create Date: 2026-10-17 00:00:00
+
+基线之后、引入 Alembic 之前新增的表结构（已部署的数据库执行 `alembic stamp 0001` 后由本迁移补齐）：
+- conversation_contexts 表：对话 KV context 缓存
+- response_cache 表：AI 回复缓存
+- conversations 回填为 NULL 的 updated_at 并设为 NOT NULL
+- conversations 增加 message_count、last_message_preview，按已有消息回填；(user_id, updated_at, id) 索引
+已经存在的列、表和索引（如由 create_all 建表的数据库）会跳过。
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+# Alembic 使用的版本标识
+revision = "0001a"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+# 与 message_store.PREVIEW_LENGTH 一致
+PREVIEW_LENGTH = 100
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+
+    # 对话 KV context 表
+    if "conversation_contexts" not in tables:
+        op.create_table(
+            "conversation_contexts",
+            sa.Column("conversation_id", sa.Integer(),
+                      sa.ForeignKey("conversations.id", ondelete="CASCADE", name="fk_conversation_contexts_conversation_id_conversations"),
+                      primary_key=True),
+            sa.Column("model", sa.String(100)),
+            sa.Column("context", sa.Text().with_variant(mysql.MEDIUMTEXT(), "mysql")),
+            sa.Column("token_count", sa.Integer()),
+            sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+
+    # AI 回复缓存表
+    if "response_cache" not in tables:
+        op.create_table(
+            "response_cache",
+            sa.Column("cache_key", sa.String(64), primary_key=True),
+            sa.Column("model", sa.String(100)),
+            sa.Column("response", sa.Text()),
+            sa.Column("expires_at", sa.DateTime()),
+        )
+        op.create_index("ix_response_cache_expires_at", "response_cache", ["expires_at"])
+
+    columns = {column["name"]: column for column in inspector.get_columns("conversations")}
+    # 基线 ORM 的 updated_at 没有服务端默认值，create_all 建的库中已有行可能为 NULL，
+    # 分页排序和游标都依赖它：按最后一条消息时间、创建时间回填，然后设为 NOT NULL（没有默认值时补上）
+    op.execute(
+        "UPDATE conversations SET updated_at = COALESCE(updated_at, "
+        "(SELECT MAX(m.created_at) FROM messages m WHERE m.conversation_id = conversations.id), "
+        "created_at, CURRENT_TIMESTAMP) WHERE updated_at IS NULL"
+    )
+    updated_at = columns["updated_at"]
+    if updated_at["nullable"]:
+        with op.batch_alter_table("conversations") as batch_op:
+            if updated_at["default"]:
+                batch_op.alter_column("updated_at", existing_type=updated_at["type"], nullable=False,
+                                      existing_server_default=sa.text(updated_at["default"]))
+            else:
+                batch_op.alter_column("updated_at", existing_type=updated_at["type"], nullable=False,
+                                      server_default=sa.func.current_timestamp())
+
+    # 对话汇总字段；回填时显式保留 updated_at，MySQL 的 ON UPDATE CURRENT_TIMESTAMP 不会把所有对话刷新为当前时间
+    if "message_count" not in columns:
+        op.add_column("conversations", sa.Column("message_count", sa.Integer(), nullable=False, server_default="0"))
+    if "last_message_preview" not in columns:
+        op.add_column("conversations", sa.Column("last_message_preview", sa.String(200)))
+    op.execute(
+        "UPDATE conversations SET updated_at = updated_at, message_count = "
+        "(SELECT COUNT(*) FROM messages WHERE messages.conversation_id = conversations.id)"
+    )
+    op.execute(
+        f"UPDATE conversations SET updated_at = updated_at, last_message_preview = (SELECT SUBSTR(m.content, 1, {PREVIEW_LENGTH}) "
+        "FROM messages m WHERE m.conversation_id = conversations.id ORDER BY m.created_at DESC, m.id DESC LIMIT 1) "
+        "WHERE last_message_preview IS NULL"
+    )
+    indexes = {index["name"] for index in inspector.get_indexes("conversations")}
+    if "idx_conversations_user_updated" not in indexes:
+        op.create_index("idx_conversations_user_updated", "conversations", ["user_id", "updated_at", "id"])
+
+
+def downgrade():
+    updated_at = next(column for column in sa.inspect(op.get_bind()).get_columns("conversations")
+                      if column["name"] == "updated_at")
+    op.drop_index("idx_conversations_user_updated", table_name="conversations")
+    with op.batch_alter_table("conversations") as batch_op:
+        batch_op.drop_column("last_message_preview")
+        batch_op.drop_column("message_count")
+        batch_op.alter_column(
+            "updated_at", existing_type=updated_at["type"], nullable=True,
+            existing_server_default=sa.text(updated_at["default"]) if updated_at["default"] else None
+        )
+    op.drop_table("response_cache")
+    op.drop_table("conversation_contexts")
@@ -0,0 +1,97 @@
+"""message seq, composite indexes and cascading deletes
+
+Revision ID: 0002
+Revises: 0001a
+Create Date: 2026-10-17 00:00:00
+
+- messages 增加对话内序号 seq，按 (created_at, id) 回填，建立 (conversation_id, seq) 唯一索引
+- conversations.message_count 按实际消息数回填（同时作为序号分配器）
+- messages.conversation_id、conversations.user_id 外键改为 ON DELETE CASCADE
+- 删除被组合索引覆盖的单列索引
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# Alembic 使用的版本标识
+revision = "0002"
+down_revision = "0001a"
+branch_labels = None
+depends_on = None
+
+# SQLite 的外键没有名称，批量模式按此约定命名后才能删除
+NAMING_CONVENTION = {"fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s"}
+
+# 被 (conversation_id, seq) 和 (user_id, updated_at, id) 覆盖的旧索引（部分只由 init.sql 创建）
+REDUNDANT_INDEXES = {
+    "messages": ["idx_messages_conversation_created", "idx_messages_conversation_id", "idx_messages_created_at"],
+    "conversations": ["idx_conversations_user_id"],
+}
+
+
+def foreign_key_name(table: str, column: str, referred_table: str):
+    """
+    查找列上现有外键的名称；SQLite 外键没有名称时返回按命名约定生成的名称。
+    """
+    for fk in sa.inspect(op.get_bind()).get_foreign_keys(table):
+        if fk["constrained_columns"] == [column]:
+            return fk["name"] or f"fk_{table}_{column}_{referred_table}"
+    return None
+
+
+def replace_foreign_key(table: str, column: str, referred_table: str, ondelete=None, alter_seq=None):
+    """
+    重建外键以修改 ON DELETE 行为（SQLite 通过批量模式重建表）。
+    """
+    existing = foreign_key_name(table, column, referred_table)
+    with op.batch_alter_table(table, naming_convention=NAMING_CONVENTION) as batch_op:
+        if alter_seq is not None:
+            batch_op.alter_column("seq", existing_type=sa.Integer(), nullable=alter_seq)
+        if existing:
+            batch_op.drop_constraint(existing, type_="foreignkey")
+        batch_op.create_foreign_key(
+            f"fk_{table}_{column}_{referred_table}", referred_table, [column], ["id"], ondelete=ondelete
+        )
+
+
+def upgrade():
+    bind = op.get_bind()
+    op.add_column("messages", sa.Column("seq", sa.Integer(), nullable=True))
+
+    # 回填序号：每个对话内按 (created_at, id) 从 1 开始编号
+    if bind.dialect.name == "mysql":
+        # MySQL 不允许 UPDATE 的子查询引用被更新的表，改用 JOIN 派生表
+        op.execute(
+            "UPDATE messages m JOIN ("
+            "SELECT id, ROW_NUMBER() OVER (PARTITION BY conversation_id ORDER BY created_at, id) AS seq "
+            "FROM messages) s ON s.id = m.id SET m.seq = s.seq"
+        )
+    else:
+        op.execute(
+            "UPDATE messages SET seq = (SELECT s.seq FROM ("
+            "SELECT id, ROW_NUMBER() OVER (PARTITION BY conversation_id ORDER BY created_at, id) AS seq "
+            "FROM messages) AS s WHERE s.id = messages.id)"
+        )
+    op.execute(
+        "UPDATE conversations SET message_count = "
+        "(SELECT COUNT(*) FROM messages WHERE messages.conversation_id = conversations.id)"
+    )
+
+    op.create_index("idx_messages_conversation_seq", "messages", ["conversation_id", "seq"], unique=True)
+    replace_foreign_key("messages", "conversation_id", "conversations", ondelete="CASCADE", alter_seq=False)
+    replace_foreign_key("conversations", "user_id", "users", ondelete="CASCADE")
+
+    inspector = sa.inspect(bind)
+    for table, names in REDUNDANT_INDEXES.items():
+        existing = {index["name"] for index in inspector.get_indexes(table)}
+        for name in names:
+            if name in existing:
+                op.drop_index(name, table_name=table)
+
+
+def downgrade():
+    op.create_index("idx_messages_conversation_created", "messages", ["conversation_id", "created_at", "id"])
+    replace_foreign_key("conversations", "user_id", "users")
+    replace_foreign_key("messages", "conversation_id", "conversations", alter_seq=True)
+    op.drop_index("idx_messages_conversation_seq", table_name="messages")
+    with op.batch_alter_table("messages") as batch_op:
+        batch_op.drop_column("seq")
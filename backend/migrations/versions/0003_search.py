@@ -0,0 +1,99 @@
+"""full-text search indexes
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 00:00:00
+
+- MySQL：messages.content、conversations.title 建立 FULLTEXT 索引（ngram 解析器，支持中文）
+- 其他数据库（或 MySQL 上显式设置 SEARCH_BACKEND=index）：创建内置倒排索引表 search_terms
+  并为已有消息和对话标题建立索引
+"""
+import os  # 读取 SEARCH_BACKEND
+import re  # 分词
+from collections import Counter
+from typing import List
+from alembic import op
+import sqlalchemy as sa
+
+# Alembic 使用的版本标识
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH = 1000  # 回填倒排索引时每批处理的文档数
+
+# 本迁移创建时的分词规则（冻结副本，不随应用的 search.tokenize 变化）
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+|[\u3400-\u4dbf\u4e00-\u9fff]+")
+CJK_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]")
+MAX_TERM_LENGTH = 32
+
+
+def tokenize(content: str) -> List[str]:
+    """
+    英文按单词（小写），中文按相邻二字组，单个汉字单独成词。
+    """
+    terms = []
+    for run in TOKEN_PATTERN.findall(content.lower()):
+        if CJK_PATTERN.match(run) and len(run) > 1:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            terms.append(run[:MAX_TERM_LENGTH])
+    return terms
+
+
+def uses_term_index(bind) -> bool:
+    """
+    是否使用内置倒排索引：MySQL 默认使用 FULLTEXT，不读取 search_terms。
+    """
+    return bind.dialect.name != "mysql" or os.getenv("SEARCH_BACKEND", "auto") == "index"
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == "mysql":
+        op.execute("CREATE FULLTEXT INDEX ft_messages_content ON messages (content) WITH PARSER ngram")
+        op.execute("CREATE FULLTEXT INDEX ft_conversations_title ON conversations (title) WITH PARSER ngram")
+    if not uses_term_index(bind):
+        return
+
+    search_terms = op.create_table(
+        "search_terms",
+        sa.Column("user_id", sa.Integer(), primary_key=True),
+        sa.Column("term", sa.String(32), primary_key=True),
+        sa.Column("conversation_id", sa.Integer(),
+                  sa.ForeignKey("conversations.id", ondelete="CASCADE", name="fk_search_terms_conversation_id_conversations"),
+                  primary_key=True),
+        sa.Column("seq", sa.Integer(), primary_key=True),
+        sa.Column("tf", sa.Integer(), nullable=False),
+    )
+    op.create_index("idx_search_terms_conversation", "search_terms", ["conversation_id", "seq"])
+
+    # 回填内置倒排索引：对话标题的 seq 为 0
+    documents = bind.execute(sa.text(
+        "SELECT c.user_id, c.id, 0, c.title FROM conversations c "
+        "UNION ALL "
+        "SELECT c.user_id, m.conversation_id, m.seq, m.content FROM messages m "
+        "JOIN conversations c ON c.id = m.conversation_id"
+    ))
+    while True:
+        chunk = documents.fetchmany(BACKFILL_BATCH)
+        if not chunk:
+            break
+        rows = [
+            {"user_id": user_id, "term": term, "conversation_id": conversation_id, "seq": seq, "tf": tf}
+            for user_id, conversation_id, seq, content in chunk
+            for term, tf in Counter(tokenize(content or "")).items()
+        ]
+        if rows:
+            op.bulk_insert(search_terms, rows)
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == "mysql":
+        op.drop_index("ft_conversations_title", table_name="conversations")
+        op.drop_index("ft_messages_content", table_name="messages")
+    if "search_terms" in sa.inspect(bind).get_table_names():
+        op.drop_index("idx_search_terms_conversation", table_name="search_terms")
+        op.drop_table("search_terms")
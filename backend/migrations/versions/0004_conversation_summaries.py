@@ -0,0 +1,33 @@
+"""rolling conversation summaries
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 00:00:00
+
+- 新增 conversation_summaries 表：每个对话一行滚动摘要，covered_seq 记录摘要覆盖到的消息序号
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# Alembic 使用的版本标识
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "conversation_summaries",
+        sa.Column("conversation_id", sa.Integer(),
+                  sa.ForeignKey("conversations.id", ondelete="CASCADE", name="fk_conversation_summaries_conversation_id_conversations"),
+                  primary_key=True),
+        sa.Column("summary", sa.Text()),
+        sa.Column("covered_seq", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("model", sa.String(100)),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+
+
+def downgrade():
+    op.drop_table("conversation_summaries")
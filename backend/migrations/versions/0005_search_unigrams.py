@@ -0,0 +1,80 @@
+"""index single CJK characters in search_terms
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 00:00:00
+
+- 内置倒排索引 search_terms 除中文二字组外，每个汉字也单独成词，单字查询能命中词中的汉字；
+  按新的分词规则重建已有消息和对话标题的索引（MySQL 使用 FULLTEXT 时没有该表，跳过）
+"""
+import re  # 分词
+from collections import Counter
+from typing import List
+from alembic import op
+import sqlalchemy as sa
+
+# Alembic 使用的版本标识
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH = 1000  # 重建倒排索引时每批处理的文档数
+
+# 本迁移创建时的分词规则（冻结副本，不随应用的 search.tokenize 变化）
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+|[\u3400-\u4dbf\u4e00-\u9fff]+")
+CJK_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]")
+MAX_TERM_LENGTH = 32
+
+
+def tokenize(content: str) -> List[str]:
+    """
+    英文按单词（小写），中文按相邻二字组，每个汉字也单独成词。
+    """
+    terms = []
+    for run in TOKEN_PATTERN.findall(content.lower()):
+        if not CJK_PATTERN.match(run):
+            terms.append(run[:MAX_TERM_LENGTH])
+            continue
+        if len(run) > 1:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+        terms.extend(run)
+    return terms
+
+
+def upgrade():
+    bind = op.get_bind()
+    if "search_terms" not in sa.inspect(bind).get_table_names():
+        return
+    search_terms = sa.table(
+        "search_terms",
+        sa.column("user_id", sa.Integer()),
+        sa.column("term", sa.String(32)),
+        sa.column("conversation_id", sa.Integer()),
+        sa.column("seq", sa.Integer()),
+        sa.column("tf", sa.Integer()),
+    )
+    op.execute("DELETE FROM search_terms")
+    # 对话标题的 seq 为 0
+    documents = bind.execute(sa.text(
+        "SELECT c.user_id, c.id, 0, c.title FROM conversations c "
+        "UNION ALL "
+        "SELECT c.user_id, m.conversation_id, m.seq, m.content FROM messages m "
+        "JOIN conversations c ON c.id = m.conversation_id"
+    ))
+    while True:
+        chunk = documents.fetchmany(BACKFILL_BATCH)
+        if not chunk:
+            break
+        rows = [
+            {"user_id": user_id, "term": term, "conversation_id": conversation_id, "seq": seq, "tf": tf}
+            for user_id, conversation_id, seq, content in chunk
+            for term, tf in Counter(tokenize(content or "")).items()
+        ]
+        if rows:
+            op.bulk_insert(search_terms, rows)
+
+
+def downgrade():
+    # 多出的单字词不影响旧版本的查询（旧版本只对单独的汉字查询单字），保留即可
+    pass
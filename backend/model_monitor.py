@@ -0,0 +1,196 @@
+"""
+Ollama 模型状态后台监控
+"""
+# 导入所需的库
+import logging  # 日志
+import asyncio  # 后台任务与事件
+import time     # 记录检查时间
+from typing import Dict, Any, List, Set  # 类型注解
+from config import settings  # 导入配置项
+
+logger = logging.getLogger(__name__)
+
+
+class ModelMonitor:
+    """
+    ModelMonitor 在后台定时检查每个 Ollama 实例的可达性、可用模型列表和模型加载状态（同时作为负载均衡的健康检查），
+    聊天接口和 /ai/status 直接读取缓存的状态，不再在请求中探测模型。
+    """
+    def __init__(self, service, interval: float = None):
+        """
+        初始化 ModelMonitor。
+        :param service: 被监控的 Ollama 服务（提供 pool 和 model）。
+        :param interval: 检查间隔（秒）。
+        """
+        self.service = service
+        self.interval = interval or settings.OLLAMA_MONITOR_INTERVAL
+        self._status: Dict[str, Any] = {
+            "checked": False,  # 是否已完成过至少一次检查
+            "connected": False,  # Ollama 服务是否可达
+            "available_models": [],  # 已下载的模型
+            "loaded_models": [],  # 当前已加载到内存的模型
+            "model_available": False,  # 当前模型是否已下载
+            "model_loaded": False,  # 当前模型是否已加载
+            "checked_at": None,  # 最近一次检查时间戳
+            "error": None,  # 最近一次检查的错误信息
+            "endpoints": [],  # 各实例的健康状态和已加载模型
+        }
+        self._task = None
+        self._wakeup = None
+        self._warmup_tasks: Dict[str, asyncio.Task] = {}  # 实例地址 -> 预加载任务
+        self._warmed: Set[str] = set()  # 本次可用期间已处理过预加载的实例地址
+        self._subscribers: Set[asyncio.Queue] = set()
+
+    @property
+    def status(self) -> Dict[str, Any]:
+        """
+        最近一次检查得到的状态快照（只读使用）。
+        """
+        return self._status
+
+    @property
+    def is_ready(self) -> bool:
+        """
+        当前模型是否可以立即处理请求。
+        """
+        return self._status["connected"] and self._status["model_loaded"]
+
+    def start(self):
+        """
+        启动后台检查任务，应用启动时调用。
+        """
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        停止后台检查任务，应用关闭时调用。
+        """
+        for task in [self._task, *self._warmup_tasks.values()]:
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._task = None
+        self._warmup_tasks.clear()
+
+    def request_refresh(self):
+        """
+        请求立即重新检查（例如聊天请求发现连接失败时）。
+        """
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def subscribe(self) -> asyncio.Queue:
+        """
+        订阅状态变化，返回的队列中会收到新的状态快照。
+        """
+        queue = asyncio.Queue(maxsize=10)
+        queue.put_nowait(self._status)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        """
+        取消订阅状态变化。
+        """
+        self._subscribers.discard(queue)
+
+    async def _run(self):
+        """
+        后台循环：检查一次，然后等待下一个周期或被提前唤醒。
+        """
+        while True:
+            await self.refresh()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def refresh(self):
+        """
+        检查一次所有 Ollama 实例的状态并汇总快照（任一实例可达即视为已连接），状态变化时通知订阅者。
+        """
+        pool = self.service.pool
+        await asyncio.gather(*(pool.check(endpoint) for endpoint in pool.endpoints))
+        status = dict(self._status)
+        status["checked"] = True
+        status["checked_at"] = time.time()
+        healthy = [endpoint for endpoint in pool.endpoints if endpoint.healthy]
+        status["connected"] = bool(healthy)
+        status["available_models"] = self._union(endpoint.available_models for endpoint in healthy)
+        status["loaded_models"] = self._union(endpoint.loaded_models for endpoint in healthy)
+        status["error"] = None if healthy else next((e.error for e in pool.endpoints if e.error), None)
+        if not healthy:
+            logger.error("Ollama 状态检查失败: %s", status["error"])
+        status["endpoints"] = [
+            {"url": endpoint.base_url, "healthy": endpoint.healthy, "loaded_models": endpoint.loaded_models}
+            for endpoint in pool.endpoints
+        ]
+        status["model_available"] = any(endpoint.has_model(self.service.model) for endpoint in healthy)
+        status["model_loaded"] = any(endpoint.has_loaded(self.service.model) for endpoint in healthy)
+        changed = any(status[key] != self._status[key] for key in
+                      ("connected", "available_models", "loaded_models", "endpoints", "error"))
+        self._status = status
+        if settings.OLLAMA_WARMUP:
+            self._warmup_ready(pool.endpoints)
+        if changed:
+            self._publish(status)
+
+    @staticmethod
+    def _union(model_lists) -> List[str]:
+        """
+        合并多个实例的模型列表，保持首次出现的顺序。
+        """
+        return list(dict.fromkeys(name for models in model_lists for name in models))
+
+    def _warmup_ready(self, endpoints):
+        """
+        只在实例变为可用（可达且已下载模型）时预加载一次；之后模型被 Ollama 按 keep_alive 卸载不再重新加载，
+        实例不可用或模型被删除后再次可用时重新预加载。
+        """
+        for endpoint in endpoints:
+            if not (endpoint.healthy and endpoint.has_model(self.service.model)):
+                self._warmed.discard(endpoint.base_url)
+            elif endpoint.base_url not in self._warmed:
+                self._warmed.add(endpoint.base_url)
+                if not endpoint.has_loaded(self.service.model):
+                    self._start_warmup(endpoint)
+
+    def _start_warmup(self, endpoint):
+        """
+        后台预加载模型：不带 prompt 的生成请求只加载模型，不做推理；使用与生成相同的 num_ctx，
+        避免第一次生成时重新加载。每个实例同时只预加载一次。
+        """
+        task = self._warmup_tasks.get(endpoint.base_url)
+        if task is not None and not task.done():
+            return
+
+        async def warmup():
+            try:
+                await endpoint.client.post(
+                    "/api/generate",
+                    json={"model": self.service.model, "options": self.service.model_options()},
+                    timeout=None
+                )
+            except Exception as e:
+                logger.warning("模型预加载失败（%s）: %s", endpoint.base_url, e)
+            self.request_refresh()
+
+        self._warmup_tasks[endpoint.base_url] = asyncio.create_task(warmup())
+
+    def _publish(self, status: Dict[str, Any]):
+        """
+        向所有订阅者推送新状态，消费过慢的订阅者丢弃最旧的状态。
+        """
+        for queue in list(self._subscribers):
+            if queue.full():
+                try:
+                    queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    pass
+            queue.put_nowait(status)
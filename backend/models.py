@@ -1,11 +1,20 @@
 
 # 导入 SQLAlchemy 所需的模块和基类
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean  # 字段类型和外键
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Index  # 字段类型、外键和索引
 from sqlalchemy.orm import relationship  # 关系映射
+from sqlalchemy.dialects import sqlite  # SQLite 方言类型
 from sqlalchemy.sql import func  # SQL 函数
 from database import Base  # 数据库基类
 
 
+# 对话活跃时间类型：SQLite 的 CURRENT_TIMESTAMP 存储为不带微秒的文本，
+# 绑定参数也使用相同格式，分页游标的比较才正确
+ActivityDateTime = DateTime(timezone=True).with_variant(
+    sqlite.DATETIME(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+    "sqlite"
+)
+
+
 class User(Base):
     """
     用户表模型，存储注册用户的基本信息。
@@ -19,8 +28,8 @@ class User(Base):
     is_active = Column(Boolean, default=True)  # 是否激活
     created_at = Column(DateTime(timezone=True), server_default=func.now())  # 创建时间
     
-    # 与 Conversation 的一对多关系
-    conversations = relationship("Conversation", back_populates="user")
+    # 与 Conversation 的一对多关系；删除用户时由数据库级联删除对话
+    conversations = relationship("Conversation", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
 
 
 class Conversation(Base):
@@ -28,17 +37,24 @@ class Conversation(Base):
     对话表模型，存储每个用户的对话。
     """
     __tablename__ = "conversations"
+    __table_args__ = (
+        # 按最近活跃时间分页列出用户的对话（WHERE user_id = ? ORDER BY updated_at DESC, id DESC）
+        Index("idx_conversations_user_updated", "user_id", "updated_at", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)  # 对话ID，主键
     title = Column(String(200))  # 对话标题
-    user_id = Column(Integer, ForeignKey("users.id"))  # 所属用户ID，外键
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))  # 所属用户ID，外键
     created_at = Column(DateTime(timezone=True), server_default=func.now())  # 创建时间
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())  # 更新时间
+    updated_at = Column(ActivityDateTime, nullable=False, server_default=func.now(), onupdate=func.now())  # 更新时间（最近活跃时间）
+    message_count = Column(Integer, nullable=False, default=0, server_default="0")  # 消息数量，写入消息时维护，同时作为消息序号分配器
+    last_message_preview = Column(String(200))  # 最后一条消息预览，写入消息时维护
     
     # 与 User 的多对一关系
     user = relationship("User", back_populates="conversations")
-    # 与 Message 的一对多关系
-    messages = relationship("Message", back_populates="conversation")
+    # 与 Message 的一对多关系，按对话内序号排序；删除对话时由数据库级联删除消息
+    messages = relationship("Message", back_populates="conversation", order_by="Message.seq",
+                            cascade="all, delete-orphan", passive_deletes=True)
 
 
 class Message(Base):
@@ -46,12 +62,75 @@ class Message(Base):
     消息表模型，存储每条对话消息。
     """
     __tablename__ = "messages"
+    __table_args__ = (
+        # 按对话内序号读取和分页（WHERE conversation_id = ? ORDER BY seq DESC LIMIT n）
+        Index("idx_messages_conversation_seq", "conversation_id", "seq", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, index=True)  # 消息ID，主键
     content = Column(Text)  # 消息内容
     role = Column(String(20))  # 消息角色，'user' 或 'assistant'
-    conversation_id = Column(Integer, ForeignKey("conversations.id"))  # 所属对话ID，外键
+    conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="CASCADE"))  # 所属对话ID，外键
+    seq = Column(Integer, nullable=False)  # 对话内消息序号，从 1 开始单调递增
     created_at = Column(DateTime(timezone=True), server_default=func.now())  # 创建时间
     
     # 与 Conversation 的多对一关系
-    conversation = relationship("Conversation", back_populates="messages")
\ No newline at end of file
+    conversation = relationship("Conversation", back_populates="messages")
+
+
+class ConversationContext(Base):
+    """
+    对话 KV context 表，保存 Ollama 上一轮返回的 context token 数组，用于跨轮次复用。
+    """
+    __tablename__ = "conversation_contexts"
+
+    conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="CASCADE"), primary_key=True)  # 对话ID，主键
+    model = Column(String(100))  # 生成该 context 的模型名称
+    context = Column(Text)  # context token 数组（JSON）
+    token_count = Column(Integer)  # token 数量
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())  # 更新时间
+
+
+
+class ConversationRollingSummary(Base):
+    """
+    对话滚动摘要表：后台把较早的消息压缩成摘要，prompt 只需发送摘要和最近的消息。
+    摘要覆盖对话内 seq 不超过 covered_seq 的全部消息。
+    """
+    __tablename__ = "conversation_summaries"
+
+    conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="CASCADE"), primary_key=True)  # 对话ID，主键
+    summary = Column(Text)  # 摘要内容
+    covered_seq = Column(Integer, nullable=False, default=0)  # 摘要覆盖到的最后一条消息序号
+    model = Column(String(100))  # 生成摘要的模型名称
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())  # 更新时间
+
+
+class ResponseCacheEntry(Base):
+    """
+    AI 回复缓存表，作为内存缓存之外的持久化层。
+    """
+    __tablename__ = "response_cache"
+
+    cache_key = Column(String(64), primary_key=True)  # 缓存键（SHA-256）
+    model = Column(String(100))  # 模型名称
+    response = Column(Text)  # 缓存的回复内容
+    expires_at = Column(DateTime, index=True)  # 过期时间（UTC）
+
+
+class SearchTerm(Base):
+    """
+    内置倒排索引表（非 MySQL 部署使用），写入消息和创建对话时增量维护。
+    每行是一个词在一篇文档中的出现次数；文档用 (conversation_id, seq) 标识，seq 为 0 表示对话标题。
+    """
+    __tablename__ = "search_terms"
+    __table_args__ = (
+        # 删除对话时级联删除索引项
+        Index("idx_search_terms_conversation", "conversation_id", "seq"),
+    )
+
+    user_id = Column(Integer, primary_key=True)  # 所属用户ID，查询时先按用户定位
+    term = Column(String(32), primary_key=True)  # 词（英文单词或中文二元组）
+    conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="CASCADE"), primary_key=True)  # 对话ID
+    seq = Column(Integer, primary_key=True)  # 消息在对话内的序号，0 表示对话标题
+    tf = Column(Integer, nullable=False)  # 词在文档中的出现次数
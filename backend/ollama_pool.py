@@ -0,0 +1,267 @@
+"""
+Ollama 多实例负载均衡：按模型驻留和未完成请求数选择实例，连续连接失败的实例被摘除，
+健康检查恢复后重新加入；未输出任何内容前的连接失败换一个实例重试
+"""
+# 导入所需的库
+import logging  # 日志
+import time   # 摘除冷却时间和请求计时
+import httpx  # 异步 HTTP 客户端（连接池 + keep-alive）
+from typing import Any, Awaitable, Callable, Dict, List, Optional  # 类型注解
+from config import settings  # 导入配置项
+from metrics import OLLAMA_REQUEST_DURATION, metrics  # 上游耗时和进行中请求数指标
+
+logger = logging.getLogger(__name__)
+
+# 可以安全地换实例重试的错误：连接失败或连接被断开（读取超时说明模型仍在生成，不重试）
+CONNECTION_ERRORS = (httpx.NetworkError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+
+
+def normalize_model_name(name: str) -> str:
+    """
+    规范化模型名称：Ollama 把不带标签的名称（如 llama2）当作 llama2:latest，模型列表中也只返回带标签的形式。
+    """
+    return name if ":" in name.rsplit("/", 1)[-1] else f"{name}:latest"
+
+
+def create_ollama_client(base_url: str) -> httpx.AsyncClient:
+    """
+    创建访问 Ollama 的共享异步 HTTP 客户端，连接池大小、超时和 keep-alive 均来自配置。
+    :param base_url: Ollama 服务的基础 URL。
+    :return: httpx.AsyncClient 实例。
+    """
+    return httpx.AsyncClient(
+        base_url=base_url,
+        headers={"Content-Type": "application/json"},
+        limits=httpx.Limits(
+            max_connections=settings.OLLAMA_POOL_SIZE,
+            max_keepalive_connections=settings.OLLAMA_POOL_KEEPALIVE,
+            keepalive_expiry=settings.OLLAMA_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            settings.OLLAMA_READ_TIMEOUT,
+            connect=settings.OLLAMA_CONNECT_TIMEOUT,
+        ),
+    )
+
+
+class Endpoint:
+    """
+    一个 Ollama 实例：独立的连接池、健康状态和未完成请求数。
+    """
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+        self._client = None  # 首次使用时创建连接池
+        self.checked = False  # 是否已完成过健康检查
+        self.healthy = True  # 未被摘除
+        self.ejected_until = 0.0  # 摘除到期时间，到期后允许少量请求试探
+        self.failures = 0  # 连续失败次数
+        self.outstanding = 0  # 未完成的请求数
+        self.available_models: List[str] = []
+        self.loaded_models: List[str] = []
+        self.error: Optional[str] = None  # 最近一次失败的错误信息
+        self.requests = 0  # 发往该实例的请求数
+        self.errors = 0  # 连接失败次数
+        self.ejections = 0  # 被摘除的次数
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """
+        该实例共享的异步 HTTP 客户端。
+        """
+        if self._client is None or self._client.is_closed:
+            self._client = create_ollama_client(self.base_url)
+        return self._client
+
+    def has_model(self, model: str) -> bool:
+        """
+        该实例是否已下载模型（忽略隐含的 :latest 标签）。
+        """
+        return normalize_model_name(model) in map(normalize_model_name, self.available_models)
+
+    def has_loaded(self, model: str) -> bool:
+        """
+        该实例是否已把模型加载到内存（忽略隐含的 :latest 标签）。
+        """
+        return normalize_model_name(model) in map(normalize_model_name, self.loaded_models)
+
+    def usable(self, now: float) -> bool:
+        """
+        是否可以接收请求：未被摘除，或摘除已到期。
+        """
+        return self.healthy or now >= self.ejected_until
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class OllamaPool:
+    """
+    OllamaPool 管理多个 Ollama 实例：
+    - 路由：已下载该模型的实例优先；residency 策略下模型已加载（驻留）的实例优先，
+      同等条件下选择未完成请求最少的实例（least_outstanding 策略只看未完成请求数）；
+    - 摘除：请求连续 OLLAMA_EJECT_FAILURES 次连接失败或健康检查失败时摘除，
+      OLLAMA_EJECT_SECONDS 后允许试探，健康检查或请求成功后恢复；
+    - 重试：连接失败时换一个未尝试过的实例，最多重试 OLLAMA_RETRIES 次。
+    """
+    def __init__(self, base_urls: List[str] = None, routing: str = None):
+        """
+        初始化 OllamaPool。
+        :param base_urls: Ollama 实例的基础 URL 列表。
+        :param routing: 路由策略，residency 或 least_outstanding。
+        """
+        self.endpoints = [Endpoint(url) for url in (base_urls or settings.OLLAMA_BASE_URLS)]
+        self.routing = routing or settings.OLLAMA_ROUTING
+        self.eject_failures = settings.OLLAMA_EJECT_FAILURES
+        self.eject_seconds = settings.OLLAMA_EJECT_SECONDS
+        self.retries = settings.OLLAMA_RETRIES
+        self.retried = 0  # 换实例重试的次数
+
+    def choose(self, model: str, exclude: List[Endpoint] = ()) -> Optional[Endpoint]:
+        """
+        为一次请求选择实例，exclude 中的实例不参与选择；全部被摘除时仍在其中选择（总比直接失败好）。
+        """
+        candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude]
+        if not candidates:
+            return None
+        now = time.monotonic()
+        candidates = [endpoint for endpoint in candidates if endpoint.usable(now)] or candidates
+
+        def rank(endpoint: Endpoint) -> tuple:
+            # 未检查过的实例不知道模型列表，按“已下载、未加载”对待
+            missing = endpoint.checked and not endpoint.has_model(model)
+            resident = self.routing == "residency" and endpoint.has_loaded(model)
+            return missing, not resident, endpoint.outstanding
+
+        return min(candidates, key=rank)
+
+    async def call(self, model: str, func: Callable[[Endpoint], Awaitable[Any]],
+                   retryable: Callable[[], bool] = None) -> Any:
+        """
+        选择实例并执行 func(endpoint)。连接失败时，如果 retryable() 为真（如流式请求尚未输出任何内容），
+        换一个实例重试；没有可重试的实例时抛出最后一次的异常。
+        """
+        tried: List[Endpoint] = []
+        while True:
+            endpoint = self.choose(model, tried)
+            if endpoint is None:
+                raise httpx.ConnectError("未配置 Ollama 实例")
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            start = time.perf_counter()
+            outcome = "error"
+            try:
+                result = await func(endpoint)
+                outcome = "ok"
+            except CONNECTION_ERRORS as e:
+                outcome = "connection_error"
+                self.report_failure(endpoint, e)
+                tried.append(endpoint)
+                if (len(tried) > self.retries or (retryable is not None and not retryable())
+                        or self.choose(model, tried) is None):
+                    raise
+                self.retried += 1
+                logger.warning("Ollama 实例 %s 连接失败，改用其他实例重试: %s", endpoint.base_url, e)
+                continue
+            finally:
+                endpoint.outstanding -= 1
+                OLLAMA_REQUEST_DURATION.observe(time.perf_counter() - start, (endpoint.base_url, outcome))
+            self.report_success(endpoint)
+            return result
+
+    def report_success(self, endpoint: Endpoint):
+        endpoint.failures = 0
+        if not endpoint.healthy:
+            self.reinstate(endpoint)
+
+    def report_failure(self, endpoint: Endpoint, error: Exception):
+        endpoint.failures += 1
+        endpoint.errors += 1
+        endpoint.error = str(error) or type(error).__name__
+        if endpoint.failures >= self.eject_failures:
+            self.eject(endpoint)
+
+    def eject(self, endpoint: Endpoint):
+        """
+        摘除实例；已摘除的实例延长冷却时间。
+        """
+        if endpoint.healthy:
+            endpoint.healthy = False
+            endpoint.ejections += 1
+            logger.error("Ollama 实例 %s 已摘除: %s", endpoint.base_url, endpoint.error)
+        endpoint.ejected_until = time.monotonic() + self.eject_seconds
+
+    def reinstate(self, endpoint: Endpoint):
+        if not endpoint.healthy:
+            logger.info("Ollama 实例 %s 已恢复", endpoint.base_url)
+        endpoint.healthy = True
+        endpoint.failures = 0
+        endpoint.error = None
+
+    async def check(self, endpoint: Endpoint):
+        """
+        主动健康检查：调用 /api/tags 和 /api/ps 更新模型列表，失败时立即摘除，成功时恢复。
+        """
+        try:
+            available = await self._fetch_model_names(endpoint, "/api/tags")
+        except Exception as e:
+            endpoint.checked = True
+            endpoint.available_models, endpoint.loaded_models = [], []
+            endpoint.error = str(e) or type(e).__name__
+            self.eject(endpoint)
+            return
+        try:
+            loaded = await self._fetch_model_names(endpoint, "/api/ps")
+        except Exception:
+            # 旧版本 Ollama 没有 /api/ps，无法判断加载状态时视为已加载
+            loaded = list(available)
+        endpoint.checked = True
+        endpoint.available_models, endpoint.loaded_models = available, loaded
+        self.reinstate(endpoint)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        各实例的健康状态和请求统计。
+        """
+        return {
+            "routing": self.routing,
+            "retried": self.retried,
+            "endpoints": [
+                {
+                    "url": endpoint.base_url,
+                    "healthy": endpoint.healthy,
+                    "outstanding": endpoint.outstanding,
+                    "requests": endpoint.requests,
+                    "errors": endpoint.errors,
+                    "ejections": endpoint.ejections,
+                    "loaded_models": endpoint.loaded_models,
+                    "error": endpoint.error,
+                }
+                for endpoint in self.endpoints
+            ],
+        }
+
+    def register_metrics(self):
+        """
+        导出各实例进行中的请求数和健康状态（读取 /metrics 时计算）。
+        """
+        metrics.gauge("ollama_in_flight_requests", "Generations currently running on each Ollama endpoint",
+                      ("endpoint",), lambda: [((e.base_url,), e.outstanding) for e in self.endpoints])
+        metrics.gauge("ollama_endpoint_healthy", "Whether the endpoint is in rotation (1) or ejected (0)",
+                      ("endpoint",), lambda: [((e.base_url,), int(e.healthy)) for e in self.endpoints])
+
+    async def close(self):
+        """
+        关闭所有实例的连接池，应用关闭时调用。
+        """
+        for endpoint in self.endpoints:
+            await endpoint.close()
+
+    async def _fetch_model_names(self, endpoint: Endpoint, path: str) -> List[str]:
+        """
+        调用 /api/tags 或 /api/ps，返回模型名称列表。
+        """
+        response = await endpoint.client.get(path, timeout=5)
+        response.raise_for_status()
+        return [model["name"] for model in response.json().get("models", [])]
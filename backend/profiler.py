@@ -0,0 +1,176 @@
+"""
+按需采样分析：管理员开启后，对接下来 N 个请求定时采样调用栈，输出火焰图使用的 collapsed 格式
+（每行 "帧1;帧2;...;帧n 次数"，可用 flamegraph.pl 或 speedscope 打开）
+"""
+# 导入所需的库
+import asyncio    # 任务类型
+import os         # 文件名
+import sys        # 读取线程当前帧
+import threading  # 采样线程
+import time       # 采样间隔
+from collections import Counter  # 调用栈计数
+from typing import Dict, List, Optional, Set  # 类型注解
+from config import settings  # 导入配置项
+
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def task_stack(task: asyncio.Task, loop_frame) -> List[str]:
+    """
+    读取任务的调用栈（从外到内）：沿 cr_await 展开挂起的协程链；
+    任务正在事件循环线程上运行时，再补上最内层协程之上的同步调用，否则以 (await) 结尾。
+    异步生成器的 asend 对象无法展开，挂起在 async for 中的任务只能看到外层协程。
+    """
+    frames = []
+    awaitable = task.get_coro()
+    while awaitable is not None:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "ag_frame", None) \
+            or getattr(awaitable, "gi_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "ag_await", None) \
+            or getattr(awaitable, "gi_yieldfrom", None)
+    if not frames:
+        return []
+    names = [frame_name(frame) for frame in frames]
+    running = []
+    frame = loop_frame
+    while frame is not None and frame is not frames[-1]:
+        running.append(frame)
+        frame = frame.f_back
+    if frame is not None:
+        names.extend(frame_name(f) for f in reversed(running))
+    else:
+        names.append("(await)")
+    return names
+
+
+class SamplingProfiler:
+    """
+    SamplingProfiler 只分析被选中的请求：请求开始时 claim() 占用一个名额，
+    请求（及其流式响应任务）登记到 track()，采样线程每隔 interval 秒读取这些任务的调用栈。
+    挂起等待（数据库、模型）的时间同样被采样，得到的是墙钟时间分布。
+    """
+    def __init__(self, interval: float = None, max_requests: int = None):
+        """
+        初始化 SamplingProfiler。
+        :param interval: 采样间隔（秒）。
+        :param max_requests: 一次最多分析的请求数。
+        """
+        self.interval = interval or settings.PROFILE_SAMPLE_INTERVAL
+        self.max_requests = max_requests or settings.PROFILE_MAX_REQUESTS
+        self._lock = threading.Lock()
+        self._remaining = 0  # 还要分析的请求数
+        self._active: Dict[int, Set[asyncio.Task]] = {}  # 正在分析的请求（根 span 的 id）-> 任务
+        self._stacks: Counter = Counter()
+        self._thread: Optional[threading.Thread] = None
+        self._loop_thread: Optional[int] = None
+        self.requested = 0  # 本次要求分析的请求数
+        self.profiled = 0  # 本次已开始分析的请求数
+        self.samples = 0  # 本次采样次数
+        self.started_at = None
+        self.finished_at = None
+
+    def arm(self, requests: int):
+        """
+        开始分析接下来的 requests 个请求，清空上一次的结果（需在事件循环线程中调用）。
+        """
+        with self._lock:
+            self.requested = self._remaining = max(1, min(requests, self.max_requests))
+            self.profiled = self.samples = 0
+            self._stacks.clear()
+            self.started_at = time.time()
+            self.finished_at = None
+            self._loop_thread = threading.get_ident()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+
+    def claim(self) -> bool:
+        """
+        请求开始时调用：还有分析名额时占用一个并返回 True。
+        """
+        if not self._remaining:
+            return False
+        with self._lock:
+            if not self._remaining:
+                return False
+            self._remaining -= 1
+            self.profiled += 1
+            return True
+
+    def track(self, request, task: Optional[asyncio.Task]):
+        """
+        登记被分析请求使用的任务（请求任务和流式响应任务）。
+        """
+        if task is None:
+            return
+        with self._lock:
+            self._active.setdefault(id(request), set()).add(task)
+
+    def release(self, request):
+        """
+        被分析的请求结束时调用。
+        """
+        with self._lock:
+            self._active.pop(id(request), None)
+            if not self._remaining and not self._active and self.finished_at is None:
+                self.finished_at = time.time()
+
+    def collapsed(self) -> str:
+        """
+        本次分析的 collapsed 格式调用栈。
+        """
+        with self._lock:
+            stacks = list(self._stacks.items())
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks))
+
+    def status(self) -> Dict[str, object]:
+        """
+        分析进度。
+        """
+        with self._lock:
+            return {
+                "requested": self.requested,
+                "remaining": self._remaining,
+                "active": len(self._active),
+                "profiled": self.profiled,
+                "samples": self.samples,
+                "stacks": len(self._stacks),
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._remaining and not self._active:
+                    self._thread = None
+                    return
+                tasks = [task for tasks in self._active.values() for task in tasks if not task.done()]
+            if tasks:
+                self._sample(tasks)
+
+    def _sample(self, tasks: List[asyncio.Task]):
+        loop_frame = sys._current_frames().get(self._loop_thread)
+        stacks = []
+        for task in tasks:
+            try:
+                stack = task_stack(task, loop_frame)
+            except Exception:
+                # 读取期间协程状态可能在事件循环线程中改变，放弃这一次采样
+                continue
+            if stack:
+                stacks.append(";".join(stack))
+        with self._lock:
+            self.samples += 1
+            self._stacks.update(stacks)
+
+
+# 创建全局采样分析实例
+profiler = SamplingProfiler()
@@ -0,0 +1,206 @@
+"""
+按 token 预算构建 prompt：从最新的消息开始装入历史，直到用完模型上下文减去回复预留后的预算，
+过长的单条消息截去中间部分，prompt 大小（以及预填充耗时）有明确上限
+"""
+# 导入所需的库
+import logging    # 日志
+import math       # token 估算取整
+import re         # 中日韩字符统计
+import threading  # 保护统计计数
+from typing import Dict, List, Optional, Tuple  # 类型注解
+from config import settings  # 导入配置项
+
+try:
+    from tokenizers import Tokenizer  # 可选：精确分词器（HuggingFace tokenizers）
+except ImportError:
+    Tokenizer = None
+
+logger = logging.getLogger(__name__)
+
+# 中日韩字符和全角标点，大多数模型的分词器中一个字约为一个 token
+CJK_RE = re.compile(r"[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]")
+TRIM_MARKER = "\n…（中间内容过长已省略）…\n"
+
+
+class BuiltPrompt:
+    """
+    构建结果：prompt 文本、估算的 token 数，以及实际装入的历史消息。
+    """
+    def __init__(self, text: str, tokens: int, history: List[Dict[str, str]], dropped: int, trimmed: int):
+        self.text = text
+        self.tokens = tokens
+        self.history = history  # 装入 prompt 的历史消息（可能已截断），按时间正序
+        self.dropped = dropped  # 因预算不足未装入的历史消息数
+        self.trimmed = trimmed  # 被截断的消息数（含当前消息）
+
+
+class PromptBuilder:
+    """
+    PromptBuilder 默认用本地估算器计数 token（中日韩字符每字 1 个，其余每 4 个字符 1 个，偏保守），
+    配置了 PROMPT_TOKENIZER 且安装了 tokenizers 时使用精确分词器。
+    预算 = 模型上下文长度（num_ctx）- 回复预留；num_ctx 会随请求发送给 Ollama，二者保持一致。
+    """
+    def __init__(self, tokenizer_path: str = None):
+        """
+        初始化 PromptBuilder。
+        :param tokenizer_path: tokenizer.json 路径（可选）。
+        """
+        self.num_ctx = settings.PROMPT_NUM_CTX
+        self.num_ctx_models = settings.PROMPT_NUM_CTX_MODELS
+        self.reply_reserve = settings.PROMPT_REPLY_RESERVE
+        self.max_message_tokens = settings.PROMPT_MAX_MESSAGE_TOKENS
+        self._tokenizer = self._load_tokenizer(tokenizer_path or settings.PROMPT_TOKENIZER)
+        self._lock = threading.Lock()
+        self.builds = 0  # 发送给模型的 prompt 数
+        self.tokens_total = 0  # 累计 prompt token 数
+        self.tokens_max = 0  # 最大 prompt token 数
+        self.dropped = 0  # 因预算不足未装入的历史消息数
+        self.trimmed = 0  # 被截断的消息数
+
+    @staticmethod
+    def _load_tokenizer(path: Optional[str]):
+        if not path:
+            return None
+        if Tokenizer is None:
+            logger.warning("未安装 tokenizers，PROMPT_TOKENIZER 不生效，改用估算的 token 数")
+            return None
+        try:
+            return Tokenizer.from_file(path)
+        except Exception as e:
+            logger.warning("加载分词器失败，改用估算的 token 数: %s", e)
+            return None
+
+    def count(self, text: str) -> int:
+        """
+        计算文本的 token 数（精确分词器或本地估算）。
+        """
+        if not text:
+            return 0
+        if self._tokenizer is not None:
+            return len(self._tokenizer.encode(text, add_special_tokens=False).ids)
+        cjk = len(CJK_RE.findall(text))
+        return cjk + math.ceil((len(text) - cjk) / 4)
+
+    def context_size(self, model: str) -> int:
+        """
+        模型的上下文长度（num_ctx），未单独配置的模型使用 PROMPT_NUM_CTX。
+        """
+        return self.num_ctx_models.get(model, self.num_ctx)
+
+    def budget(self, model: str) -> int:
+        """
+        prompt 可用的 token 预算：上下文长度减去回复预留。
+        """
+        return max(self.context_size(model) - self.reply_reserve, 1)
+
+    def trim(self, text: str, limit: int) -> str:
+        """
+        把文本截断到 limit 个 token 以内：保留开头和结尾，省略中间部分。
+        """
+        tokens = self.count(text)
+        if tokens <= limit:
+            return text
+        available = limit - self.count(TRIM_MARKER)
+        if available <= 0:
+            return ""
+        keep = int(len(text) * available / tokens)
+        while keep > 0:
+            head = keep // 2
+            trimmed = text[:head] + TRIM_MARKER + text[len(text) - (keep - head):]
+            if self.count(trimmed) <= limit:
+                return trimmed
+            keep = int(keep * 0.9)
+        return ""
+
+    def format_line(self, role: str, content: str) -> str:
+        if role == "summary":
+            return f"之前对话的摘要: {content}\n"
+        return f"{'用户' if role == 'user' else '助手'}: {content}\n"
+
+    def select(self, model: str, message: str,
+               conversation_history: List[Dict[str, str]] = None) -> Tuple[str, List[Dict[str, str]], int, int, int]:
+        """
+        在预算内选择当前消息（必要时截断）和历史消息：从最新的历史开始装入，装不下时停止，保证历史连续。
+        历史的第一条是对话摘要（role 为 summary）时，摘要优先于最近的消息装入。
+        :return: (当前消息, 装入的历史, prompt token 数, 未装入的历史条数, 截断条数)
+        """
+        budget = self.budget(model)
+        trimmed = 0
+        tail = f"用户: {message}\n助手:"
+        tokens = self.count(tail)
+        if tokens > budget:
+            message = self.trim(message, budget - self.count("用户: \n助手:"))
+            tail = f"用户: {message}\n助手:"
+            tokens = self.count(tail)
+            trimmed += 1
+        history: List[Dict[str, str]] = []
+        conversation_history = conversation_history or []
+        summary = None
+        if conversation_history and conversation_history[0]["role"] == "summary":
+            summary, conversation_history = conversation_history[0], conversation_history[1:]
+            limit = min(settings.SUMMARY_MAX_TOKENS, budget - tokens - self.count(self.format_line("summary", "")))
+            content = self.trim(summary["content"], limit) if limit > 0 else ""
+            if content:
+                summary = {"role": "summary", "content": content}
+                tokens += self.count(self.format_line("summary", content))
+            else:
+                summary = None
+        for msg in reversed(conversation_history):
+            remaining = budget - tokens
+            content = msg["content"]
+            limit = min(self.max_message_tokens, remaining - self.count(self.format_line(msg["role"], "")))
+            if limit <= 0:
+                break
+            if self.count(content) > limit:
+                content = self.trim(content, limit)
+                if not content:
+                    break
+                trimmed += 1
+            line_tokens = self.count(self.format_line(msg["role"], content))
+            if line_tokens > remaining:
+                break
+            history.append({"role": msg["role"], "content": content})
+            tokens += line_tokens
+        history.reverse()
+        dropped = len(conversation_history) - len(history)
+        if summary is not None:
+            history.insert(0, summary)
+        return message, history, tokens, dropped, trimmed
+
+    def build(self, model: str, message: str, conversation_history: List[Dict[str, str]] = None) -> BuiltPrompt:
+        """
+        构建 prompt。
+        """
+        message, history, tokens, dropped, trimmed = self.select(model, message, conversation_history)
+        text = "".join(self.format_line(msg["role"], msg["content"]) for msg in history)
+        text += f"用户: {message}\n助手:"
+        return BuiltPrompt(text, tokens, history, dropped, trimmed)
+
+    def record(self, prompt: BuiltPrompt):
+        """
+        记录实际发送给模型的 prompt 的 token 数。
+        """
+        with self._lock:
+            self.builds += 1
+            self.tokens_total += prompt.tokens
+            self.tokens_max = max(self.tokens_max, prompt.tokens)
+            self.dropped += prompt.dropped
+            self.trimmed += prompt.trimmed
+
+    def stats(self) -> Dict[str, object]:
+        """
+        prompt 大小统计。
+        """
+        with self._lock:
+            return {
+                "tokenizer": "exact" if self._tokenizer is not None else "estimate",
+                "builds": self.builds,
+                "avg_tokens": self.tokens_total / self.builds if self.builds else 0.0,
+                "max_tokens": self.tokens_max,
+                "dropped_messages": self.dropped,
+                "trimmed_messages": self.trimmed,
+            }
+
+
+# 创建全局 prompt 构建器实例
+prompt_builder = PromptBuilder()
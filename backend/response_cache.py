@@ -0,0 +1,162 @@
+"""
+AI 回复缓存：相同模型、相同消息和历史窗口的请求直接返回缓存的回复
+"""
+# 导入所需的库
+import hashlib    # 计算缓存键
+import json       # 序列化缓存键内容
+import logging  # 日志
+import re         # 规范化空白字符
+import threading  # 线程锁
+import time       # TTL 计算
+from collections import OrderedDict  # LRU 缓存
+from datetime import datetime, timedelta  # 持久化层过期时间
+from typing import List, Dict, Optional  # 类型注解
+from sqlalchemy import delete  # 删除语句
+from database import AsyncSessionLocal, upsert  # 异步数据库会话工厂和 upsert 语句
+from models import ResponseCacheEntry  # 回复缓存持久化模型
+from config import settings  # 导入配置项
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    两级回复缓存：内存 LRU（条数和 TTL 双重上限）+ 可选的数据库持久化层（重启后仍可命中）。
+    """
+    PURGE_EVERY = 100  # 每写入多少次清理一次数据库中过期的记录
+
+    def __init__(self, max_entries: int = None, ttl: int = None, persist: bool = None):
+        """
+        初始化 ResponseCache。
+        :param max_entries: 内存中最多缓存的回复条数。
+        :param ttl: 缓存有效期（秒）。
+        :param persist: 是否启用数据库持久化层。
+        """
+        self.max_entries = max_entries or settings.RESPONSE_CACHE_SIZE
+        self.ttl = ttl or settings.RESPONSE_CACHE_TTL
+        self.persist = settings.RESPONSE_CACHE_PERSIST if persist is None else persist
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (过期时间戳, 回复)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0  # 内存层命中次数
+        self.persistent_hits = 0  # 持久化层命中次数
+        self.misses = 0  # 未命中次数
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """
+        规范化文本：去除首尾空白、合并连续空白、统一小写。
+        """
+        return re.sub(r"\s+", " ", text).strip().lower()
+
+    def make_key(self, model: str, message: str, conversation_history: List[Dict[str, str]] = None) -> str:
+        """
+        根据模型名称、规范化后的消息和实际参与生成的历史窗口计算缓存键。
+        """
+        window = (conversation_history or [])[-settings.HISTORY_WINDOW:]
+        material = json.dumps({
+            "model": model,
+            "message": self.normalize(message),
+            "history": [[msg["role"], self.normalize(msg["content"])] for msg in window],
+        }, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        """
+        查询缓存，先查内存层，未命中时查持久化层并回填内存。
+        :param key: 缓存键。
+        :return: 缓存的回复，未命中返回 None。
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+        if self.persist:
+            try:
+                entry = await self._load(key)
+            except Exception as e:
+                # 持久化层只是缓存，读取失败按未命中处理
+                logger.warning("读取回复缓存失败: %s", e)
+                entry = None
+            if entry is not None:
+                self._remember(key, entry)
+                with self._lock:
+                    self.persistent_hits += 1
+                return entry[1]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    async def put(self, key: str, model: str, response: str):
+        """
+        写入缓存。持久化层写入失败只记录日志，不影响已经生成的回复。
+        """
+        entry = (time.time() + self.ttl, response)
+        self._remember(key, entry)
+        if self.persist:
+            try:
+                await self._save(key, model, response)
+            except Exception as e:
+                logger.warning("写入回复缓存失败: %s", e)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        缓存命中统计。
+        """
+        with self._lock:
+            hits = self.hits + self.persistent_hits
+            total = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0,
+            }
+
+    def _remember(self, key: str, entry: tuple):
+        """
+        写入内存层并淘汰最久未使用的条目。
+        """
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def _load(self, key: str) -> Optional[tuple]:
+        async with AsyncSessionLocal() as db:
+            row = await db.get(ResponseCacheEntry, key)
+            if row is None:
+                return None
+            remaining = (row.expires_at - datetime.utcnow()).total_seconds()
+            if remaining <= 0:
+                await db.delete(row)
+                await db.commit()
+                return None
+            return (time.time() + remaining, row.response)
+
+    async def _save(self, key: str, model: str, response: str):
+        async with AsyncSessionLocal() as db:
+            await db.execute(upsert(ResponseCacheEntry, {
+                "cache_key": key,
+                "model": model,
+                "response": response,
+                "expires_at": datetime.utcnow() + timedelta(seconds=self.ttl),
+            }))
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                # 定期清理过期记录，限制表的大小
+                await db.execute(delete(ResponseCacheEntry).where(
+                    ResponseCacheEntry.expires_at < datetime.utcnow()
+                ))
+            await db.commit()
+
+
+# 创建全局回复缓存实例
+response_cache = ResponseCache()
@@ -58,6 +58,12 @@ class Message(MessageBase):
         from_attributes = True  # 支持 ORM 模式
 
 
+# 消息分页返回 Schema
+class MessagePage(BaseModel):
+    items: List[Message]  # 当前页的消息，按时间正序
+    has_more: bool  # 查询方向上是否还有更多消息
+
+
 # 对话基础 Schema
 class ConversationBase(BaseModel):
     title: str  # 对话标题
@@ -80,13 +86,48 @@ class Conversation(ConversationBase):
         from_attributes = True  # 支持 ORM 模式
 
 
+# 对话摘要 Schema，用于对话列表（不包含消息）
+class ConversationSummary(ConversationBase):
+    id: int  # 对话ID
+    created_at: datetime  # 创建时间
+    updated_at: Optional[datetime] = None  # 最近活跃时间
+    message_count: int = 0  # 消息数量
+    last_message_preview: Optional[str] = None  # 最后一条消息预览
+    
+    class Config:
+        from_attributes = True  # 支持 ORM 模式
+
+
+# 对话摘要分页返回 Schema
+class ConversationSummaryPage(BaseModel):
+    items: List[ConversationSummary]  # 当前页的对话
+    next_cursor: Optional[str] = None  # 下一页游标，没有更多数据时为空
+
+
 # 聊天请求 Schema
 class ChatRequest(BaseModel):
     message: str  # 用户消息
     conversation_id: Optional[int] = None  # 对话ID（可选）
+    bypass_cache: bool = False  # 是否跳过回复缓存，强制由模型重新生成
 
 
 # 聊天响应 Schema
 class ChatResponse(BaseModel):
     response: str  # AI 回复内容
-    conversation_id: int  # 对话ID
\ No newline at end of file
+    conversation_id: int  # 对话ID
+
+# 搜索结果 Schema
+class SearchHit(BaseModel):
+    conversation_id: int  # 所属对话ID
+    conversation_title: str  # 对话标题
+    message_id: Optional[int] = None  # 命中的消息ID，命中对话标题时为空
+    role: Optional[str] = None  # 消息角色，命中对话标题时为空
+    snippet: str  # 高亮片段（已转义的 HTML，命中词用 <mark> 标记）
+    score: float  # 相关度得分
+    created_at: Optional[datetime] = None  # 消息（或对话）创建时间
+
+
+# 搜索结果分页返回 Schema
+class SearchPage(BaseModel):
+    items: List[SearchHit]  # 当前页的结果，按相关度倒序
+    next_offset: Optional[int] = None  # 下一页偏移量，没有更多结果时为空
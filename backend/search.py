@@ -0,0 +1,213 @@
+"""
+全文搜索：在当前用户的消息内容和对话标题中搜索，返回按相关度排序的高亮片段
+"""
+# 导入所需的库
+import html  # 片段 HTML 转义
+import re    # 分词
+from collections import Counter  # 词频统计
+from typing import Dict, List, Optional, Tuple  # 类型注解
+from sqlalchemy import func, insert, select, text, tuple_  # 查询构造
+from sqlalchemy.engine import make_url  # 解析数据库连接字符串
+from sqlalchemy.ext.asyncio import AsyncSession  # 异步数据库会话
+from models import Conversation, Message, SearchTerm  # ORM 模型
+from config import settings  # 导入配置项
+
+# 英文/数字连续串，或中文连续串
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+|[\u3400-\u4dbf\u4e00-\u9fff]+")
+CJK_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]")
+MAX_TERM_LENGTH = 32  # 与 search_terms.term 列长度一致
+MAX_QUERY_TERMS = 16  # 单次查询最多使用的词数
+SNIPPET_LENGTH = 120  # 片段长度（字符）
+
+
+def tokenize(content: str, query: bool = False) -> List[str]:
+    """
+    分词：英文按单词（小写），中文按相邻二字组（与 MySQL ngram 解析器的默认 token 大小一致）。
+    建立索引时每个汉字也单独成词，单字查询能命中词中的汉字；
+    查询时多字的中文串只使用二字组，单个汉字使用单字。
+    """
+    terms = []
+    for run in TOKEN_PATTERN.findall(content.lower()):
+        if not CJK_PATTERN.match(run):
+            terms.append(run[:MAX_TERM_LENGTH])
+            continue
+        if len(run) > 1:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+        if not query or len(run) == 1:
+            terms.extend(run)
+    return terms
+
+
+def make_snippet(content: str, terms: List[str]) -> str:
+    """
+    截取第一个命中词附近的片段，HTML 转义后用 <mark> 标记所有命中词。
+    """
+    lowered = content.lower()
+    ranges = []
+    for term in set(terms):
+        start = lowered.find(term)
+        while start != -1:
+            ranges.append((start, start + len(term)))
+            start = lowered.find(term, start + 1)
+    # 合并重叠区间（中文二字组相互重叠）
+    ranges.sort()
+    merged: List[List[int]] = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    first = merged[0][0] if merged else 0
+    window_start = max(0, min(first - SNIPPET_LENGTH // 4, len(content) - SNIPPET_LENGTH))
+    window_end = min(len(content), window_start + SNIPPET_LENGTH)
+    parts = ["…"] if window_start > 0 else []
+    position = window_start
+    for start, end in merged:
+        if end <= window_start or start >= window_end:
+            continue
+        start, end = max(start, window_start), min(end, window_end)
+        parts.append(html.escape(content[position:start]))
+        parts.append(f"<mark>{html.escape(content[start:end])}</mark>")
+        position = end
+    parts.append(html.escape(content[position:window_end]))
+    if window_end < len(content):
+        parts.append("…")
+    return " ".join("".join(parts).split())
+
+
+class SearchIndex:
+    """
+    搜索实现：MySQL 使用 FULLTEXT 索引（ngram 解析器），其他数据库使用内置倒排索引 search_terms。
+    内置倒排索引在写入消息和创建对话时与业务数据在同一事务中增量维护。
+    """
+    def __init__(self, backend: str = None):
+        """
+        初始化 SearchIndex。
+        :param backend: auto / fulltext / index，auto 时按数据库类型选择。
+        """
+        backend = backend or settings.SEARCH_BACKEND
+        if backend == "auto":
+            is_mysql = make_url(settings.DATABASE_URL).get_backend_name() == "mysql"
+            backend = "fulltext" if is_mysql else "index"
+        self.backend = backend
+
+    @property
+    def maintains_index(self) -> bool:
+        return self.backend == "index"
+
+    def term_rows(self, user_id: int, conversation_id: int, seq: int, content: str) -> List[dict]:
+        """
+        生成一篇文档的倒排索引行。
+        """
+        return [
+            {"user_id": user_id, "term": term, "conversation_id": conversation_id, "seq": seq, "tf": tf}
+            for term, tf in Counter(tokenize(content)).items()
+        ]
+
+    async def index_documents(self, db: AsyncSession, rows: List[dict]):
+        """
+        写入倒排索引行（不提交，与消息在同一事务中）。
+        """
+        if self.maintains_index and rows:
+            await db.execute(insert(SearchTerm), rows)
+
+    async def index_title(self, db: AsyncSession, conversation: Conversation):
+        """
+        为对话标题建立索引（对话已 flush，拥有ID）。
+        """
+        if self.maintains_index and conversation.title:
+            await self.index_documents(db, self.term_rows(conversation.user_id, conversation.id, 0, conversation.title))
+
+    async def search(self, db: AsyncSession, user_id: int, query: str,
+                     offset: int = 0, limit: int = 20) -> Tuple[List[dict], bool]:
+        """
+        搜索当前用户的消息和对话标题。
+        :return: (结果列表, 是否还有更多结果)
+        """
+        terms = list(dict.fromkeys(tokenize(query, query=True)))[:MAX_QUERY_TERMS]
+        if not terms:
+            return [], False
+        if self.backend == "fulltext":
+            hits = await self._search_fulltext(db, user_id, query, offset, limit + 1)
+        else:
+            hits = await self._search_index(db, user_id, terms, offset, limit + 1)
+        has_more = len(hits) > limit
+        return await self._load_documents(db, hits[:limit], terms), has_more
+
+    async def _search_index(self, db: AsyncSession, user_id: int, terms: List[str],
+                            offset: int, limit: int) -> List[Tuple[int, int, float]]:
+        # 按 (user_id, term) 主键前缀定位倒排列表，要求文档包含全部查询词
+        result = await db.execute(
+            select(SearchTerm.conversation_id, SearchTerm.seq, func.sum(SearchTerm.tf).label("score"))
+            .where(SearchTerm.user_id == user_id, SearchTerm.term.in_(terms))
+            .group_by(SearchTerm.conversation_id, SearchTerm.seq)
+            .having(func.count() == len(terms))
+            .order_by(text("score DESC"), SearchTerm.conversation_id.desc(), SearchTerm.seq.desc())
+            .offset(offset)
+            .limit(limit)
+        )
+        return [(conversation_id, seq, float(score)) for conversation_id, seq, score in result.all()]
+
+    async def _search_fulltext(self, db: AsyncSession, user_id: int, query: str,
+                               offset: int, limit: int) -> List[Tuple[int, int, float]]:
+        # 布尔模式：每个词都必须出现，中文词按短语匹配 ngram
+        words = [word for word in re.split(r"[\s\"'()+\-<>~*@]+", query) if word]
+        if not words:
+            return []
+        against = " ".join(f'+"{word}"' for word in words)
+        result = await db.execute(text(
+            "SELECT m.conversation_id, m.seq, MATCH(m.content) AGAINST(:q IN BOOLEAN MODE) AS score "
+            "FROM messages m JOIN conversations c ON c.id = m.conversation_id "
+            "WHERE c.user_id = :user_id AND MATCH(m.content) AGAINST(:q IN BOOLEAN MODE) "
+            "UNION ALL "
+            "SELECT c.id, 0, MATCH(c.title) AGAINST(:q IN BOOLEAN MODE) "
+            "FROM conversations c "
+            "WHERE c.user_id = :user_id AND MATCH(c.title) AGAINST(:q IN BOOLEAN MODE) "
+            "ORDER BY score DESC, conversation_id DESC, seq DESC "
+            "LIMIT :limit OFFSET :offset"
+        ), {"q": against, "user_id": user_id, "limit": limit, "offset": offset})
+        return [(conversation_id, seq, float(score)) for conversation_id, seq, score in result.all()]
+
+    async def _load_documents(self, db: AsyncSession, hits: List[Tuple[int, int, float]],
+                              terms: List[str]) -> List[dict]:
+        """
+        加载命中文档并生成高亮片段。
+        """
+        if not hits:
+            return []
+        conversation_ids = {conversation_id for conversation_id, _, _ in hits}
+        result = await db.execute(
+            select(Conversation.id, Conversation.title, Conversation.created_at)
+            .where(Conversation.id.in_(conversation_ids))
+        )
+        conversations = {row.id: row for row in result.all()}
+        message_keys = [(conversation_id, seq) for conversation_id, seq, _ in hits if seq]
+        messages: Dict[Tuple[int, int], Message] = {}
+        if message_keys:
+            # 按 (conversation_id, seq) 唯一索引回表
+            result = await db.execute(
+                select(Message).where(tuple_(Message.conversation_id, Message.seq).in_(message_keys))
+            )
+            messages = {(m.conversation_id, m.seq): m for m in result.scalars().all()}
+        items = []
+        for conversation_id, seq, score in hits:
+            conversation = conversations.get(conversation_id)
+            if conversation is None:
+                continue
+            message: Optional[Message] = messages.get((conversation_id, seq)) if seq else None
+            if seq and message is None:
+                continue
+            items.append({
+                "conversation_id": conversation_id,
+                "conversation_title": conversation.title or "",
+                "message_id": message.id if message else None,
+                "role": message.role if message else None,
+                "snippet": make_snippet(message.content if message else conversation.title or "", terms),
+                "score": score,
+                "created_at": message.created_at if message else conversation.created_at,
+            })
+        return items
+
+
+# 创建全局搜索实例
+search_index = SearchIndex()
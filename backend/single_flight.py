@@ -0,0 +1,160 @@
+"""
+相同生成请求的合并（single-flight）：同一模型、同一实际输入的请求同时进行时，
+只有第一个请求调用模型，其余请求等待同一结果或共享同一个流
+"""
+# 导入所需的库
+import asyncio  # 共享任务与事件
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional  # 类型注解
+
+
+class Flight:
+    """
+    一次正在进行的上游生成。非流式请求等待 task 的结果；流式请求从头读取 chunks，
+    追上后等待新的分片，晚加入的请求也能拿到完整回复。
+    """
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.chunks: List[str] = []  # 已生成的文本分片（流式）
+        self.context: Optional[List[int]] = None  # 生成结束时返回的 context（流式）
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.waiters = 0  # 仍在等待结果的请求数
+        self._changed = asyncio.Event()
+
+    def push(self, text: str):
+        """
+        追加一个分片并唤醒等待中的订阅者。
+        """
+        self.chunks.append(text)
+        self._notify()
+
+    def finish(self, error: BaseException = None):
+        self.done = True
+        self.error = error
+        self._notify()
+
+    async def wait_changed(self):
+        await self._changed.wait()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+
+class SingleFlight:
+    """
+    SingleFlight 按键合并正在进行的请求。上游调用在独立任务中执行，发起请求的客户端断开不影响其他等待者；
+    所有等待者都离开后才取消上游调用。
+    """
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._flights: Dict[str, Flight] = {}
+        self.started = 0  # 实际发起的上游调用数
+        self.coalesced = 0  # 合并到已有调用上的请求数
+
+    def join(self, key: str) -> Optional[Flight]:
+        """
+        加入相同键的正在进行的调用，没有时返回 None。检查和登记之间没有 await，
+        加入后即使调用随即结束，结果也保留在返回的 Flight 上，不会再发起新的上游调用。
+        返回的 Flight 必须交给 wait（非流式）或 subscribe（流式）读取，或调用 leave 放弃。
+        """
+        flight = self._flights.get(key) if self.enabled else None
+        if flight is not None:
+            self.coalesced += 1
+            flight.waiters += 1
+        return flight
+
+    def leave(self, flight: Flight):
+        """
+        放弃 join 加入但没有读取的调用。
+        """
+        self._leave(flight)
+
+    async def run(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行非流式调用：没有相同键的调用时执行 func，否则等待已有调用的结果（异常同样共享）。
+        """
+        if not self.enabled:
+            return await func()
+        flight = self.join(key)
+        if flight is None:
+            flight = self._start(key, func())
+            flight.waiters += 1
+        return await self.wait(flight)
+
+    async def wait(self, flight: Flight) -> Any:
+        """
+        等待非流式调用的结果（异常同样共享），结束后离开。
+        """
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            self._leave(flight)
+
+    def stream_flight(self, key: str, func: Callable[[Flight], Awaitable[None]]) -> Flight:
+        """
+        获取（必要时发起）流式调用：func 接收 Flight 并把分片 push 进去，结束时设置 context；
+        返回的 Flight 交给 subscribe 读取，相同键的请求订阅同一个 Flight。
+        """
+        flight = self.join(key)
+        if flight is None:
+            flight = Flight()
+            self._start(key, self._produce(flight, func), flight)
+            flight.waiters += 1
+        return flight
+
+    async def subscribe(self, flight: Flight) -> AsyncIterator[str]:
+        """
+        从头读取 stream_flight 返回的 Flight 的分片直到结束，上游出错时抛出同一异常。
+        """
+        try:
+            index = 0
+            while True:
+                while index < len(flight.chunks):
+                    yield flight.chunks[index]
+                    index += 1
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await flight.wait_changed()
+        finally:
+            self._leave(flight)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._flights),
+            "started": self.started,
+            "coalesced": self.coalesced,
+        }
+
+    def _start(self, key: str, coroutine: Awaitable[Any], flight: Flight = None) -> Flight:
+        flight = flight or Flight()
+        flight.task = asyncio.ensure_future(coroutine)
+        self.started += 1
+        if self.enabled:
+            self._flights[key] = flight
+            # 调用结束后立即移除，之后的相同请求重新发起（或命中回复缓存），不会读到旧结果
+            flight.task.add_done_callback(lambda _: self._remove(key, flight))
+        return flight
+
+    def _remove(self, key: str, flight: Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def _produce(self, flight: Flight, func: Callable[[Flight], Awaitable[None]]):
+        try:
+            await func(flight)
+        except BaseException as e:
+            flight.finish(e)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        else:
+            flight.finish()
+
+    def _leave(self, flight: Flight):
+        flight.waiters -= 1
+        if flight.waiters == 0 and not flight.task.done():
+            # 所有等待者都已离开（客户端断开），不再需要上游结果
+            flight.task.cancel()
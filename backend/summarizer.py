@@ -0,0 +1,247 @@
+"""
+对话滚动摘要：后台把较早的消息压缩成摘要，prompt 只发送摘要和最近的消息，
+对话再长，prompt 长度也基本不变
+"""
+# 导入所需的库
+import logging  # 日志
+import asyncio    # 后台摘要任务
+import threading  # 线程锁
+from collections import OrderedDict  # LRU 缓存
+from typing import Dict, List, Optional, Set, Tuple  # 类型注解
+from sqlalchemy import func, select, update  # 查询和更新语句
+from database import AsyncSessionLocal  # 异步数据库会话工厂
+from models import ConversationRollingSummary, Message  # ORM 模型
+from admission import admission  # 低优先级的模型并发名额
+from ai_service import ai_service  # 调用模型生成摘要
+from prompt_builder import prompt_builder  # token 计数和截断
+from config import settings  # 导入配置项
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_INSTRUCTION = (
+    "请把下面的对话整理成一段简洁的摘要，保留用户的身份和偏好、已经确定的事实和结论、"
+    "尚未解决的问题，不要编造内容，不超过{limit}字。\n"
+)
+
+
+class ConversationSummarizer:
+    """
+    ConversationSummarizer 为每个对话维护一份滚动摘要（conversation_summaries 表 + 进程内 LRU）：
+    - 读取历史时，摘要替换它已覆盖的消息，放在历史最前面（role 为 summary）；
+    - 摘要之后的消息超过 keep_recent + every 条时，后台任务把除最近 keep_recent 条以外的消息
+      连同旧摘要交给模型生成新摘要；
+    - 生成摘要通过准入控制的低优先级通道调用模型，交互请求排队时一直让行。
+    """
+    def __init__(self, enabled: bool = None, every: int = None, keep_recent: int = None,
+                 max_conversations: int = None):
+        """
+        初始化 ConversationSummarizer。
+        :param enabled: 是否启用滚动摘要。
+        :param every: 摘要之后积累多少条新消息（不含保留的最近消息）时重新生成摘要。
+        :param keep_recent: 始终原样发送、不进入摘要的最近消息条数。
+        :param max_conversations: 内存中最多缓存摘要的对话数量。
+        """
+        self.enabled = settings.SUMMARY_ENABLED if enabled is None else enabled
+        self.every = every or settings.SUMMARY_EVERY
+        self.keep_recent = keep_recent or settings.SUMMARY_KEEP_RECENT
+        self.max_conversations = max_conversations or settings.SUMMARY_CACHE_SIZE
+        self._entries: "OrderedDict[int, Tuple[str, int]]" = OrderedDict()  # conversation_id -> (摘要, covered_seq)
+        self._lock = threading.Lock()
+        self._queue: Optional[asyncio.Queue] = None
+        self._scheduled: Set[int] = set()  # 已排队或正在生成摘要的对话
+        self._task: Optional[asyncio.Task] = None
+        self.generated = 0  # 生成的摘要数
+        self.failed = 0  # 生成失败次数
+        self.skipped = 0  # 队列已满未能排队的次数
+
+    def start(self):
+        """
+        启动后台摘要任务（需在事件循环中调用）。
+        """
+        if not self.enabled or self._task is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=settings.SUMMARY_QUEUE_SIZE)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        停止后台摘要任务，未完成的摘要下次触发时重新生成。
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+
+    async def apply(self, conversation_id: int, history: List[Dict]) -> List[Dict]:
+        """
+        用摘要替换历史中已被覆盖的消息，并在摘要落后太多时安排后台重新生成。
+        :param conversation_id: 对话ID。
+        :param history: 最近的消息（带 seq），按时间正序。
+        :return: [摘要（如有）, 摘要之后的消息...]
+        """
+        if not self.enabled or not history:
+            return history
+        summary, covered_seq = await self.get(conversation_id)
+        if history[-1]["seq"] - covered_seq >= self.keep_recent + self.every:
+            self.schedule(conversation_id)
+        if not summary:
+            return history
+        return [{"role": "summary", "content": summary}] + [msg for msg in history if msg["seq"] > covered_seq]
+
+    async def get(self, conversation_id: int) -> Tuple[Optional[str], int]:
+        """
+        获取对话的摘要和它覆盖到的消息序号，没有摘要时返回 (None, 0)。
+        """
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is not None:
+                self._entries.move_to_end(conversation_id)
+                return entry
+        async with AsyncSessionLocal() as db:
+            row = await db.get(ConversationRollingSummary, conversation_id)
+            entry = (row.summary, row.covered_seq) if row else (None, 0)
+        self._remember(conversation_id, entry)
+        return entry
+
+    def schedule(self, conversation_id: int):
+        """
+        安排后台为对话生成摘要；已在队列中或队列已满时忽略（下一轮对话会再次触发）。
+        """
+        if self._queue is None or conversation_id in self._scheduled:
+            return
+        try:
+            self._queue.put_nowait(conversation_id)
+        except asyncio.QueueFull:
+            self.skipped += 1
+            return
+        self._scheduled.add(conversation_id)
+
+    def discard(self, conversation_id: int):
+        """
+        删除内存中的摘要（数据库记录随对话级联删除）。
+        """
+        with self._lock:
+            self._entries.pop(conversation_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        摘要生成统计。
+        """
+        return {
+            "enabled": self.enabled,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "generated": self.generated,
+            "failed": self.failed,
+            "skipped": self.skipped,
+        }
+
+    def _remember(self, conversation_id: int, entry: Tuple[Optional[str], int]):
+        with self._lock:
+            self._entries[conversation_id] = entry
+            self._entries.move_to_end(conversation_id)
+            while len(self._entries) > self.max_conversations:
+                self._entries.popitem(last=False)
+
+    async def _run(self):
+        while True:
+            conversation_id = await self._queue.get()
+            more = False
+            try:
+                more = await self._summarize(conversation_id)
+            except Exception as e:
+                self.failed += 1
+                logger.warning("生成对话摘要失败: %s", e)
+            finally:
+                self._scheduled.discard(conversation_id)
+            if more:
+                # 一次没有覆盖完（如长对话首次摘要），继续下一段
+                self.schedule(conversation_id)
+
+    async def _summarize(self, conversation_id: int) -> bool:
+        """
+        为对话生成一次新摘要：旧摘要 + 之后到最近 keep_recent 条之前的消息（在预算内按时间顺序装入）。
+        :return: 是否还有未能装入本次摘要的消息。
+        """
+        summary, covered_seq = await self.get(conversation_id)
+        async with AsyncSessionLocal() as db:
+            last_seq = (await db.execute(
+                select(func.max(Message.seq)).where(Message.conversation_id == conversation_id)
+            )).scalar() or 0
+            upto = last_seq - self.keep_recent
+            if upto - covered_seq < self.every:
+                return False
+            result = await db.execute(
+                select(Message.role, Message.content, Message.seq)
+                .where(Message.conversation_id == conversation_id,
+                       Message.seq > covered_seq, Message.seq <= upto)
+                .order_by(Message.seq)
+            )
+            messages = result.all()
+        if not messages:
+            return False
+
+        limit = settings.SUMMARY_MAX_TOKENS
+        prompt = SUMMARY_INSTRUCTION.format(limit=limit)
+        if summary:
+            prompt += prompt_builder.format_line("summary", summary)
+        tail = "摘要:"
+        # 输出摘要也要占用上下文，预算中为其预留 limit 个 token
+        remaining = prompt_builder.budget(ai_service.model) - limit - prompt_builder.count(prompt + tail)
+        new_covered = covered_seq
+        for role, content, seq in messages:
+            content = prompt_builder.trim(content, min(settings.PROMPT_MAX_MESSAGE_TOKENS, remaining))
+            line = prompt_builder.format_line(role, content)
+            tokens = prompt_builder.count(line)
+            if not content or tokens > remaining:
+                break
+            prompt += line
+            remaining -= tokens
+            new_covered = seq
+        if new_covered == covered_seq:
+            return False
+        prompt += tail
+
+        # 低优先级：交互请求排队时一直等待
+        ticket = await admission.acquire_background()
+        try:
+            text = await ai_service.complete(prompt)
+        finally:
+            ticket.release()
+        text = prompt_builder.trim(text.strip(), limit)
+        if not text:
+            raise ValueError("模型没有返回摘要")
+        await self._save(conversation_id, text, covered_seq, new_covered)
+        self.generated += 1
+        return new_covered < messages[-1].seq
+
+    async def _save(self, conversation_id: int, summary: str, previous_seq: int, covered_seq: int):
+        """
+        保存新摘要；只在数据库中的摘要仍是生成时读取的那一份时覆盖，多个进程同时生成时不会回退。
+        """
+        async with AsyncSessionLocal() as db:
+            row = await db.get(ConversationRollingSummary, conversation_id)
+            if row is None:
+                db.add(ConversationRollingSummary(
+                    conversation_id=conversation_id, summary=summary,
+                    covered_seq=covered_seq, model=ai_service.model
+                ))
+            else:
+                result = await db.execute(
+                    update(ConversationRollingSummary)
+                    .where(ConversationRollingSummary.conversation_id == conversation_id,
+                           ConversationRollingSummary.covered_seq == previous_seq)
+                    .values(summary=summary, covered_seq=covered_seq, model=ai_service.model)
+                    .execution_options(synchronize_session=False)
+                )
+                if not result.rowcount:
+                    self.discard(conversation_id)
+                    return
+            await db.commit()
+        self._remember(conversation_id, (summary, covered_seq))
+
+
+# 创建全局对话摘要实例
+conversation_summarizer = ConversationSummarizer()
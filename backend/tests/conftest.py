@@ -0,0 +1,14 @@
+"""
+测试配置：在导入应用模块之前设置必需的环境变量，使用临时 SQLite 数据库
+"""
+# 导入所需的库
+import os        # 环境变量
+import sys       # 模块搜索路径
+import tempfile  # 临时数据库文件
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "test.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{DB_PATH}")
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,64 @@
+"""
+认证缓存测试：停用的用户不能通过认证，已缓存的 token 在停用后立即失效
+"""
+# 导入所需的库
+import asyncio  # 运行异步依赖
+import pytest   # 断言异常
+from fastapi import HTTPException  # 认证失败的异常
+from auth import create_access_token, get_current_user, token_user_cache  # 被测试的认证依赖
+from database import AsyncSessionLocal, Base, engine  # 数据库
+from models import User  # 用户模型
+
+
+@pytest.fixture(autouse=True)
+def database():
+    Base.metadata.create_all(engine)
+    yield
+    Base.metadata.drop_all(engine)
+
+
+async def create_user(username: str, is_active: bool = True) -> User:
+    async with AsyncSessionLocal() as db:
+        user = User(username=username, email=f"{username}@example.com", hashed_password="x", is_active=is_active)
+        db.add(user)
+        await db.commit()
+        return user
+
+
+async def authenticate(token: str):
+    async with AsyncSessionLocal() as db:
+        return await get_current_user(token, db)
+
+
+async def set_active(user_id: int, is_active: bool):
+    async with AsyncSessionLocal() as db:
+        user = await db.get(User, user_id)
+        user.is_active = is_active
+        await db.commit()
+
+
+def test_inactive_user_is_rejected():
+    async def scenario():
+        await create_user("inactive", is_active=False)
+        token = create_access_token({"sub": "inactive"})
+        with pytest.raises(HTTPException) as error:
+            await authenticate(token)
+        assert error.value.status_code == 403
+        assert token_user_cache.get(token) is None
+
+    asyncio.run(scenario())
+
+
+def test_deactivated_user_is_not_served_from_cache():
+    async def scenario():
+        user = await create_user("active")
+        token = create_access_token({"sub": "active"})
+        assert (await authenticate(token)).id == user.id
+        assert token_user_cache.get(token) is not None
+        await set_active(user.id, False)
+        assert token_user_cache.get(token) is None
+        with pytest.raises(HTTPException) as error:
+            await authenticate(token)
+        assert error.value.status_code == 403
+
+    asyncio.run(scenario())
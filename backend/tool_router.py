@@ -0,0 +1,180 @@
+"""
+工具路由：在调用大模型之前，用一个预编译的组合正则一次扫描消息，
+命中数学计算等工具时直接由工具回复，不再调用模型
+"""
+# 导入所需的库
+import re         # 组合正则
+import threading  # 保护统计计数
+import time       # 统计工具耗时
+from typing import Awaitable, Callable, Dict, List, Optional  # 类型注解
+from math_mcp import math_engine  # 数学计算
+from tracing import span  # 请求追踪
+
+# 工具处理函数：接收消息和匹配结果，返回回复文本；返回 None 时继续调用模型
+ToolHandler = Callable[[str, "re.Match"], Awaitable[Optional[str]]]
+
+
+def build_keyword_pattern(keywords: List[str]) -> str:
+    """
+    把关键词构造成前缀树形式的正则：同一位置上各分支首字符互不相同，
+    匹配代价只取决于关键词长度，与关键词数量无关；有公共前缀时优先匹配更长的关键词。
+    """
+    trie: Dict[str, dict] = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def render(node: Dict[str, dict]) -> str:
+        branches = [re.escape(char) + render(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return render(trie)
+
+
+class Tool:
+    """
+    已注册的工具及其命中统计。
+    """
+    def __init__(self, name: str, handler: Optional[ToolHandler]):
+        self.name = name
+        self.handler = handler
+        self.hits = 0  # 命中次数
+        self.handled = 0  # 由工具直接回复（未调用模型）的次数
+        self.total_ms = 0.0  # 处理函数累计耗时（毫秒）
+
+
+class ToolRouter:
+    """
+    ToolRouter 管理模型前的快速路径。工具可以按正则注册（如整条消息是算式），
+    也可以按关键词注册（意图识别）；所有工具合并成一个正则，每条消息只扫描一次。
+    """
+    def __init__(self):
+        self._tools: Dict[str, Tool] = {}
+        self._patterns: List[tuple] = []  # [(工具名, 正则)]，按注册顺序，同一位置上先注册的优先
+        self._keywords: Dict[str, str] = {}  # 关键词（小写） -> 工具名
+        self._compiled: Optional[re.Pattern] = None
+        self._lock = threading.Lock()
+        self.routed = 0  # 扫描的消息数
+        self.route_ms = 0.0  # 扫描累计耗时（毫秒）
+
+    def register(self, name: str, handler: Optional[ToolHandler] = None,
+                 pattern: str = None, keywords: List[str] = None):
+        """
+        注册工具。
+        :param name: 工具名称。
+        :param handler: 处理函数；为 None 时只统计命中（意图标记），消息继续交给模型。
+        :param pattern: 匹配消息的正则（不能包含命名分组）。
+        :param keywords: 匹配消息的关键词，不区分大小写。
+        """
+        self._tools[name] = Tool(name, handler)
+        if pattern:
+            self._patterns.append((name, pattern))
+        for keyword in keywords or []:
+            self._keywords.setdefault(keyword.lower(), name)
+        self._compiled = None
+
+    def match(self, message: str) -> Optional[tuple]:
+        """
+        扫描消息，返回 (工具, 匹配结果)，没有命中时返回 None。
+        """
+        pattern = self._compiled or self._compile()
+        start = time.perf_counter()
+        found = None
+        # 一次扫描：优先返回第一个有处理函数的工具，否则返回第一个命中的意图
+        for match in pattern.finditer(message):
+            tool = self._tool_for(match)
+            if found is None:
+                found = (tool, match)
+            if tool.handler is not None:
+                found = (tool, match)
+                break
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.routed += 1
+            self.route_ms += elapsed
+        return found
+
+    async def dispatch(self, message: str) -> Optional[str]:
+        """
+        命中工具时调用其处理函数并返回回复；没有命中或工具不处理时返回 None，由调用方继续调用模型。
+        """
+        matched = self.match(message)
+        if matched is None:
+            return None
+        tool, match = matched
+        reply = None
+        start = time.perf_counter()
+        try:
+            if tool.handler is not None:
+                with span(f"tool.{tool.name}") as stage:
+                    reply = await tool.handler(message, match)
+                    stage.set(handled=reply is not None)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            with self._lock:
+                tool.hits += 1
+                tool.total_ms += elapsed
+                if reply is not None:
+                    tool.handled += 1
+        return reply
+
+    def stats(self) -> Dict[str, object]:
+        """
+        路由与各工具的命中、耗时统计。
+        """
+        with self._lock:
+            return {
+                "routed": self.routed,
+                "route_avg_ms": self.route_ms / self.routed if self.routed else 0.0,
+                "tools": {
+                    tool.name: {
+                        "hits": tool.hits,
+                        "handled": tool.handled,
+                        "avg_ms": tool.total_ms / tool.hits if tool.hits else 0.0,
+                    }
+                    for tool in self._tools.values()
+                },
+            }
+
+    def _tool_for(self, match: "re.Match") -> Tool:
+        if match.lastgroup == "kw":
+            return self._tools[self._keywords[match.group().lower()]]
+        return self._tools[self._patterns[int(match.lastgroup[1:])][0]]
+
+    def _compile(self) -> re.Pattern:
+        """
+        把所有工具合并成一个正则：正则工具各占一个分组 t<序号>，关键词合并为前缀树分组 kw。
+        """
+        parts = [f"(?P<t{index}>{pattern})" for index, (_, pattern) in enumerate(self._patterns)]
+        if self._keywords:
+            parts.append(f"(?P<kw>{build_keyword_pattern(list(self._keywords))})")
+        # 没有注册任何工具时使用永不匹配的正则
+        self._compiled = re.compile("|".join(parts) or r"(?!)", re.IGNORECASE)
+        return self._compiled
+
+
+async def math_tool(message: str, match: "re.Match") -> Optional[str]:
+    """
+    数学计算：整条消息是算式时直接计算。
+    """
+    result = await math_engine.request(message)
+    if result["status"] == "success":
+        return f"答案：{result['result']}"
+    elif result["status"] == "error":
+        return f"数学计算出错：{result['reason']}"
+    return None
+
+
+# 创建全局工具路由实例，并注册内置工具
+tool_router = ToolRouter()
+# 只由数字、运算符和“等于多少”等问法组成的消息
+tool_router.register("math", math_tool, pattern=r"\A\s*(?:[0-9+\-*/().eE= ]|等于多少|等于几|是多少)+\s*\Z")
+# 需要联网获取实时信息的意图，目前只统计命中，仍由模型回复
+tool_router.register("internet", keywords=[
+    '今天', '日期', '星期', '几号', '现在时间', '天气', '新闻', '查一下', '搜索', '百度', '谷歌', 'google', 'bing', 'stock', '股价', '汇率', '实时', '热搜', '头条'
+])
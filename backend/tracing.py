@@ -0,0 +1,297 @@
+"""
+请求级链路追踪：每个请求一棵 span 树，当前 span 通过 contextvars 在请求内传递（包括依赖项和流式响应），
+完成的追踪保存在内存环形缓冲区中（可选写入 JSON Lines 文件），超过阈值的慢请求打印 span 树
+"""
+# 导入所需的库
+import asyncio    # 记录被采样请求使用的任务
+import json       # JSON Lines 导出
+import logging  # 日志
+import threading  # 保护环形缓冲区和导出文件
+import time       # 计时
+import uuid       # 追踪 ID
+from collections import deque  # 环形缓冲区
+from contextlib import contextmanager  # span 上下文管理器
+from contextvars import ContextVar  # 在请求内传递当前 span
+from typing import Any, Dict, List, Optional  # 类型注解
+from profiler import profiler  # 按需采样分析
+from config import settings  # 导入配置项
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    """
+    一个计时阶段：名称、属性、起止时间、子 span 和异常类型。
+    """
+    __slots__ = ("name", "attrs", "start", "end", "children", "error", "root")
+
+    def __init__(self, name: str, root: "Trace" = None, attrs: Dict[str, Any] = None):
+        self.name = name
+        self.attrs = attrs or {}
+        self.start = time.perf_counter()
+        self.end = None
+        self.children: List["Span"] = []
+        self.error = None
+        self.root = root
+
+    def child(self, name: str, **attrs) -> "Span":
+        """
+        创建子 span（不设为当前 span，调用方负责 finish）。
+        """
+        span = Span(name, self.root, attrs)
+        self.children.append(span)
+        return span
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def finish(self, error: str = None):
+        if self.end is None:
+            self.end = time.perf_counter()
+        if error:
+            self.error = error
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end or time.perf_counter()) - self.start) * 1000
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        data = {
+            "name": self.name,
+            "offset_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round(self.duration_ms, 3),
+        }
+        if self.attrs:
+            data["attrs"] = self.attrs
+        if self.error:
+            data["error"] = self.error
+        if self.children:
+            data["children"] = [child.to_dict(origin) for child in self.children]
+        return data
+
+
+class Trace(Span):
+    """
+    请求的根 span，附带追踪 ID 和是否被采样分析。
+    """
+    __slots__ = ("trace_id", "started_at", "profiled")
+
+    def __init__(self, name: str, profiled: bool = False):
+        super().__init__(name)
+        self.root = self
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.started_at = time.time()
+        self.profiled = profiled
+
+    def to_dict(self, origin: float = None) -> Dict[str, Any]:
+        data = super().to_dict(self.start)
+        data["trace_id"] = self.trace_id
+        data["started_at"] = self.started_at
+        return data
+
+
+class _NullSpan:
+    """
+    当前没有请求追踪时（如后台任务）使用的空 span，所有操作都不做任何事。
+    """
+    def child(self, name: str, **attrs) -> "_NullSpan":
+        return self
+
+    def set(self, **attrs):
+        pass
+
+    def finish(self, error: str = None):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span():
+    """
+    当前 span，不在请求追踪中时返回空 span。
+    """
+    return _current_span.get() or NULL_SPAN
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    在当前 span 下创建子 span 并设为当前 span，退出时结束计时；异常时记录异常类型。
+    不在请求追踪中时不做任何事。
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield NULL_SPAN
+        return
+    child = parent.child(name, **attrs)
+    if parent.root.profiled:
+        profiler.track(parent.root, asyncio.current_task())
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = type(e).__name__
+        raise
+    finally:
+        child.finish()
+        _current_span.reset(token)
+
+
+def start_span(name: str, **attrs):
+    """
+    在当前 span 下创建子 span 但不设为当前 span，用于跨越 yield 的阶段（如流式生成），调用方负责 finish。
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return NULL_SPAN
+    if parent.root.profiled:
+        profiler.track(parent.root, asyncio.current_task())
+    return parent.child(name, **attrs)
+
+
+class Tracer:
+    """
+    Tracer 管理请求追踪的导出：
+    - 最近完成的追踪保存在环形缓冲区中，供 /admin/traces 查看；
+    - 配置了 TRACE_EXPORT_PATH 时每条追踪追加一行 JSON；
+    - 耗时超过 TRACE_SLOW_MS 的请求打印 span 树。
+    """
+    def __init__(self, enabled: bool = None, buffer_size: int = None, export_path: str = None,
+                 slow_ms: float = None):
+        """
+        初始化 Tracer。
+        :param enabled: 是否启用追踪。
+        :param buffer_size: 环形缓冲区保存的追踪数量。
+        :param export_path: JSON Lines 导出文件路径（可选）。
+        :param slow_ms: 慢请求阈值（毫秒），0 表示不打印。
+        """
+        self.enabled = settings.TRACING_ENABLED if enabled is None else enabled
+        self.slow_ms = settings.TRACE_SLOW_MS if slow_ms is None else slow_ms
+        self.export_path = export_path or settings.TRACE_EXPORT_PATH
+        self.exclude_paths = tuple(settings.TRACE_EXCLUDE_PATHS)
+        self._buffer: deque = deque(maxlen=buffer_size or settings.TRACE_BUFFER_SIZE)
+        self._lock = threading.Lock()
+        self._file = None
+        self.traced = 0  # 完成追踪的请求数
+        self.slow = 0  # 慢请求数
+
+    def excluded(self, path: str) -> bool:
+        """
+        是否不追踪该路径（长连接和监控接口）。
+        """
+        return path.startswith(self.exclude_paths)
+
+    def finish(self, trace: Trace):
+        """
+        结束请求追踪：保存到环形缓冲区、导出，并打印慢请求。
+        """
+        trace.finish()
+        data = trace.to_dict()
+        slow = bool(self.slow_ms) and trace.duration_ms >= self.slow_ms
+        with self._lock:
+            self.traced += 1
+            if slow:
+                self.slow += 1
+            self._buffer.append(data)
+            if self.export_path:
+                self._export(data)
+        if slow:
+            logger.warning("🐢 慢请求 %s %.1fms trace_id=%s\n%s", trace.name, trace.duration_ms, trace.trace_id,
+                           format_tree(trace))
+
+    def recent(self, limit: int = 50, slow_only: bool = False) -> List[Dict[str, Any]]:
+        """
+        最近完成的追踪，最新的在前。
+        """
+        with self._lock:
+            traces = list(self._buffer)
+        traces.reverse()
+        if slow_only:
+            traces = [trace for trace in traces if trace["duration_ms"] >= self.slow_ms]
+        return traces[:limit]
+
+    def stats(self) -> Dict[str, object]:
+        """
+        追踪统计。
+        """
+        return {
+            "enabled": self.enabled,
+            "traced": self.traced,
+            "slow": self.slow,
+            "buffered": len(self._buffer),
+        }
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _export(self, data: Dict[str, Any]):
+        """
+        追加一行 JSON（调用方需持有锁）。单行写入很小，直接写入页缓存，不单独使用线程。
+        """
+        try:
+            if self._file is None:
+                self._file = open(self.export_path, "a", encoding="utf-8")
+            self._file.write(json.dumps(data, ensure_ascii=False) + "\n")
+            self._file.flush()
+        except OSError as e:
+            logger.error("写入追踪文件失败，停止导出: %s", e)
+            self.export_path = None
+
+
+def format_tree(span: Span, depth: int = 0) -> str:
+    """
+    按缩进格式化 span 树。
+    """
+    line = f"{'  ' * depth}{span.name} {span.duration_ms:.1f}ms"
+    if span.attrs:
+        line += " " + " ".join(f"{key}={value}" for key, value in span.attrs.items())
+    if span.error:
+        line += f" error={span.error}"
+    return "\n".join([line] + [format_tree(child, depth + 1) for child in span.children])
+
+
+class TracingMiddleware:
+    """
+    为每个请求创建根 span（名称为方法和路由模板），在响应头中返回 X-Trace-Id。
+    纯 ASGI 中间件，流式响应追踪到最后一个分片发送完毕。
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not tracer.enabled or tracer.excluded(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        trace = Trace(scope["method"], profiled=profiler.claim())
+        if trace.profiled:
+            profiler.track(trace, asyncio.current_task())
+        token = _current_span.set(trace)
+
+        async def send_with_trace_id(message):
+            if message["type"] == "http.response.start":
+                trace.set(status=message["status"])
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-trace-id", trace.trace_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        except BaseException as e:
+            trace.error = type(e).__name__
+            raise
+        finally:
+            _current_span.reset(token)
+            route = scope.get("route")
+            trace.name = f"{scope['method']} {getattr(route, 'path', None) or scope['path']}"
+            if trace.profiled:
+                profiler.release(trace)
+            tracer.finish(trace)
+
+
+# 创建全局追踪实例
+tracer = Tracer()
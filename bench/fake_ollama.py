@@ -0,0 +1,162 @@
+"""
+本地模拟 Ollama 服务（压测用）：实现 /api/generate、/api/chat、/api/tags 和 /api/ps，
+可配置首 token 延迟、生成速度、回复长度、模型加载耗时和错误注入，返回与 Ollama 相同的计数和耗时字段
+
+用法：python bench/fake_ollama.py --port 11435 --latency 0.05 --token-rate 200 --tokens 50
+"""
+# 导入所需的库
+import argparse  # 命令行参数
+import asyncio   # 模拟延迟
+import json      # NDJSON 分片
+import random    # 错误注入
+import time      # 统计耗时
+from fastapi import FastAPI, Request  # HTTP 服务
+from fastapi.responses import JSONResponse, StreamingResponse  # 普通和流式响应
+import uvicorn   # 运行服务
+
+
+def create_app(args: argparse.Namespace) -> FastAPI:
+    """
+    按命令行参数创建模拟服务。
+    """
+    app = FastAPI()
+    models = args.models.split(",")
+    # 已“加载”的模型；配置了加载耗时时模型一开始都未加载，首次请求时模拟加载
+    loaded = set() if args.load_delay else set(models)
+    load_lock = asyncio.Lock()
+
+    async def load(model: str) -> int:
+        """
+        模拟模型加载，返回本次加载耗时（纳秒）。
+        """
+        if model in loaded:
+            return 0
+        async with load_lock:
+            if model in loaded:
+                return 0
+            await asyncio.sleep(args.load_delay)
+            loaded.add(model)
+            return int(args.load_delay * 1e9)
+
+    def injected_error():
+        """
+        按 --error-rate 随机返回 500。
+        """
+        if args.error_rate and random.random() < args.error_rate:
+            return JSONResponse({"error": "injected failure"}, status_code=500)
+        return None
+
+    def reply_tokens(prompt: str) -> list:
+        words = [f"词{index} " for index in range(args.tokens)]
+        if args.echo:
+            words[-1:] = [f"p={prompt[-40:]}"]
+        return words
+
+    def final_fields(model: str, prompt: str, load_duration: int, prompt_duration: float, eval_duration: float) -> dict:
+        return {
+            "model": model,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int((prompt_duration + eval_duration) * 1e9) + load_duration,
+            "load_duration": load_duration,
+            "prompt_eval_count": max(1, len(prompt) // 4),
+            "prompt_eval_duration": int(prompt_duration * 1e9),
+            "eval_count": args.tokens,
+            "eval_duration": int(eval_duration * 1e9),
+        }
+
+    async def generate(body: dict, prompt: str, make_chunk, make_final):
+        """
+        公共的生成流程：加载模型、等待首 token 延迟，然后按 token 速度输出。
+        """
+        model = body.get("model", models[0])
+        load_duration = await load(model)
+        tokens = reply_tokens(prompt)
+        interval = 1 / args.token_rate if args.token_rate else 0
+        if body.get("stream", True):
+            async def chunks():
+                started = time.perf_counter()
+                await asyncio.sleep(args.latency)
+                prompt_duration = time.perf_counter() - started
+                for token in tokens:
+                    yield json.dumps(make_chunk(model, token), ensure_ascii=False) + "\n"
+                    if interval:
+                        await asyncio.sleep(interval)
+                eval_duration = time.perf_counter() - started - prompt_duration
+                final = final_fields(model, prompt, load_duration, prompt_duration, eval_duration)
+                yield json.dumps(make_final(final), ensure_ascii=False) + "\n"
+            return StreamingResponse(chunks(), media_type="application/x-ndjson")
+        started = time.perf_counter()
+        await asyncio.sleep(args.latency)
+        prompt_duration = time.perf_counter() - started
+        await asyncio.sleep(interval * len(tokens))
+        eval_duration = time.perf_counter() - started - prompt_duration
+        final = final_fields(model, prompt, load_duration, prompt_duration, eval_duration)
+        return JSONResponse(make_final(final, "".join(tokens)))
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": name, "model": name} for name in models]}
+
+    @app.get("/api/ps")
+    async def ps():
+        return {"models": [{"name": name, "model": name} for name in sorted(loaded)]}
+
+    @app.post("/api/generate")
+    async def api_generate(request: Request):
+        body = await request.json()
+        error = injected_error()
+        if error is not None:
+            return error
+        prompt = body.get("prompt") or ""
+        if not prompt:
+            # 不带 prompt 的请求只加载模型（预加载）
+            model = body.get("model", models[0])
+            load_duration = await load(model)
+            return {"model": model, "response": "", "done": True, "done_reason": "load", "load_duration": load_duration}
+
+        def make_chunk(model, token):
+            return {"model": model, "response": token, "done": False}
+
+        def make_final(final, text=""):
+            return dict(final, response=text, context=list(range(final["prompt_eval_count"] + final["eval_count"])))
+
+        return await generate(body, prompt, make_chunk, make_final)
+
+    @app.post("/api/chat")
+    async def api_chat(request: Request):
+        body = await request.json()
+        error = injected_error()
+        if error is not None:
+            return error
+        prompt = "\n".join(message.get("content", "") for message in body.get("messages", []))
+
+        def make_chunk(model, token):
+            return {"model": model, "message": {"role": "assistant", "content": token}, "done": False}
+
+        def make_final(final, text=""):
+            return dict(final, message={"role": "assistant", "content": text})
+
+        return await generate(body, prompt, make_chunk, make_final)
+
+    return app
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="模拟 Ollama 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--models", default="bench:latest", help="逗号分隔的模型名称")
+    parser.add_argument("--latency", type=float, default=0.05, help="首 token 延迟（秒，模拟预填充）")
+    parser.add_argument("--token-rate", type=float, default=200, help="生成速度（tokens/s），0 表示不限速")
+    parser.add_argument("--tokens", type=int, default=50, help="每个回复的 token 数")
+    parser.add_argument("--load-delay", type=float, default=0, help="模型首次使用时的加载耗时（秒）")
+    parser.add_argument("--error-rate", type=float, default=0, help="返回 500 的请求比例（0-1）")
+    parser.add_argument("--echo", action="store_true", help="回复末尾附带 prompt 的结尾，便于检查上下文")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,449 @@
+"""
+压测脚本：启动模拟 Ollama（bench/fake_ollama.py）和使用临时 SQLite 数据库的后端，
+按场景并发发送请求，输出吞吐量和 p50/p95/p99 延迟，并把结果写入 JSON 文件便于比较不同版本
+
+场景：
+- register_login：并发注册并登录新用户（bcrypt 线程池）
+- chat：每个用户在同一对话中连续聊天，历史逐轮增长（历史查询、prompt 构建、模型调用）
+- conversations：单个用户拥有大量对话时读取对话列表和分页摘要
+- stream：大量用户同时请求流式回复，统计首 token 时间和总耗时
+
+用法：python bench/run.py --scenarios all --output bench_results.json
+"""
+# 导入所需的库
+import argparse    # 命令行参数
+import asyncio     # 并发请求
+import json        # 结果文件
+import os          # 环境变量和路径
+import socket      # 获取空闲端口
+import subprocess  # 启动模拟 Ollama 和后端
+import sys         # 当前 Python 解释器
+import tempfile    # 临时数据库目录
+import time        # 计时
+from collections import Counter  # 按状态码统计错误
+from datetime import datetime, timezone  # 结果时间戳
+from typing import Awaitable, Callable, Dict, List, Optional  # 类型注解
+import httpx       # HTTP 客户端
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+SCENARIOS = ["register_login", "chat", "conversations", "stream"]
+PASSWORD = "bench-password"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: List[float], p: float) -> float:
+    """
+    最近秩法计算百分位数（values 已排序）。
+    """
+    if not values:
+        return 0.0
+    rank = max(1, int(-(-p * len(values) // 100)))
+    return values[min(rank, len(values)) - 1]
+
+
+class Recorder:
+    """
+    记录一类请求的延迟和错误。
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: List[float] = []  # 成功请求的耗时（秒）
+        self.errors: Counter = Counter()  # 状态码（或异常类型）-> 次数
+        self.ttft: List[float] = []  # 流式请求的首 token 时间（秒）
+        self.elapsed = 0.0
+
+    def record(self, latency: float, status):
+        if isinstance(status, int) and status < 400:
+            self.latencies.append(latency)
+        else:
+            self.errors[str(status)] += 1
+
+    def summary(self) -> Dict[str, object]:
+        latencies = sorted(self.latencies)
+        total = len(latencies) + sum(self.errors.values())
+        result = {
+            "requests": total,
+            "ok": len(latencies),
+            "errors": dict(self.errors),
+            "elapsed_seconds": round(self.elapsed, 3),
+            "throughput_rps": round(len(latencies) / self.elapsed, 2) if self.elapsed else 0.0,
+            "latency_ms": distribution(latencies),
+        }
+        if self.ttft:
+            result["ttft_ms"] = distribution(sorted(self.ttft))
+        return result
+
+
+def distribution(values: List[float]) -> Dict[str, float]:
+    """
+    延迟分布（毫秒）。
+    """
+    if not values:
+        return {}
+    return {
+        "mean": round(sum(values) / len(values) * 1000, 2),
+        "p50": round(percentile(values, 50) * 1000, 2),
+        "p95": round(percentile(values, 95) * 1000, 2),
+        "p99": round(percentile(values, 99) * 1000, 2),
+        "max": round(values[-1] * 1000, 2),
+    }
+
+
+async def run_workers(total: int, concurrency: int, func: Callable[[int], Awaitable[None]]) -> float:
+    """
+    用 concurrency 个并发任务依次执行 func(0..total-1)，返回总耗时。
+    """
+    indexes = iter(range(total))
+
+    async def worker():
+        for index in indexes:
+            await func(index)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, total))))
+    return time.perf_counter() - start
+
+
+class Bench:
+    """
+    压测客户端：管理测试用户并实现各场景。
+    """
+    def __init__(self, client: httpx.AsyncClient, args: argparse.Namespace):
+        self.client = client
+        self.args = args
+        self.run_id = datetime.now().strftime("%H%M%S%f")  # 连接已有服务时避免用户名冲突
+        self.tokens: List[str] = []  # 预先注册好的用户 token，每个并发任务使用自己的用户
+
+    async def timed(self, recorder: Recorder, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            recorder.record(time.perf_counter() - start, type(e).__name__)
+            return None
+        recorder.record(time.perf_counter() - start, response.status_code)
+        return response
+
+    def user(self, prefix: str, index: int) -> Dict[str, str]:
+        name = f"{prefix}{self.run_id}_{index}"
+        return {"username": name, "email": f"{name}@example.com", "password": PASSWORD}
+
+    async def create_user(self, prefix: str, index: int) -> str:
+        """
+        注册并登录用户（场景准备，不计入结果），返回 token。
+        """
+        user = self.user(prefix, index)
+        response = await self.client.post("/register", json=user)
+        response.raise_for_status()
+        response = await self.client.post("/token", data={"username": user["username"], "password": PASSWORD})
+        response.raise_for_status()
+        return response.json()["access_token"]
+
+    async def ensure_users(self, count: int):
+        tokens = {}
+
+        async def one(index: int):
+            tokens[index] = await self.create_user("bench", index)
+
+        start = len(self.tokens)
+        await run_workers(count - start, self.args.concurrency, lambda index: one(start + index))
+        self.tokens += [tokens[index] for index in sorted(tokens)]
+
+    def auth(self, token: str) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {token}"}
+
+    async def register_login(self) -> Dict[str, Recorder]:
+        """
+        并发注册 users 个新用户，每个用户注册后立即登录。
+        """
+        register, login = Recorder("register"), Recorder("login")
+
+        async def one(index: int):
+            user = self.user("rl", index)
+            response = await self.timed(register, "POST", "/register", json=user)
+            if response is None or response.status_code >= 400:
+                return
+            await self.timed(login, "POST", "/token", data={"username": user["username"], "password": PASSWORD})
+
+        elapsed = await run_workers(self.args.users, self.args.concurrency, one)
+        register.elapsed = login.elapsed = elapsed
+        return {"register": register, "login": login}
+
+    async def chat(self) -> Dict[str, Recorder]:
+        """
+        concurrency 个用户各自在一个对话中连续发送 turns 条消息，历史逐轮增长；
+        另外按轮次统计延迟，观察延迟是否随历史长度增长。
+        """
+        await self.ensure_users(self.args.concurrency)
+        recorder = Recorder("chat")
+        by_turn: List[Recorder] = [Recorder(f"turn{turn}") for turn in range(self.args.turns)]
+
+        async def conversation(worker: int):
+            headers = self.auth(self.tokens[worker])
+            conversation_id = None
+            for turn in range(self.args.turns):
+                # 每条消息都不同，避免命中回复缓存
+                body = {"message": f"第{turn}轮：请介绍一下话题 {worker}-{turn}，" + "背景" * self.args.message_size,
+                        "conversation_id": conversation_id}
+                start = time.perf_counter()
+                response = await self.timed(recorder, "POST", "/chat", json=body, headers=headers)
+                by_turn[turn].record(time.perf_counter() - start, response.status_code if response else "error")
+                if response is not None and response.status_code < 400:
+                    conversation_id = response.json()["conversation_id"]
+
+        start = time.perf_counter()
+        await asyncio.gather(*(conversation(worker) for worker in range(self.args.concurrency)))
+        recorder.elapsed = time.perf_counter() - start
+        result = {"chat": recorder}
+        # 第一轮和最后一轮单独输出
+        for turn in {0, self.args.turns - 1}:
+            by_turn[turn].elapsed = recorder.elapsed
+            result[f"chat_turn{turn + 1}"] = by_turn[turn]
+        return result
+
+    async def conversations(self) -> Dict[str, Recorder]:
+        """
+        单个用户创建 conversations 个对话（每个对话通过计算工具快速路径写入一问一答），
+        然后并发读取完整对话列表和第一页对话摘要。
+        """
+        token = await self.create_user("conv", 0)
+        headers = self.auth(token)
+
+        async def seed(index: int):
+            response = await self.client.post("/chat", json={"message": f"{index}+1"}, headers=headers)
+            response.raise_for_status()
+
+        await run_workers(self.args.conversations, self.args.concurrency, seed)
+        full, summary = Recorder("conversations"), Recorder("conversations_summary")
+
+        async def read_full(index: int):
+            await self.timed(full, "GET", "/conversations", headers=headers)
+
+        async def read_summary(index: int):
+            await self.timed(summary, "GET", "/conversations/summary", headers=headers)
+
+        full.elapsed = await run_workers(self.args.requests, self.args.concurrency, read_full)
+        summary.elapsed = await run_workers(self.args.requests, self.args.concurrency, read_summary)
+        return {"conversations": full, "conversations_summary": summary}
+
+    async def stream(self) -> Dict[str, Recorder]:
+        """
+        streams 个用户同时请求流式回复，统计首个 delta 事件的时间和整个流的耗时。
+        """
+        await self.ensure_users(self.args.streams)
+        recorder = Recorder("stream")
+
+        async def one(index: int):
+            body = {"message": f"请写一段关于压测 {self.run_id}-{index} 的介绍"}
+            start = time.perf_counter()
+            first = None
+            try:
+                async with self.client.stream("POST", "/chat/stream", json=body,
+                                              headers=self.auth(self.tokens[index])) as response:
+                    if response.status_code >= 400:
+                        await response.aread()
+                        recorder.record(time.perf_counter() - start, response.status_code)
+                        return
+                    async for line in response.aiter_lines():
+                        if first is None and line == "event: delta":
+                            first = time.perf_counter() - start
+            except httpx.HTTPError as e:
+                recorder.record(time.perf_counter() - start, type(e).__name__)
+                return
+            recorder.record(time.perf_counter() - start, response.status_code)
+            if first is not None:
+                recorder.ttft.append(first)
+
+        recorder.elapsed = await run_workers(self.args.streams, self.args.streams, one)
+        return {"stream": recorder}
+
+    async def server_stats(self) -> Optional[dict]:
+        """
+        读取服务端的缓存和准入统计，一并写入结果文件。
+        """
+        if not self.tokens:
+            return None
+        try:
+            response = await self.client.get("/cache/stats", headers=self.auth(self.tokens[0]))
+            return response.json() if response.status_code == 200 else None
+        except httpx.HTTPError:
+            return None
+
+
+class Services:
+    """
+    启动和停止压测用的模拟 Ollama 与后端进程。
+    """
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.processes: List[subprocess.Popen] = []
+        self.tempdir = None
+
+    def start(self) -> str:
+        """
+        启动模拟 Ollama、执行数据库迁移并启动后端，返回后端地址。
+        """
+        args = self.args
+        ollama_port = free_port()
+        self.spawn([
+            sys.executable, os.path.join(BENCH_DIR, "fake_ollama.py"), "--port", str(ollama_port),
+            "--models", args.model, "--latency", str(args.latency), "--token-rate", str(args.token_rate),
+            "--tokens", str(args.tokens), "--load-delay", str(args.load_delay), "--error-rate", str(args.error_rate),
+        ], cwd=BENCH_DIR)
+
+        env = dict(os.environ)
+        env.pop("OLLAMA_BASE_URLS", None)
+        database_url = args.database_url
+        if not database_url:
+            self.tempdir = tempfile.TemporaryDirectory(prefix="aichat-bench-")
+            database_url = f"sqlite:///{os.path.join(self.tempdir.name, 'bench.db')}"
+        env.update({
+            "DATABASE_URL": database_url,
+            "SECRET_KEY": "bench-secret",
+            "ALGORITHM": "HS256",
+            "ACCESS_TOKEN_EXPIRE_MINUTES": "60",
+            "OLLAMA_BASE_URL": f"http://127.0.0.1:{ollama_port}",
+            "OLLAMA_MODEL": args.model,
+        })
+        if args.bcrypt_rounds:
+            env["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+        for item in args.env:
+            key, _, value = item.partition("=")
+            env[key] = value
+        subprocess.run([sys.executable, "-m", "alembic", "upgrade", "head"], cwd=BACKEND_DIR, env=env,
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        port = free_port()
+        self.spawn([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+                    "--workers", str(args.workers), "--log-level", "warning"], cwd=BACKEND_DIR, env=env)
+        return f"http://127.0.0.1:{port}"
+
+    def spawn(self, command: List[str], cwd: str, env: Dict[str, str] = None):
+        self.processes.append(subprocess.Popen(command, cwd=cwd, env=env))
+
+    def stop(self):
+        for process in reversed(self.processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if self.tempdir is not None:
+            self.tempdir.cleanup()
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float = 60):
+    """
+    等待后端启动且模型已加载（/ai/status）。
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = await client.get("/ai/status")
+            status = response.json()
+            if status["connected"] and status["model_loaded"]:
+                return
+        except (httpx.HTTPError, ValueError, KeyError):
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("后端在超时时间内没有就绪")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(results: Dict[str, dict]):
+    header = f"{'operation':<24}{'ok':>8}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    print(header)
+    print("-" * len(header))
+    for scenario in results.values():
+        for name, item in scenario.items():
+            latency = item["latency_ms"] or {}
+            print(f"{name:<24}{item['ok']:>8}{sum(item['errors'].values()):>8}{item['throughput_rps']:>10}"
+                  f"{latency.get('p50', 0):>10}{latency.get('p95', 0):>10}{latency.get('p99', 0):>10}")
+            if "ttft_ms" in item:
+                ttft = item["ttft_ms"]
+                print(f"{'  ttft':<24}{'':>8}{'':>8}{'':>10}{ttft['p50']:>10}{ttft['p95']:>10}{ttft['p99']:>10}")
+
+
+async def run(args: argparse.Namespace) -> dict:
+    scenarios = SCENARIOS if args.scenarios == "all" else args.scenarios.split(",")
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"未知场景: {', '.join(sorted(unknown))}")
+    services = None
+    url = args.url
+    if not url:
+        services = Services(args)
+        url = services.start()
+    try:
+        timeout = httpx.Timeout(args.timeout)
+        limits = httpx.Limits(max_connections=max(args.concurrency, args.streams) + 10)
+        async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+            await wait_ready(client)
+            bench = Bench(client, args)
+            results = {}
+            for name in scenarios:
+                print(f"运行场景 {name} ...", flush=True)
+                recorders = await getattr(bench, name)()
+                results[name] = {key: recorder.summary() for key, recorder in recorders.items()}
+            stats = await bench.server_stats()
+    finally:
+        if services is not None:
+            services.stop()
+    return {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "config": vars(args),
+        "results": results,
+        "server_stats": stats,
+    }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="AI Chat 后端压测")
+    parser.add_argument("--scenarios", default="all", help=f"逗号分隔的场景（{', '.join(SCENARIOS)}）或 all")
+    parser.add_argument("--output", default="bench_results.json", help="JSON 结果文件路径")
+    parser.add_argument("--url", help="压测已运行的后端（不启动模拟 Ollama 和后端）")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发数（chat 场景为并发用户数）")
+    parser.add_argument("--users", type=int, default=20, help="register_login 场景注册的用户数")
+    parser.add_argument("--turns", type=int, default=10, help="chat 场景每个对话的轮数")
+    parser.add_argument("--message-size", type=int, default=20, help="chat 场景每条消息附加的填充长度")
+    parser.add_argument("--conversations", type=int, default=100, help="conversations 场景创建的对话数")
+    parser.add_argument("--requests", type=int, default=100, help="conversations 场景每个接口的请求数")
+    parser.add_argument("--streams", type=int, default=16, help="stream 场景同时进行的流式请求数")
+    parser.add_argument("--timeout", type=float, default=120, help="单个请求的超时秒数")
+    # 以下参数只在自动启动服务时生效
+    parser.add_argument("--database-url", help="数据库连接字符串，默认使用临时 SQLite 文件")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn 进程数")
+    parser.add_argument("--bcrypt-rounds", type=int, help="覆盖 BCRYPT_ROUNDS")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="传给后端的额外环境变量，可重复")
+    parser.add_argument("--model", default="bench:latest", help="模拟的模型名称")
+    parser.add_argument("--latency", type=float, default=0.05, help="模拟 Ollama 的首 token 延迟（秒）")
+    parser.add_argument("--token-rate", type=float, default=200, help="模拟 Ollama 的生成速度（tokens/s）")
+    parser.add_argument("--tokens", type=int, default=50, help="模拟 Ollama 每个回复的 token 数")
+    parser.add_argument("--load-delay", type=float, default=0, help="模拟 Ollama 的模型加载耗时（秒）")
+    parser.add_argument("--error-rate", type=float, default=0, help="模拟 Ollama 返回 500 的比例")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = asyncio.run(run(args))
+    print()
+    print_table(report["results"])
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已写入 {args.output}")